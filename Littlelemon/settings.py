@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +47,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'LittlelemonAPI.middleware.InstrumentationMiddleware',
+    'LittlelemonAPI.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,13 +81,68 @@ WSGI_APPLICATION = 'Littlelemon.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Pick a profile with the LITTLELEMON_DB_PROFILE environment variable: 'sqlite' (default) or
+# 'postgresql'.
+DB_PROFILE = os.environ.get('LITTLELEMON_DB_PROFILE', 'sqlite')
+
+if DB_PROFILE == 'postgresql':
+    # Connections come from a psycopg pool (needs psycopg[pool]); pooling replaces CONN_MAX_AGE.
+    POSTGRESQL = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'littlelemon'),
+        'USER': os.environ.get('POSTGRES_USER', 'littlelemon'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10)),
+                'timeout': 10,
+            },
+        },
     }
+    DATABASES = {'default': POSTGRESQL}
+    # Read replicas, e.g. POSTGRES_REPLICA_HOSTS=replica1,replica2. Tests read them through default.
+    for index, host in enumerate(filter(None, os.environ.get('POSTGRES_REPLICA_HOSTS', '').split(','))):
+        DATABASES[f'replica{index + 1}'] = {**POSTGRESQL, 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # Persistent connections, checked before reuse; the pragmas below are set per connection.
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Take the write lock when a transaction starts, so writers queue on busy_timeout
+                # instead of failing when they upgrade from a read lock.
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+# Journal mode of the SQLite database. It is stored in the database file, so it is set once by
+# migration 0014 rather than per connection. WAL lets reads proceed while a write is in progress.
+LITTLELEMON_SQLITE_JOURNAL_MODE = 'WAL'
+
+# Applied to every new SQLite connection (see LittlelemonAPI/db.py). None of them is stored in the
+# database file. synchronous=NORMAL is durable across application crashes in WAL mode.
+LITTLELEMON_SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 128 * 2 ** 20,
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
 }
 
+# GET requests to the menu, category and order views read from these aliases, see
+# LittlelemonAPI/routers.py. Writes always go to default.
+LITTLELEMON_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+DATABASE_ROUTERS = ['LittlelemonAPI.routers.ReadReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -128,14 +187,19 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
+        'LittlelemonAPI.renderers.FastJSONRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'LittlelemonAPI.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'LittlelemonAPI.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': [
+        'LittlelemonAPI.filters.DeclarativeFilterBackend',
         'rest_framework.filters.OrderingFilter',
         'rest_framework.filters.SearchFilter',
     ],
@@ -143,13 +207,122 @@ REST_FRAMEWORK = {
     'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 3,
 
-    # 'DEFAULT_THROTTLE_CLASSES': [
-    #     'rest_framework.throttling.AnonRateThrottle',
-    #     'rest_framework.throttling.UserRateThrottle',
-    # ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'LittlelemonAPI.throttling.GCRAThrottle',
+    ],
+}
+
+# MessagePack for the internal POS clients, when the msgpack package is installed.
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('LittlelemonAPI.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('LittlelemonAPI.parsers.MessagePackParser')
+
+# The browsable API is a development tool only.
+if DEBUG:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('rest_framework.renderers.BrowsableAPIRenderer')
+
+# Rendered menu/category pages. Use 'LittlelemonAPI.catalogue.DjangoCatalogueBackend' with a
+# shared cache (e.g. Redis or Memcached) when running several workers.
+LITTLELEMON_CATALOGUE_CACHE = {
+    'BACKEND': 'LittlelemonAPI.catalogue.LocalCatalogueBackend',
+    'OPTIONS': {
+        'maxsize': 512,
+    },
+}
 
-    # 'DEFAULT_THROTTLE_RATES': {
-    #     'anon': '2/minute',
-    #     'user': '10/minute'
-    # }
-}
\ No newline at end of file
+# Render read-only list responses of flat serializers from .values() rows instead of model
+# instances. The JSON output is identical; validation and writes still use DRF serializers.
+LITTLELEMON_COMPILED_SERIALIZERS = True
+
+# Serve the menu, category, cart and order read endpoints with native async views (async ORM and
+# token lookup) instead of running the sync views in a thread. Only useful under ASGI.
+LITTLELEMON_ASYNC_VIEWS = False
+
+# User id -> role (group name) cache, per process. Group changes made in this process invalidate it at
+# once; changes made in other processes are noticed after at most TIMEOUT seconds. Token snapshots
+# (LITTLELEMON_TOKEN_CACHE) copy the cached roles, so for token-authenticated requests a role change
+# made elsewhere can take up to TIMEOUT plus the token cache's TIMEOUT to show.
+LITTLELEMON_ROLE_CACHE = {
+    'MAXSIZE': 10000,
+    'TIMEOUT': 300,
+}
+
+# Token key -> user snapshot cache of CachedTokenAuthentication, per process. TIMEOUT bounds how
+# long changes made without signals (e.g. bulk updates) or in other processes go unnoticed; unknown
+# keys are remembered for NEGATIVE_TIMEOUT. METRICS is an optional dotted path to a callable that
+# receives 'hit', 'negative_hit' or 'miss' for every lookup.
+LITTLELEMON_TOKEN_CACHE = {
+    'MAXSIZE': 10000,
+    'TIMEOUT': 300,
+    'NEGATIVE_TIMEOUT': 60,
+    'METRICS': None,
+}
+
+# Order change feed (/api/cart/orders/changes). Waiting subscribers are woken by changes made in
+# this process at once, and by changes from other processes within POLL_INTERVAL seconds, which is
+# also the reconnect delay of event streams under WSGI. Streams send a comment every HEARTBEAT
+# seconds and end after STREAM_TIMEOUT; long polls wait at most MAX_WAIT seconds.
+LITTLELEMON_CHANGE_FEED = {
+    'POLL_INTERVAL': 2,
+    'HEARTBEAT': 15,
+    'MAX_WAIT': 30,
+    'STREAM_TIMEOUT': 300,
+    'BATCH_SIZE': 100,
+}
+
+# Request metrics, exposed at /api/metrics. SAMPLE_RATE is the share of requests measured (sampling
+# every request adds 1-5% to the cheapest endpoints, see `benchmark metrics`); sampled requests slower
+# than SLOW_REQUEST_SECONDS are logged with their SQL to the 'littlelemon.slow_requests' logger.
+LITTLELEMON_METRICS = {
+    'SAMPLE_RATE': 1.0,
+    'SLOW_REQUEST_SECONDS': 1.0,
+}
+
+# Rate limits per user (per address for anonymous requests) and scope, as '<count>/<period>' or
+# {'rate': ..., 'burst': n}; see LittlelemonAPI/throttling.py. The local backend limits each worker
+# on its own. With several workers use 'LittlelemonAPI.throttling.RedisThrottleBackend' on a Redis
+# cache alias, or 'LittlelemonAPI.throttling.CacheThrottleBackend' on any other shared cache.
+LITTLELEMON_THROTTLING = {
+    'ENABLED': True,
+    'BACKEND': 'LittlelemonAPI.throttling.LocalThrottleBackend',
+    'OPTIONS': {
+        'maxsize': 100000,
+    },
+    'RATES': {
+        'default': '300/min',
+        'catalogue': '1200/min',
+        'cart': '120/min',
+        'orders': {'rate': '30/min', 'burst': 10},
+        'dispatch': '120/min',
+        'export': '30/hour',
+    },
+}
+
+# Daily sales rollups behind /api/analytics, see LittlelemonAPI/rollups.py. With REFRESH_ON_READ the
+# endpoints recompute the days that order writes marked out of date before answering; otherwise run
+# `manage.py update_rollups` periodically. The command refreshes BATCH_DAYS days per transaction.
+# TOP_ITEMS is the default ?limit of /api/analytics/menu-items.
+LITTLELEMON_ROLLUPS = {
+    'REFRESH_ON_READ': True,
+    'BATCH_DAYS': 31,
+    'TOP_ITEMS': 10,
+}
+
+# Data lifecycle, see LittlelemonAPI/lifecycle.py. `manage.py archive_orders` moves delivered orders
+# older than ARCHIVE_AFTER_DAYS days to the archive tables (read at /api/cart/orders/archive);
+# `manage.py expire_carts` deletes carts untouched for CART_EXPIRY_DAYS days. Both work in
+# transactions of BATCH_SIZE orders or users; run them periodically, e.g. nightly from cron.
+LITTLELEMON_LIFECYCLE = {
+    'ARCHIVE_AFTER_DAYS': 180,
+    'CART_EXPIRY_DAYS': 30,
+    'BATCH_SIZE': 1000,
+}
+
+# Response compression: brotli and zstd are used when the brotli/zstandard packages are installed,
+# gzip always. Bodies smaller than MIN_SIZE bytes are not worth compressing.
+LITTLELEMON_COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    'ZSTD_LEVEL': 3,
+}
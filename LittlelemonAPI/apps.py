@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class LittlelemonapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'LittlelemonAPI'
+
+    def ready(self):
+        # Connect the cache invalidation and connection setup signal handlers.
+        from . import roles, catalogue, authentication, db, changes, metrics, rollups  # noqa: F401
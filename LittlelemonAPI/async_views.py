@@ -0,0 +1,313 @@
+"""
+Native async versions of the read-heavy endpoints, used instead of the sync views when
+`LITTLELEMON_ASYNC_VIEWS` is on and the project is served over ASGI. The URLconf routes those
+endpoints with `read_path`, which picks the view per request, so the setting can change at runtime.
+
+Each view wraps the sync DRF view it replaces and reuses its queryset, filters, permissions,
+pagination and serializers, which do no I/O of their own. Only the queries run through the async
+ORM. Writes, cursor pagination, full-text search and non-JSON formats are handed to the sync view.
+
+The order change feed has no sync counterpart and is always served from here.
+"""
+import asyncio
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls.resolvers import RoutePattern, URLPattern
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, ParseError
+from rest_framework.request import Request
+
+from . import catalogue, changes, metrics, roles, routers, throttling, views
+from .authentication import aauthenticate
+from .compiled import CompiledReadMixin
+from .conditional import evaluate, set_validators
+from .pagination import apaginate_queryset
+from .renderers import FastJSONRenderer
+from .serializers import OrderChangeSerializer
+
+# Query parameters whose handling needs the sync path.
+SYNC_PARAMS = ('cursor', 'search', 'format')
+JSON_MEDIA_TYPES = ('', '*/*', 'application/json')
+
+
+def serves_natively(request):
+    """True for GET requests the async path answers exactly like the sync view would."""
+    if request.method != 'GET' or any(param in request.GET for param in SYNC_PARAMS):
+        return False
+    accept = request.headers.get('Accept', '')
+    return all(media_type.strip() in JSON_MEDIA_TYPES for media_type in accept.split(','))
+
+
+# The `AsyncReadView` class answers GET requests natively and hands everything else to the sync
+# `sync_view_class`. Subclasses implement `respond(view, request)`, where `view` is an instance of
+# the sync view bound to a DRF request.
+class AsyncReadView(View):
+    sync_view_class = None
+    sync_view = None
+    renderer = FastJSONRenderer()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        sync_view = sync_to_async(cls.sync_view_class.as_view())
+        # Like DRF views, CSRF is enforced by session authentication only.
+        return csrf_exempt(super().as_view(sync_view=sync_view, **initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not serves_natively(request):
+            return await self.sync_view(request, *args, **kwargs)
+        return await self.get(request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        drf_request = Request(request)
+        drf_request.accepted_renderer = self.renderer
+        drf_request.accepted_media_type = self.renderer.media_type
+        view = self.sync_view_class(format_kwarg=None)
+        # Like `as_view()`, which also answers HEAD with GET and so lists it in the Allow header.
+        view.setup(drf_request, *args, **kwargs)
+        view.headers = view.default_response_headers
+        replica = issubclass(self.sync_view_class, views.ReplicaReadMixin)
+        try:
+            with routers.replica_reads() if replica else nullcontext():
+                drf_request.user = await aauthenticate(request) or AnonymousUser()
+                if not drf_request.user.is_authenticated:
+                    raise NotAuthenticated()
+                # Warms the per-request role memo, so role checks in the sync code do no queries.
+                await roles.aget_roles(drf_request.user)
+                view.check_permissions(drf_request)
+                await self.check_throttles(view, drf_request)
+                response = await self.respond(view, drf_request)
+        except Exception as exc:
+            response = view.finalize_response(drf_request, view.handle_exception(exc))
+            # Rendered here, since Django would render a DRF response in a worker thread.
+            response.render()
+            response = HttpResponse(response.content, status=response.status_code, headers=response.headers)
+        for key, value in view.headers.items():
+            response[key] = value
+        return response
+
+    async def check_throttles(self, view, request):
+        """`view.check_throttles`, in a worker thread unless every throttle is answered in process."""
+        if getattr(throttling.get_backend(), 'in_process', False) and \
+                all(issubclass(throttle, throttling.GCRAThrottle) for throttle in view.throttle_classes):
+            view.check_throttles(request)
+        else:
+            await sync_to_async(view.check_throttles)(request)
+
+    async def list_data(self, view, request):
+        """The data `view.list()` would return, read with the async ORM."""
+        queryset = view.filter_queryset(view.get_queryset())
+        compiled = view.get_compiled_serializer() if isinstance(view, CompiledReadMixin) else None
+        if compiled is not None:
+            queryset = view.compiled_values(compiled, queryset)
+        paginator = view.paginator
+        page = None
+        if paginator is not None:
+            page = await apaginate_queryset(paginator, queryset, request)
+        objects = page if page is not None else [obj async for obj in queryset]
+        if compiled is not None:
+            data = compiled.render_many(objects)
+        else:
+            with metrics.serializing():
+                data = view.get_serializer(objects, many=True).data
+        if page is None:
+            return data
+        return paginator.get_paginated_response(data).data
+
+    def render(self, data):
+        return HttpResponse(self.renderer.render(data), content_type=self.renderer.media_type)
+
+
+# The `AsyncListView` class lists like `ListAPIView.list`.
+class AsyncListView(AsyncReadView):
+    async def respond(self, view, request):
+        return self.render(await self.list_data(view, request))
+
+
+# The `AsyncRetrieveView` class returns one object like `RetrieveAPIView.retrieve`.
+class AsyncRetrieveView(AsyncReadView):
+    async def respond(self, view, request):
+        queryset = view.filter_queryset(view.get_queryset())
+        lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+        instance = await queryset.filter(**{view.lookup_field: view.kwargs[lookup_url_kwarg]}).afirst()
+        if instance is None:
+            raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+        view.check_object_permissions(request, instance)
+        with metrics.serializing():
+            data = view.get_serializer(instance).data
+        return self.render(data)
+
+
+# The `AsyncCatalogueListView` class adds the conditional GET and rendered-page cache of the sync
+# catalogue views. Both share the catalogue cache, so pages rendered by one are served by the other.
+class AsyncCatalogueListView(AsyncReadView):
+    async def respond(self, view, request):
+        etag, timestamp, response = evaluate(request, await view.aget_validator())
+        if response is None:
+            backend = catalogue.get_backend()
+            key = catalogue.make_key(view.cache_namespace, await backend.aget_version(), request)
+            body = await backend.aget(key)
+            if body is None:
+                body = self.renderer.render(await self.list_data(view, request))
+                await backend.aset(key, body)
+            response = HttpResponse(body, content_type=self.renderer.media_type)
+            response.catalogue_key = key
+        return set_validators(response, etag, timestamp)
+
+
+class MenuItemView(AsyncCatalogueListView):
+    sync_view_class = views.MenuItemView
+
+
+class CategoryListView(AsyncCatalogueListView):
+    sync_view_class = views.CategoryListView
+
+
+class CartView(AsyncListView):
+    sync_view_class = views.CartView
+
+
+class OrderView(AsyncListView):
+    sync_view_class = views.OrderView
+
+
+class SingleOrderView(AsyncRetrieveView):
+    sync_view_class = views.SingleOrderView
+
+
+# The `ReadViewPattern` class is a URL pattern of an `AsyncReadView` that resolves to it while
+# `LITTLELEMON_ASYNC_VIEWS` is on and to its sync view otherwise. The choice is made per request but
+# at resolution, so neither handler pays a thread or event loop hop to reach the view it runs.
+class ReadViewPattern(URLPattern):
+    @property
+    def callback(self):
+        return self.async_callback if getattr(settings, 'LITTLELEMON_ASYNC_VIEWS', False) else self.sync_callback
+
+    @callback.setter
+    def callback(self, view):
+        self.async_callback = view
+        self.sync_callback = view.view_class.sync_view_class.as_view()
+
+
+def read_path(route, view_class):
+    """Like `path(route, view_class.as_view())` for an `AsyncReadView`, see `ReadViewPattern`."""
+    return ReadViewPattern(RoutePattern(route, is_endpoint=True), view_class.as_view())
+
+
+# The `OrderChangeFeedView` class sends the changes of the orders the user may see after a cursor:
+# `?after=<change id>`, or the Last-Event-ID header of a reconnecting EventSource. Without one the
+# feed starts at the newest change. Clients accepting text/event-stream get Server-Sent Events,
+# others a JSON page with the next cursor, which waits up to `?wait=<seconds>` for a change.
+#
+# Under ASGI waiting subscribers are parked on `changes.notifier` and cost no queries until a change
+# concerns them. Under WSGI the view never holds a worker: it answers at once, and event streams end
+# after one batch with a retry hint, so EventSource polls. Configured with `LITTLELEMON_CHANGE_FEED`.
+class OrderChangeFeedView(View):
+    renderer = FastJSONRenderer()
+
+    async def get(self, request):
+        config = changes.get_config()
+        try:
+            user = await aauthenticate(request)
+            if user is None:
+                raise NotAuthenticated()
+            cursor = self.get_cursor(request)
+            wait = self.get_wait(request, config)
+        except APIException as exc:
+            return self.error(exc)
+        await roles.aget_roles(user)
+        if cursor is None:
+            cursor = await changes.alatest_id()
+        held = isinstance(request, ASGIRequest)
+
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            if held:
+                response = StreamingHttpResponse(self.stream(user, cursor, config), content_type='text/event-stream')
+            else:
+                found = await self.fetch(user, cursor, config['BATCH_SIZE'])
+                body = self.preamble(cursor, config) + b''.join(self.event(change) for change in found)
+                response = HttpResponse(body, content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            # Keeps nginx from buffering the stream.
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        found = await self.poll(user, cursor, wait if held else 0, config['BATCH_SIZE'])
+        return HttpResponse(self.renderer.render({
+            'cursor': found[-1].pk if found else cursor,
+            'results': OrderChangeSerializer(found, many=True).data,
+        }), content_type=self.renderer.media_type)
+
+    def get_cursor(self, request):
+        value = request.GET.get('after') or request.headers.get('Last-Event-ID')
+        if not value:
+            return None
+        try:
+            cursor = int(value)
+        except ValueError:
+            cursor = -1
+        if cursor < 0:
+            raise ParseError('Invalid cursor.')
+        return cursor
+
+    def get_wait(self, request, config):
+        try:
+            wait = float(request.GET.get('wait', 0))
+        except ValueError:
+            raise ParseError('Invalid wait.')
+        return min(max(wait, 0), config['MAX_WAIT'])
+
+    def error(self, exc):
+        response = HttpResponse(self.renderer.render({'detail': exc.detail}), status=exc.status_code,
+                                content_type=self.renderer.media_type)
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+            response['WWW-Authenticate'] = 'Token'
+        return response
+
+    async def fetch(self, user, cursor, limit):
+        return [change async for change in changes.visible(user).filter(id__gt=cursor)[:limit]]
+
+    async def poll(self, user, cursor, wait, limit):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        key = changes.subscriber_key(user)
+        while True:
+            checked = changes.notifier.last_id
+            found = await self.fetch(user, cursor, limit)
+            remaining = deadline - loop.time()
+            if found or remaining <= 0:
+                return found
+            await changes.notifier.wait(key, checked, remaining)
+
+    async def stream(self, user, cursor, config):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config['STREAM_TIMEOUT']
+        key = changes.subscriber_key(user)
+        yield self.preamble(cursor, config)
+        while (remaining := deadline - loop.time()) > 0:
+            checked = changes.notifier.last_id
+            found = await self.fetch(user, cursor, config['BATCH_SIZE'])
+            for change in found:
+                yield self.event(change)
+            if found:
+                cursor = found[-1].pk
+            if len(found) == config['BATCH_SIZE']:
+                continue
+            if not await changes.notifier.wait(key, checked, min(config['HEARTBEAT'], remaining)):
+                # Comments keep proxies from closing the idle connection.
+                yield b': keep-alive\n\n'
+
+    def preamble(self, cursor, config):
+        # An event without data is not dispatched, but its id becomes the Last-Event-ID sent on
+        # reconnect, so a client that saw no change yet resumes from here.
+        return f'retry: {int(config["POLL_INTERVAL"] * 1000)}\nid: {cursor}\n\n'.encode()
+
+    def event(self, change):
+        data = self.renderer.render(OrderChangeSerializer(change).data)
+        return b'id: %d\nevent: order\ndata: %s\n\n' % (change.pk, data)
@@ -0,0 +1,273 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.db import router
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from . import roles
+from .cache import TTLCache
+
+# Loaded user fields, in `User` field order as `Model.from_db` expects.
+SNAPSHOT_FIELDS = ('id', 'is_superuser', 'username', 'is_staff', 'is_active')
+
+# Negative cache entry for keys that match no token.
+INVALID = object()
+
+
+# The `AsyncTokenAuthentication` class is DRF's `TokenAuthentication` with an async lookup for the
+# native async views. The sync methods are inherited unchanged, and so are the error messages.
+class AsyncTokenAuthentication(TokenAuthentication):
+    def get_key(self, request):
+        """The token key sent in the Authorization header, or None when no token is sent."""
+        auth = get_authorization_header(request).split()
+
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain spaces.'))
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                _('Invalid token header. Token string should not contain invalid characters.'))
+
+    async def aauthenticate(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        model = self.get_model()
+        try:
+            token = await model.objects.select_related('user').aget(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
+
+
+# The `UserSnapshot` class is what the token cache keeps per key: the user's id, flags and group ids.
+# `generation` is the cache generation read before the snapshot's queries ran.
+class UserSnapshot(namedtuple('UserSnapshot', SNAPSHOT_FIELDS + ('group_ids', 'generation'))):
+    def to_user(self):
+        """A `User` with only the snapshot fields loaded; the others are loaded if accessed."""
+        return User.from_db(router.db_for_read(User), SNAPSHOT_FIELDS, self[:len(SNAPSHOT_FIELDS)])
+
+
+# The `TokenCache` class maps token keys to `UserSnapshot`s, or to `INVALID` for keys that matched
+# no token, in a TTL-bounded LRU. Invalidating a user records the next cache generation for them,
+# which retires every snapshot of theirs read at an earlier one. The per-user generations are kept
+# for the `maxsize` most recently invalidated users; evicting one raises the floor every snapshot
+# must reach, so an evicted user's stale snapshots cannot come back. Lookups are counted and
+# reported to the optional `metrics` hook.
+class TokenCache:
+    def __init__(self, maxsize=10000, timeout=300, negative_timeout=60, metrics=None):
+        self._entries = TTLCache(maxsize=maxsize, timeout=timeout)
+        self.maxsize = maxsize
+        self.negative_timeout = negative_timeout
+        self.metrics = metrics
+        self._generation = 0
+        self._floor = 0
+        self._generations = OrderedDict()
+        self._counts = {'hit': 0, 'negative_hit': 0, 'miss': 0}
+        self._lock = Lock()
+
+    def _record(self, outcome):
+        with self._lock:
+            self._counts[outcome] += 1
+        if self.metrics is not None:
+            self.metrics(outcome)
+
+    def _is_current(self, snapshot):
+        with self._lock:
+            return snapshot.generation >= self._generations.get(snapshot.id, self._floor)
+
+    def get(self, key):
+        """The snapshot or `INVALID` cached for `key`, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is INVALID:
+            self._record('negative_hit')
+            return entry
+        if entry is not None and self._is_current(entry):
+            self._record('hit')
+            return entry
+        self._record('miss')
+        return None
+
+    def generation(self):
+        """The current generation; read it before the queries whose results are passed to `set`."""
+        return self._generation
+
+    def set(self, key, user, group_ids, generation):
+        """
+        Cache a snapshot of `user` read at `generation`. Returns it, also when it is already stale
+        because the user was invalidated since, in which case it is not cached.
+        """
+        snapshot = UserSnapshot(*(getattr(user, field) for field in SNAPSHOT_FIELDS),
+                                group_ids=group_ids, generation=generation)
+        if self._is_current(snapshot):
+            self._entries.set(key, snapshot)
+        return snapshot
+
+    def set_invalid(self, key):
+        self._entries.set(key, INVALID, timeout=self.negative_timeout)
+
+    def delete(self, key):
+        self._entries.delete(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._generations[user_id] = self._generation
+            self._generations.move_to_end(user_id)
+            while len(self._generations) > self.maxsize:
+                self._floor = max(self._floor, self._generations.popitem(last=False)[1])
+
+    def clear(self):
+        # Snapshots read before the clear are retired too, in case they are set after it.
+        with self._lock:
+            self._generation += 1
+            self._floor = self._generation
+            self._generations.clear()
+        self._entries.clear()
+
+    def stats(self):
+        """Lookup counts and the share of lookups answered without a query."""
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        counts['hit_rate'] = (counts['hit'] + counts['negative_hit']) / total if total else 0.0
+        return counts
+
+
+_token_cache = None
+
+
+def get_token_cache():
+    """Return the process-wide token cache, see `LITTLELEMON_TOKEN_CACHE` in settings."""
+    global _token_cache
+    if _token_cache is None:
+        config = getattr(settings, 'LITTLELEMON_TOKEN_CACHE', {})
+        metrics = config.get('METRICS')
+        _token_cache = TokenCache(
+            maxsize=config.get('MAXSIZE', 10000),
+            timeout=config.get('TIMEOUT', 300),
+            negative_timeout=config.get('NEGATIVE_TIMEOUT', 60),
+            metrics=import_string(metrics) if isinstance(metrics, str) else metrics,
+        )
+    return _token_cache
+
+
+def reset_token_cache():
+    global _token_cache
+    _token_cache = None
+
+
+# The `CachedTokenAuthentication` class answers repeated token lookups from the token cache, without
+# the token/user join or the role query. The request user is built from the snapshot with its roles
+# memoized; unknown keys are cached too, so scanning with made-up tokens costs one query per key.
+class CachedTokenAuthentication(AsyncTokenAuthentication):
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        snapshot = cache.get(key)
+        if snapshot is None:
+            generation = cache.generation()
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                cache.set_invalid(key)
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            user = token.user
+            group_ids = roles.get_group_ids(user) if user.is_active else frozenset()
+            snapshot = cache.set(key, user, group_ids, generation)
+        return self.credentials(key, snapshot)
+
+    async def aauthenticate_credentials(self, key):
+        cache = get_token_cache()
+        snapshot = cache.get(key)
+        if snapshot is None:
+            generation = cache.generation()
+            model = self.get_model()
+            try:
+                token = await model.objects.select_related('user').aget(key=key)
+            except model.DoesNotExist:
+                cache.set_invalid(key)
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            user = token.user
+            group_ids = await roles.aget_group_ids(user) if user.is_active else frozenset()
+            snapshot = cache.set(key, user, group_ids, generation)
+        return self.credentials(key, snapshot)
+
+    def credentials(self, key, snapshot):
+        if snapshot is INVALID:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not snapshot.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        user = snapshot.to_user()
+        roles.prime(user, snapshot.group_ids)
+        return (user, self.get_model()(key=key, user=user))
+
+
+async def aauthenticate(request):
+    """
+    Return the user of a plain Django `request` the way the configured authentication classes would
+    (token first, then session), or None for anonymous requests.
+    """
+    result = await CachedTokenAuthentication().aauthenticate(request)
+    if result is not None:
+        return result[0]
+    user = await request.auser()
+    return user if user.is_active else None
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def _token_changed(sender, instance, **kwargs):
+    # Also drops a negative entry when a token is created with that key.
+    get_token_cache().delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _user_changed(sender, instance, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which snapshots do not hold. Bulk `.update()` calls send
+    # no signal; the TTL bounds how long such changes go unnoticed.
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    get_token_cache().invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def _user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    cache = get_token_cache()
+    if not reverse:
+        cache.invalidate_user(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            cache.invalidate_user(user_id)
+    else:
+        cache.clear()
+
+
+@receiver(post_delete, sender=Group)
+def _group_deleted(sender, **kwargs):
+    # Memberships are removed by a cascade that sends no m2m_changed.
+    get_token_cache().clear()
@@ -0,0 +1,940 @@
+"""
+In-process benchmark scenarios, run with `python manage.py benchmark [scenario ...]`.
+
+Each scenario receives the options of the command and returns a list of result rows. Scenarios
+run against a throwaway test database, never against the configured one.
+"""
+import asyncio
+import json
+import platform
+import shutil
+import tempfile
+from base64 import urlsafe_b64encode
+from datetime import date, timedelta
+from statistics import mean, median, quantiles
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, process_time
+from unittest import mock
+import tracemalloc
+
+from asgiref.sync import async_to_sync, sync_to_async
+import django
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Count, Q, Sum
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.throttling import UserRateThrottle
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .models import *
+from . import roles, catalogue, exports, authentication, changes, deliveries, synthetic, throttling, views, rollups, lifecycle
+from .compiled import compile_serializer
+from .serializers import MenuItemSerializer, CategorySerializer, OrderSerializer
+from .renderers import FastJSONRenderer, MessagePackRenderer, msgpack, orjson
+from .compression import available_codecs
+
+SCENARIOS = {}
+
+# Row fields compared against a baseline, and whether a higher value is the better one.
+GATED = {'p50_ms': False, 'p95_ms': False, 'req_per_s': True, 'renders_per_s': True}
+# Latency changes below this many milliseconds are noise, whatever the tolerance.
+MIN_DELTA_MS = 0.2
+
+
+def scenario(name, atomic=True):
+    """
+    Register a scenario. Scenarios run in a transaction that is rolled back afterwards, unless
+    `atomic` is False: those see committed rows from other connections, and the database is flushed
+    after them instead.
+    """
+    def register(func):
+        func.atomic = atomic
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def measure(label, func, iterations, setup=None, warmup=0):
+    """
+    Call `func` `iterations` times and return timing and query-count statistics, after `warmup`
+    untimed calls that fill caches and pools.
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        func()
+    timings = []
+    queries = 0
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as ctx:
+            start = perf_counter()
+            func()
+            timings.append(perf_counter() - start)
+        queries += len(ctx.captured_queries)
+    timings.sort()
+    cuts = quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+    return {
+        'label': label,
+        'iterations': iterations,
+        'mean_ms': mean(timings) * 1000,
+        'p50_ms': cuts[49] * 1000,
+        'p95_ms': cuts[94] * 1000,
+        'p99_ms': cuts[98] * 1000,
+        'queries': queries / iterations,
+    }
+
+
+def summarize(label, timings, elapsed):
+    """Throughput and latency percentiles of concurrently sent requests."""
+    timings.sort()
+    cuts = quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+    return {
+        'label': label,
+        'requests': len(timings),
+        'req_per_s': len(timings) / elapsed,
+        'p50_ms': cuts[49] * 1000,
+        'p95_ms': cuts[94] * 1000,
+        'p99_ms': cuts[98] * 1000,
+    }
+
+
+def make_client(username='bench'):
+    user, _ = User.objects.get_or_create(username=username)
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def make_manager(username='bench-manager'):
+    user = User.objects.create(username=username)
+    user.groups.add(Group.objects.get_or_create(name=roles.MANAGER)[0])
+    return user
+
+
+def make_orders(user, count, batch_size=10000):
+    start = date(2020, 1, 1)
+    for offset in range(0, count, batch_size):
+        Order.objects.bulk_create(
+            Order(user=user, total=i % 50 + 1, date=start + timedelta(days=i // 500))
+            for i in range(offset, min(offset + batch_size, count))
+        )
+
+
+def make_menu(count):
+    category = Category.objects.create(slug='bench', title='Bench')
+    MenuItem.objects.bulk_create(
+        MenuItem(title=f'Item {i}', price=i % 100 + 1, featured=i % 7 == 0, category=category)
+        for i in range(count)
+    )
+    return category
+
+
+def reset_caches():
+    roles.clear()
+    catalogue.reset_backend()
+    authentication.reset_token_cache()
+    throttling.reset_backend()
+
+
+@scenario('conditional')
+def conditional(options):
+    """Full catalogue GET versus a revalidation answered with 304 Not Modified."""
+    reset_caches()
+    make_menu(200)
+    client = make_client()
+    results = []
+    for path in ('/api/menu-items', '/api/categories', '/api/menu-items/1'):
+        etag = client.get(path)['ETag']
+        # Drop the rendered page so the full path really serializes.
+        results.append(measure(f'GET {path} 200', lambda: (catalogue.reset_backend(), client.get(path)),
+                               options['iterations']))
+        client.get(path)
+        results.append(measure(f'GET {path} 304', lambda: client.get(path, HTTP_IF_NONE_MATCH=etag),
+                               options['iterations']))
+    return results
+
+
+@scenario('pagination')
+def pagination(options):
+    """Page-number versus keyset pagination of the order list at increasing depth."""
+    reset_caches()
+    rows = options['rows']
+    manager = make_manager()
+    make_orders(manager, rows)
+    client = make_client(manager.username)
+    page_size = 50
+    ordered = Order.objects.order_by('-date', '-id').values_list('date', 'id')
+    results = []
+    for depth in (0, 0.5, 0.99):
+        page = int(rows * depth) // page_size + 1
+        results.append(measure(f'page={page}', lambda: client.get(f'/api/cart/orders?page={page}&page_size={page_size}'),
+                               options['iterations']))
+        cursor = ''
+        if page > 1:
+            last_date, last_id = ordered[(page - 1) * page_size - 1]
+            data = {'o': ['-date', '-id'], 'p': [last_date.isoformat(), str(last_id)]}
+            cursor = urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+        url = f'/api/cart/orders?cursor={cursor}&page_size={page_size}'
+        results.append(measure(f'cursor at page {page}', lambda: client.get(url), options['iterations']))
+    return results
+
+
+@scenario('checkout')
+def checkout(options):
+    """Cart checkout into an order for carts of 1 to 500 items."""
+    reset_caches()
+    make_menu(500)
+    user = User.objects.create(username='bench-checkout')
+    client = make_client(user.username)
+    items = list(MenuItem.objects.values_list('id', 'price'))
+
+    def fill_cart(size):
+        Cart.objects.bulk_create(
+            Cart(user=user, menuitem_id=pk, quantity=1, unit_price=price, price=price) for pk, price in items[:size]
+        )
+
+    results = []
+    for size in (1, 10, 100, 500):
+        results.append(measure(f'checkout {size} items', lambda: client.post('/api/cart/orders'),
+                               options['iterations'], setup=lambda: fill_cart(size)))
+    return results
+
+
+@scenario('export')
+def export(options):
+    """Peak Python memory of the streaming NDJSON export as the order table grows."""
+    manager = make_manager()
+    results = []
+    created = 0
+    for size in (options['rows'] // 10, options['rows']):
+        make_orders(manager, size - created)
+        created = size
+        tracemalloc.start()
+        start = perf_counter()
+        written = sum(len(line) for line in exports.ndjson_lines(Order.objects.order_by('id')))
+        elapsed = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({'label': f'ndjson {size} orders', 'seconds': elapsed, 'bytes': written,
+                        'peak_mb': peak / 2 ** 20})
+    return results
+
+
+@scenario('serializers')
+def serializers(options):
+    """DRF versus compiled serializers, query plus rendering, at 10/100/1000 rows."""
+    make_menu(1000)
+    Category.objects.bulk_create(Category(slug=f'category-{i}', title=f'Category {i}') for i in range(999))
+    renderer = JSONRenderer()
+    results = []
+    for serializer_class, queryset in ((MenuItemSerializer, MenuItem.objects.order_by('id')),
+                                       (CategorySerializer, Category.objects.order_by('id'))):
+        compiled = compile_serializer(serializer_class)
+        for size in (10, 100, 1000):
+            page = queryset[:size]
+            name = serializer_class.__name__
+            results.append(measure(f'{name} drf {size}', lambda: renderer.render(
+                serializer_class(list(page.all()), many=True).data), options['iterations']))
+            results.append(measure(f'{name} compiled {size}', lambda: renderer.render(
+                compiled.render_many(compiled.values(page))), options['iterations']))
+    return results
+
+
+@scenario('renderers')
+def renderers(options):
+    """Throughput of each renderer on a menu page and an order history page."""
+    category = make_menu(1000)
+    manager = make_manager()
+    make_orders(manager, 200)
+    items = list(MenuItem.objects.filter(category=category)[:5])
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+        for order in Order.objects.all() for item in items
+    )
+    payloads = {
+        'menu': MenuItemSerializer(MenuItem.objects.all(), many=True).data,
+        'orders': OrderSerializer(Order.objects.prefetch_related('orderitems'), many=True).data,
+    }
+
+    def stdlib_render(data):
+        with mock.patch('LittlelemonAPI.renderers.orjson', None):
+            return FastJSONRenderer().render(data)
+
+    candidates = {'drf-json': JSONRenderer().render, 'fast-json-fallback': stdlib_render}
+    if orjson is not None:
+        candidates['fast-json-orjson'] = FastJSONRenderer().render
+    if msgpack is not None:
+        candidates['msgpack'] = MessagePackRenderer().render
+
+    results = []
+    for payload_name, data in payloads.items():
+        for name, render in candidates.items():
+            row = measure(f'{payload_name} {name}', lambda: render(data), options['iterations'])
+            row['bytes'] = len(render(data))
+            row['renders_per_s'] = 1000 / row['mean_ms']
+            results.append(row)
+    return results
+
+
+@scenario('compression')
+def compression(options):
+    """Bytes on the wire and CPU per request for each content coding."""
+    make_menu(100)
+    manager = make_manager()
+    make_orders(manager, 100)
+    client = make_client(manager.username)
+    paths = {
+        'menu (cached page)': '/api/menu-items?page_size=100',
+        'orders': '/api/cart/orders?page_size=100',
+    }
+    results = []
+    for label, path in paths.items():
+        for encoding in ['identity'] + [codec.name for codec in available_codecs({})]:
+            response = client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+            start = process_time()
+            for _ in range(options['iterations']):
+                client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+            cpu = (process_time() - start) / options['iterations']
+            results.append({'label': f'{label} {encoding}', 'bytes': len(response.content),
+                            'cpu_ms': cpu * 1000})
+    return results
+
+
+@scenario('auth')
+def auth(options):
+    """Token authentication plus role check of a manager: DRF's lookup versus the token cache."""
+    reset_caches()
+    manager = make_manager()
+    key = Token.objects.create(user=manager).key
+    request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {key}')
+    results = []
+    for label, authenticator in (('drf token', TokenAuthentication()),
+                                 ('cached token', authentication.CachedTokenAuthentication())):
+        roles.clear()
+        results.append(measure(label, lambda: roles.is_manager(authenticator.authenticate(request)[0]),
+                               options['iterations']))
+    scan = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {"f" * 40}')
+    authenticator = authentication.CachedTokenAuthentication()
+
+    def unknown_key():
+        try:
+            authenticator.authenticate(scan)
+        except AuthenticationFailed:
+            pass
+
+    results.append(measure('cached token, unknown key', unknown_key, options['iterations']))
+    results.append({'label': 'token cache', **authentication.get_token_cache().stats()})
+    return results
+
+
+def load_wsgi(workloads, clients, rounds):
+    """`clients` threads, each sending `rounds` requests through the WSGI handler."""
+    def run(index):
+        headers, paths = workloads[index % len(workloads)]
+        client = Client(headers=headers)
+        timings = []
+        try:
+            for request in range(rounds):
+                start = perf_counter()
+                response = client.get(paths[(index + request) % len(paths)])
+                timings.append(perf_counter() - start)
+                assert response.status_code == 200, response.content
+        finally:
+            connection.close()
+        return timings
+
+    start = perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        timings = [timing for result in pool.map(run, range(clients)) for timing in result]
+    return timings, perf_counter() - start
+
+
+async def load_asgi(workloads, clients, rounds):
+    """`clients` coroutines, each sending `rounds` requests through the ASGI handler."""
+    async def run(index):
+        headers, paths = workloads[index % len(workloads)]
+        client = AsyncClient()
+        timings = []
+        for request in range(rounds):
+            start = perf_counter()
+            response = await client.get(paths[(index + request) % len(paths)], headers=headers)
+            timings.append(perf_counter() - start)
+            assert response.status_code == 200, response.content
+        return timings
+
+    start = perf_counter()
+    results = await asyncio.gather(*(run(index) for index in range(clients)))
+    return [timing for result in results for timing in result], perf_counter() - start
+
+
+@scenario('asgi', atomic=False)
+def asgi(options):
+    """Concurrent clients on the read endpoints: sync WSGI, sync views under ASGI, native async views."""
+    make_menu(200)
+    workloads = []
+    for index in range(20):
+        user = User.objects.create(username=f'bench-async-{index}')
+        Cart.objects.bulk_create(
+            Cart(user=user, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+            for item in MenuItem.objects.all()[index:index + 5]
+        )
+        make_orders(user, 20)
+        order = Order.objects.filter(user=user).first()
+        headers = {'Authorization': f'Token {Token.objects.create(user=user).key}'}
+        paths = ['/api/menu-items', '/api/menu-items?page=2', '/api/categories', '/api/cart/menu-items',
+                 '/api/cart/orders', f'/api/cart/orders/{order.pk}']
+        workloads.append((headers, paths))
+
+    modes = {
+        'wsgi sync': (False, load_wsgi),
+        'asgi sync': (False, async_to_sync(load_asgi)),
+        'asgi async': (True, async_to_sync(load_asgi)),
+    }
+    results = []
+    for clients in (10, 100):
+        for label, (async_views, load) in modes.items():
+            with override_settings(LITTLELEMON_ASYNC_VIEWS=async_views):
+                reset_caches()
+                load(workloads, clients, 1)
+                timings, elapsed = load(workloads, clients, options['iterations'])
+            results.append(summarize(f'{label} {clients} clients', timings, elapsed))
+    return results
+
+
+def add_database(alias, config):
+    """Register an extra database alias at runtime and create the schema in it."""
+    connections.settings[alias] = connections.configure_settings({'default': {}, alias: config})[alias]
+    call_command('migrate', database=alias, verbosity=0)
+
+
+def remove_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+
+
+def read_write_load(alias, readers, writers, operations):
+    """`writers` threads upserting cart rows and `readers` threads reading the menu and orders."""
+    users = list(User.objects.using(alias).values_list('id', flat=True))
+    items = list(MenuItem.objects.using(alias).values_list('id', 'price'))
+
+    def write(index):
+        timings, errors = [], 0
+        user_id = users[index]
+        for operation in range(operations):
+            menuitem_id, price = items[(index + operation) % len(items)]
+            start = perf_counter()
+            try:
+                with transaction.atomic(using=alias):
+                    Cart.objects.using(alias).bulk_create(
+                        [Cart(user_id=user_id, menuitem_id=menuitem_id, quantity=operation % 5 + 1,
+                              unit_price=price, price=price)],
+                        update_conflicts=True, unique_fields=['menuitem', 'user'],
+                        update_fields=['quantity', 'unit_price', 'price'],
+                    )
+                    Cart.objects.using(alias).filter(user_id=user_id).count()
+            except OperationalError:
+                errors += 1
+            timings.append(perf_counter() - start)
+        connections[alias].close()
+        return 'write', timings, errors
+
+    def read(index):
+        timings, errors = [], 0
+        for operation in range(operations):
+            start = perf_counter()
+            try:
+                list(MenuItem.objects.using(alias).filter(featured=True).order_by('id')[:50])
+                list(Order.objects.using(alias).filter(user_id=users[(index + operation) % len(users)])
+                     .order_by('-date', '-id')[:20])
+            except OperationalError:
+                errors += 1
+            timings.append(perf_counter() - start)
+        connections[alias].close()
+        return 'read', timings, errors
+
+    start = perf_counter()
+    with ThreadPoolExecutor(readers + writers) as pool:
+        futures = [pool.submit(write, index) for index in range(writers)]
+        futures += [pool.submit(read, index) for index in range(readers)]
+        results = [future.result() for future in futures]
+    elapsed = perf_counter() - start
+    summary = {}
+    for kind, timings, errors in results:
+        entry = summary.setdefault(kind, {'timings': [], 'errors': 0})
+        entry['timings'] += timings
+        entry['errors'] += errors
+    return summary, elapsed
+
+
+@scenario('sqlite')
+def sqlite(options):
+    """Concurrent cart writes and catalogue/order reads on a SQLite file: defaults versus the profile."""
+    default = connections.settings['default']
+    if default['ENGINE'] != 'django.db.backends.sqlite3':
+        return [{'label': 'skipped', 'reason': 'the sqlite profile is not active'}]
+    profiles = {
+        # journal_mode=DELETE, Python's default 5 s busy timeout, deferred transactions.
+        'rollback journal': ({}, 'DELETE', {}),
+        'profile': (default['OPTIONS'], settings.LITTLELEMON_SQLITE_JOURNAL_MODE, settings.LITTLELEMON_SQLITE_PRAGMAS),
+    }
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for label, (db_options, journal_mode, pragmas) in profiles.items():
+            alias = f'bench-{label.replace(" ", "-")}'
+            # The journal mode is set by the migrations that `add_database` runs.
+            with override_settings(LITTLELEMON_SQLITE_JOURNAL_MODE=journal_mode, LITTLELEMON_SQLITE_PRAGMAS=pragmas):
+                add_database(alias, {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': dict(db_options),
+                                     'NAME': f'{directory}/{alias}.sqlite3'})
+                try:
+                    category = Category.objects.using(alias).create(slug='bench', title='Bench')
+                    MenuItem.objects.using(alias).bulk_create(
+                        MenuItem(title=f'Item {i}', price=i % 100 + 1, featured=i % 7 == 0, category=category)
+                        for i in range(200)
+                    )
+                    users = User.objects.using(alias).bulk_create(User(username=f'bench-{i}') for i in range(8))
+                    Order.objects.using(alias).bulk_create(
+                        Order(user=user, total=i % 50 + 1, date=date(2024, 1, 1) + timedelta(days=i % 365))
+                        for user in users for i in range(500)
+                    )
+                    summary, elapsed = read_write_load(alias, readers=8, writers=8,
+                                                       operations=options['iterations'])
+                finally:
+                    remove_database(alias)
+            for kind, entry in summary.items():
+                row = summarize(f'{label} {kind}s', entry['timings'], elapsed)
+                row['errors'] = entry['errors']
+                results.append(row)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+class QueryCounter:
+    """`connection.execute_wrapper` that counts queries, also when a query log would be too long."""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+async def hold_subscribers(users, idle, queries, sample=100):
+    """
+    Open an event stream per user through the ASGI handler, leave them idle for `idle` seconds, then
+    time how long one change takes to reach its subscriber. Memory is traced for the last `sample`
+    subscribers only, as tracing slows everything down.
+    """
+    client = AsyncClient()
+    loop = asyncio.get_running_loop()
+
+    async def subscribe(user):
+        response = await client.get('/api/cart/orders/changes', headers={
+            'Authorization': f'Token {user.auth_token.key}', 'Accept': 'text/event-stream'})
+        chunks = aiter(response.streaming_content)
+        await anext(chunks)
+        # Like a server, keep asking for the next event, which parks the view on the notifier.
+        return chunks, asyncio.ensure_future(anext(chunks))
+
+    start = perf_counter()
+    streams = await asyncio.gather(*(subscribe(user) for user in users[:-sample]))
+    tracemalloc.start()
+    streams += await asyncio.gather(*(subscribe(user) for user in users[-sample:]))
+    while changes.notifier.subscribers() < len(users):
+        await asyncio.sleep(0.01)
+    memory = tracemalloc.get_traced_memory()[0] / sample
+    tracemalloc.stop()
+    subscribe_s = perf_counter() - start
+
+    # Scheduling delay of a 10 ms timer while the subscribers wait.
+    lags = []
+    idle_queries = queries.count
+    deadline = loop.time() + idle
+    while loop.time() < deadline:
+        start = loop.time()
+        await asyncio.sleep(0.01)
+        lags.append(loop.time() - start - 0.01)
+    idle_queries = queries.count - idle_queries
+
+    start = perf_counter()
+    await sync_to_async(Order.objects.create)(user=users[0], date=date(2024, 1, 1))
+    await asyncio.wait_for(streams[0][1], 10)
+    wake_s = perf_counter() - start
+    for chunks, pending in streams:
+        pending.cancel()
+    await asyncio.gather(*(pending for chunks, pending in streams), return_exceptions=True)
+    for chunks, pending in streams:
+        await chunks.aclose()
+    return subscribe_s, memory, idle_queries, max(lags), wake_s
+
+
+@scenario('feed', atomic=False)
+def feed(options):
+    """Idle event-stream subscribers held by one ASGI worker: memory, idle queries, wake-up latency."""
+    idle = 2
+    results = []
+    queries = QueryCounter()
+    config = {**settings.LITTLELEMON_CHANGE_FEED, 'POLL_INTERVAL': 0.5}
+    with override_settings(LITTLELEMON_CHANGE_FEED=config), connection.execute_wrapper(queries):
+        for count in (100, 1000, 5000):
+            reset_caches()
+            changes.notifier = changes.ChangeNotifier()
+            users = User.objects.bulk_create(User(username=f'bench-feed-{count}-{i}') for i in range(count))
+            Token.objects.bulk_create(Token(key=Token.generate_key(), user=user) for user in users)
+            users = list(User.objects.filter(pk__in=[user.pk for user in users]).select_related('auth_token'))
+            subscribe_s, memory, idle_queries, lag, wake_s = async_to_sync(hold_subscribers)(users, idle, queries)
+            results.append({
+                'label': f'{count} subscribers',
+                'subscribe_s': subscribe_s,
+                'kib_per_subscriber': memory / 1024,
+                # Only the shared poller queries while everyone is idle.
+                'idle_queries_per_s': idle_queries / idle,
+                'max_loop_lag_ms': lag * 1000,
+                'wake_ms': wake_s * 1000,
+            })
+    return results
+
+
+@scenario('metrics')
+def instrumentation(options):
+    """Request instrumentation overhead: no middleware, every request sampled, 10% sampled."""
+    reset_caches()
+    make_menu(200)
+    user = User.objects.create(username='bench')
+    make_orders(user, 20)
+    without = [name for name in settings.MIDDLEWARE if not name.endswith('.InstrumentationMiddleware')]
+    modes = {
+        'off': {'MIDDLEWARE': without},
+        'sampled 100%': {'LITTLELEMON_METRICS': {'SAMPLE_RATE': 1.0, 'SLOW_REQUEST_SECONDS': 60}},
+        'sampled 10%': {'LITTLELEMON_METRICS': {'SAMPLE_RATE': 0.1, 'SLOW_REQUEST_SECONDS': 60}},
+    }
+    results = []
+    for path in ('/api/menu-items', '/api/cart/orders'):
+        clients = {}
+        for label, overrides in modes.items():
+            with override_settings(**overrides):
+                # The middleware is loaded with the overridden settings on the first request.
+                clients[label] = make_client(user.username)
+                clients[label].get(path)
+        # Modes take turns, so drift and GC pauses hit them alike.
+        timings = {label: [] for label in modes}
+        for _ in range(options['iterations']):
+            for label, client in clients.items():
+                start = perf_counter()
+                client.get(path)
+                timings[label].append(perf_counter() - start)
+        baseline = median(timings['off'])
+        for label, values in timings.items():
+            results.append({
+                'label': f'GET {path} {label}',
+                'iterations': len(values),
+                'mean_ms': mean(values) * 1000,
+                'p50_ms': median(values) * 1000,
+                'overhead_pct': (median(values) / baseline - 1) * 100,
+            })
+    return results
+
+
+@scenario('throttle')
+def throttle(options):
+    """
+    Cost of one throttle check after 1000 requests in the window: DRF's `UserRateThrottle` versus
+    `GCRAThrottle` on each backend, then whole menu requests with throttling off and on.
+    """
+    reset_caches()
+    user = User.objects.create(username='bench')
+    request = Request(APIRequestFactory().get('/api/menu-items'))
+    request.user = user
+    view = views.MenuItemView()
+    view.headers = {}
+    rate = '1000000/hour'
+
+    class DRFThrottle(UserRateThrottle):
+        def get_rate(self):
+            return rate
+
+    candidates = {
+        'drf UserRateThrottle': (DRFThrottle, None),
+        'gcra local': (throttling.GCRAThrottle, 'LittlelemonAPI.throttling.LocalThrottleBackend'),
+        'gcra django cache': (throttling.GCRAThrottle, 'LittlelemonAPI.throttling.CacheThrottleBackend'),
+    }
+    results = []
+    for label, (throttle_class, backend) in candidates.items():
+        config = {'ENABLED': True, 'BACKEND': backend or 'LittlelemonAPI.throttling.LocalThrottleBackend',
+                  'OPTIONS': {}, 'RATES': {'catalogue': rate}}
+        with override_settings(LITTLELEMON_THROTTLING=config):
+            row = measure(label, lambda: throttle_class().allow_request(request, view), options['iterations'],
+                          warmup=1000)
+            row['us_per_call'] = row['mean_ms'] * 1000
+            results.append(row)
+
+    make_menu(200)
+    client = make_client(user.username)
+    config = {**settings.LITTLELEMON_THROTTLING, 'RATES': {'catalogue': rate}}
+    modes = {'off': [], 'on': views.MenuItemView.throttle_classes}
+    # Modes take turns, so drift and GC pauses hit them alike.
+    timings = {label: [] for label in modes}
+    with override_settings(LITTLELEMON_THROTTLING=config):
+        for _ in range(options['iterations']):
+            for label, throttle_classes in modes.items():
+                with mock.patch.object(views.MenuItemView, 'throttle_classes', throttle_classes):
+                    start = perf_counter()
+                    client.get('/api/menu-items')
+                    timings[label].append(perf_counter() - start)
+    for label, values in timings.items():
+        results.append({
+            'label': f'GET /api/menu-items throttling {label}',
+            'iterations': len(values),
+            'mean_ms': mean(values) * 1000,
+            'p50_ms': median(values) * 1000,
+            'overhead_us': (median(values) - median(timings['off'])) * 1e6,
+        })
+    return results
+
+@scenario('analytics')
+def analytics(options):
+    """
+    Manager reports on `--rows` synthetic orders: aggregating the order tables on every request
+    versus reading the daily rollups, then the refresh a read pays after writes marked a day.
+    """
+    reset_caches()
+    rows = options['rows']
+    synthetic.generate(synthetic.Counts(menu_items=200, crew=20, customers=max(rows // 20, 10), cart_rows=0,
+                                        orders=rows), prefix='bench')
+    rebuild = measure('update_rollups --full', lambda: list(rollups.catch_up(full=True)), 1)
+    manager = make_manager()
+    client = make_client(manager.username)
+    iterations = options['iterations']
+    day = Order.objects.order_by('-date').values_list('date', flat=True).first()
+
+    def raw_reports():
+        orders = Order.objects.order_by()
+        list(orders.values('date').annotate(revenue=Sum('total')).order_by('date'))
+        list(OrderItem.objects.order_by().values('menuitem').annotate(revenue=Sum('price')).order_by('-revenue')[:10])
+        list(orders.filter(delivery_crew__isnull=False).values('delivery_crew')
+             .annotate(delivered=Count('id', filter=Q(status=True))))
+
+    def rollup_reports():
+        for path in ('/api/analytics/sales', '/api/analytics/menu-items', '/api/analytics/crew'):
+            call(client, 'get', path, (200,))
+
+    results = [
+        measure('raw aggregates (3 reports)', raw_reports, iterations, warmup=1),
+        measure('rollup endpoints (3 reports)', rollup_reports, iterations, warmup=1),
+        measure('rollup endpoints, one day marked', rollup_reports, iterations,
+                setup=lambda: rollups.mark_dates([day]), warmup=1),
+        rebuild,
+    ]
+    return results
+
+
+@scenario('archive')
+def archive(options):
+    """
+    Latency of the order list on `--rows` synthetic orders spread over a year, before and after
+    archiving the delivered orders older than 30 days, as a manager (page numbers, so a COUNT(*) of
+    the whole table) and as a customer, plus the time the archiving took.
+    """
+    reset_caches()
+    rows = options['rows']
+    synthetic.generate(synthetic.Counts(menu_items=200, crew=20, customers=max(rows // 200, 10), cart_rows=0,
+                                        orders=rows), prefix='bench')
+    manager = make_client(make_manager().username)
+    customer = make_client('bench-customer-0')
+    reads = [
+        ('GET /api/cart/orders as manager', manager, '/api/cart/orders'),
+        ('GET /api/cart/orders?page=50 as manager', manager, '/api/cart/orders?page=50'),
+        ('GET /api/cart/orders as customer', customer, '/api/cart/orders'),
+    ]
+    iterations = options['iterations']
+    results = []
+    for phase in ('before', 'after'):
+        if phase == 'after':
+            row = measure('archive_orders --days 30', lambda: sum(lifecycle.archive_orders(days=30)), 1)
+            row['live_orders'] = Order.objects.count()
+            results.append(row)
+        results += [measure(f'{label} {phase} archiving', lambda: call(client, 'get', path, (200,)), iterations,
+                            warmup=2) for label, client, path in reads]
+    return results
+
+
+def call(client, method, path, expected, **kwargs):
+    response = getattr(client, method)(path, **kwargs)
+    assert response.status_code in expected, (method, path, response.status_code, response.content)
+    if response.streaming:
+        # Export and feed responses do their work while they are consumed.
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+@scenario('endpoints')
+def endpoints(options):
+    """
+    Every endpoint on synthetic data of `--rows` orders, authenticated with tokens as a customer, a
+    crew member, a manager and an admin. Writes are measured with a setup that restores their input.
+    """
+    reset_caches()
+    rows = options['rows']
+    counts = synthetic.Counts(
+        categories=10, menu_items=200, managers=2, crew=max(rows // 2000, 2), customers=max(rows // 20, 10),
+        cart_rows=max(rows // 10, 10), orders=rows, open_days=max(365 * 1000 // max(rows, 1), 2),
+    )
+    # Logins would otherwise spend hundreds of milliseconds in PBKDF2.
+    with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+        synthetic.generate(counts, prefix='bench')
+        for _ in rollups.catch_up():
+            pass
+        admin = User.objects.create_superuser('bench-admin', password='pass')
+        users = {role: User.objects.get(username=f'bench-{role}-0') for role in ('customer', 'crew', 'manager')}
+        users['admin'] = admin
+        clients = {}
+        for role, user in users.items():
+            clients[role] = APIClient()
+            clients[role].credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        customer, crew, manager, admin = (clients[role] for role in ('customer', 'crew', 'manager', 'admin'))
+        item = MenuItem.objects.order_by('id').first()
+        category = item.category_id
+        order = Order.objects.filter(user=users['customer']).order_by('id').first()
+        # Synthetic orders span the last year; an older one is archived for the archive endpoints.
+        Order.objects.create(user=users['customer'], date=date.today() - timedelta(days=400), status=True)
+        sum(lifecycle.archive_orders(days=365))
+        archived = ArchivedOrder.objects.get(user=users['customer'])
+        prices = list(MenuItem.objects.order_by('id').values_list('id', 'price')[:10])
+        queued = list(deliveries.queue().values_list('id', flat=True)[:10])
+        iterations = options['iterations']
+
+        def fill_cart():
+            Cart.objects.filter(user=users['customer']).delete()
+            Cart.objects.bulk_create(
+                Cart(user=users['customer'], menuitem_id=pk, quantity=1, unit_price=price, price=price)
+                for pk, price in prices
+            )
+
+        claimed = []
+
+        def claim():
+            claimed[:] = [deliveries.claim_next(users['crew']) or 0]
+
+        reads = [
+            ('GET /api/menu-items', customer, '/api/menu-items'),
+            ('GET /api/menu-items?page=2', customer, '/api/menu-items?page=2'),
+            ('GET /api/menu-items/<id>', customer, f'/api/menu-items/{item.pk}'),
+            ('GET /api/categories', customer, '/api/categories'),
+            ('GET /api/categories/<id>', customer, f'/api/categories/{category}'),
+            ('GET /api/cart/menu-items', customer, '/api/cart/menu-items'),
+            ('GET /api/cart/summary', customer, '/api/cart/summary'),
+            ('GET /api/cart/orders', customer, '/api/cart/orders'),
+            ('GET /api/cart/orders as manager', manager, '/api/cart/orders'),
+            ('GET /api/cart/orders?cursor=', manager, '/api/cart/orders?cursor='),
+            ('GET /api/cart/orders/<id>', customer, f'/api/cart/orders/{order.pk}'),
+            ('GET /api/cart/orders/archive', customer, '/api/cart/orders/archive'),
+            ('GET /api/cart/orders/archive/<id>', customer, f'/api/cart/orders/archive/{archived.pk}'),
+            ('GET /api/cart/orders/changes', customer, '/api/cart/orders/changes?after=0'),
+            ('GET /api/dispatch/queue', crew, '/api/dispatch/queue'),
+            ('GET /api/dispatch/mine', crew, '/api/dispatch/mine'),
+            ('GET /api/groups/manager/users', admin, '/api/groups/manager/users'),
+            ('GET /api/groups/delivery-crew/users', manager, '/api/groups/delivery-crew/users'),
+            ('GET /api/metrics', admin, '/api/metrics'),
+            ('GET /api/analytics/sales', manager, '/api/analytics/sales'),
+            ('GET /api/analytics/menu-items', manager, '/api/analytics/menu-items'),
+            ('GET /api/analytics/crew', manager, '/api/analytics/crew'),
+        ]
+        results = [measure(label, lambda: call(client, 'get', path, (200,)), iterations, warmup=2)
+                   for label, client, path in reads]
+        # The export reads every order, so it gets fewer rounds.
+        results.append(measure('GET /api/cart/orders/export', lambda: call(
+            manager, 'get', '/api/cart/orders/export', (200,)), max(iterations // 10, 1), warmup=1))
+
+        batch = [{'menuitem': pk, 'quantity': 2} for pk, _ in prices]
+        # Re-imports of 100 existing rows, so every run upserts the same data.
+        categories_csv = 'slug,title\n' + ''.join(
+            f'{slug},{title}\n' for slug, title in Category.objects.order_by('id').values_list('slug', 'title'))
+        menu_csv = 'title,price,featured,category\n' + ''.join(
+            f'"{title}",{price},{featured},{slug}\n' for title, price, featured, slug in
+            MenuItem.objects.order_by('id').values_list('title', 'price', 'featured', 'category__slug')[:100])
+        writes = [
+            ('POST /api/cart/menu-items/batch', lambda: call(
+                customer, 'post', '/api/cart/menu-items/batch', (200,), data=batch, format='json'), fill_cart),
+            ('DELETE /api/cart/menu-items', lambda: call(customer, 'delete', '/api/cart/menu-items', (204,)),
+             fill_cart),
+            ('POST /api/cart/orders', lambda: call(customer, 'post', '/api/cart/orders', (201,)), fill_cart),
+            ('POST /api/dispatch/claim', lambda: call(crew, 'post', '/api/dispatch/claim', (200, 204)), None),
+            ('POST /api/dispatch/assign', lambda: call(
+                manager, 'post', '/api/dispatch/assign', (200,),
+                data={'delivery_crew': users['crew'].pk, 'orders': queued}, format='json'), None),
+            ('POST /api/dispatch/orders/<id>/delivered', lambda: call(
+                crew, 'post', f'/api/dispatch/orders/{claimed[0]}/delivered', (204, 404)), claim),
+            ('POST /api/categories/import', lambda: call(
+                manager, 'post', '/api/categories/import', (200,), data=categories_csv, content_type='text/csv'), None),
+            ('POST /api/menu-items/import', lambda: call(
+                manager, 'post', '/api/menu-items/import', (200,), data=menu_csv, content_type='text/csv'), None),
+            ('POST /api/menu-items/prices', lambda: call(
+                manager, 'post', f'/api/menu-items/prices?category={category}', (200,), data={'percent': '0'},
+                format='json'), None),
+            ('POST /api/api-token-auth', lambda: call(
+                APIClient(), 'post', '/api/api-token-auth', (200,),
+                data={'username': 'bench-customer-1', 'password': 'pass'}), None),
+        ]
+        results += [measure(label, func, iterations, setup=setup, warmup=2) for label, func, setup in writes]
+    for row in results:
+        row['req_per_s'] = 1000 / row['mean_ms']
+    return results
+
+
+def save_baseline(path, results, options):
+    """Write `{scenario: {label: row}}` with the run's parameters to the JSON file at `path`."""
+    baseline = {
+        'meta': {
+            'iterations': options['iterations'],
+            'rows': options['rows'],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'scenarios': {name: {row['label']: row for row in rows} for name, rows in results.items()},
+    }
+    with open(path, 'w') as file:
+        json.dump(baseline, file, indent=2, sort_keys=True)
+
+
+def compare(baseline, results, tolerance):
+    """
+    Regressions of `results` against a loaded baseline, as messages. Latencies and throughput may
+    each get worse by the `tolerance` share; average query counts must not grow. Rows missing from
+    either side are not compared.
+    """
+    regressions = []
+    for name, rows in results.items():
+        previous = baseline['scenarios'].get(name, {})
+        for row in rows:
+            before = previous.get(row['label'])
+            if before is None:
+                continue
+            where = f'{name}: {row["label"]}'
+            if 'queries' in row and 'queries' in before and row['queries'] > before['queries'] + 0.01:
+                regressions.append(f'{where}: queries {before["queries"]:.2f} -> {row["queries"]:.2f}')
+            for field, higher_is_better in GATED.items():
+                if field not in row or field not in before:
+                    continue
+                old, new = before[field], row[field]
+                if higher_is_better:
+                    worse = new < old * (1 - tolerance)
+                else:
+                    worse = new > old * (1 + tolerance) and new - old > MIN_DELTA_MS
+                if worse:
+                    regressions.append(f'{where}: {field} {old:.3f} -> {new:.3f}')
+    return regressions
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+# The `LRUCache` class is a small thread-safe, size-bounded mapping used for the process-wide
+# caches in this app. The least recently used entry is evicted once `maxsize` is reached.
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+# The `TTLCache` class is an `LRUCache` whose entries also expire `timeout` seconds after they were
+# set. `set` takes a per-entry timeout, e.g. shorter ones for negative entries.
+class TTLCache(LRUCache):
+    def __init__(self, maxsize=1024, timeout=300):
+        super().__init__(maxsize)
+        self.timeout = timeout
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires <= monotonic():
+            self.delete(key)
+            return default
+        return value
+
+    def set(self, key, value, timeout=None):
+        super().set(key, (monotonic() + (self.timeout if timeout is None else timeout), value))
@@ -0,0 +1,47 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce
+
+from rest_framework.exceptions import ValidationError
+
+from .models import Cart, MenuItem
+
+
+def set_quantities(user, quantities):
+    """
+    Upsert the user's cart rows from a `{menuitem_id: quantity}` mapping; a quantity of 0 removes
+    the row. Prices come from one `in_bulk` lookup and the rows are written with a single
+    INSERT ... ON CONFLICT DO UPDATE, so the query count does not grow with the number of entries.
+    """
+    menuitems = MenuItem.objects.only('price').in_bulk(list(quantities))
+    missing = sorted(set(quantities) - set(menuitems))
+    if missing:
+        raise ValidationError({'menuitem': [f'Invalid pk "{pk}" - object does not exist.' for pk in missing]})
+
+    removed = [pk for pk, quantity in quantities.items() if quantity == 0]
+    rows = [
+        Cart(user=user, menuitem_id=pk, quantity=quantity, unit_price=menuitems[pk].price,
+             price=quantity * menuitems[pk].price)
+        for pk, quantity in quantities.items() if quantity > 0
+    ]
+    with transaction.atomic():
+        if removed:
+            Cart.objects.filter(user=user, menuitem_id__in=removed).delete()
+        if rows:
+            Cart.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['menuitem', 'user'],
+                update_fields=['quantity', 'unit_price', 'price', 'updated_at'],
+            )
+
+
+def summary(user):
+    """Line count, summed quantity and total of the user's cart, from one aggregate query."""
+    return Cart.objects.filter(user=user).aggregate(
+        lines=Count('id'),
+        quantity=Coalesce(Sum('quantity'), 0),
+        total=Coalesce(Sum('price'), Value(Decimal('0.00'))),
+    )
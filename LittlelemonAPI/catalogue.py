@@ -0,0 +1,152 @@
+from threading import Lock
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .cache import LRUCache
+from .models import Category, MenuItem
+
+
+# The `LocalCatalogueBackend` class keeps rendered catalogue pages in a per-process LRU. The menu
+# version is a plain counter, so it only suits single-worker deployments.
+class LocalCatalogueBackend:
+    def __init__(self, maxsize=512):
+        self._pages = LRUCache(maxsize=maxsize)
+        self._version = 1
+        self._lock = Lock()
+
+    def get_version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+        # Pages of older versions can never be read again.
+        self._pages.clear()
+
+    def get(self, key):
+        return self._pages.get(key)
+
+    def set(self, key, body):
+        self._pages.set(key, body)
+
+    # Nothing here blocks, so the async methods just call the sync ones.
+    async def aget_version(self):
+        return self.get_version()
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, body):
+        self.set(key, body)
+
+
+# The `DjangoCatalogueBackend` class stores pages and the menu version in a Django cache, so every
+# worker sharing that cache sees the same version.
+class DjangoCatalogueBackend:
+    version_key = 'littlelemon:catalogue:version'
+
+    def __init__(self, alias='default', timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.cache.add(self.version_key, 1, timeout=None)
+            version = self.cache.get(self.version_key, 1)
+        return version
+
+    def bump_version(self):
+        try:
+            self.cache.incr(self.version_key)
+        except ValueError:
+            self.cache.add(self.version_key, 2, timeout=None)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, body):
+        self.cache.set(key, body, timeout=self.timeout)
+
+    # The async methods go through Django's async cache API, so async views never wait for the cache
+    # server on the event loop.
+    async def aget_version(self):
+        version = await self.cache.aget(self.version_key)
+        if version is None:
+            await self.cache.aadd(self.version_key, 1, timeout=None)
+            version = await self.cache.aget(self.version_key, 1)
+        return version
+
+    async def aget(self, key):
+        return await self.cache.aget(key)
+
+    async def aset(self, key, body):
+        await self.cache.aset(key, body, timeout=self.timeout)
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the configured catalogue backend, see `LITTLELEMON_CATALOGUE_CACHE` in settings."""
+    global _backend
+    if _backend is None:
+        config = getattr(settings, 'LITTLELEMON_CATALOGUE_CACHE', {})
+        backend_class = import_string(config.get('BACKEND', 'LittlelemonAPI.catalogue.LocalCatalogueBackend'))
+        _backend = backend_class(**config.get('OPTIONS', {}))
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    _backend = None
+
+
+def make_key(namespace, version, request):
+    # Every parameter (page, cursor, ordering, filters, ...) selects a different rendered page, and
+    # so does the negotiated media type with its parameters, e.g. `indent=4`.
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    return f'littlelemon:catalogue:{version}:{namespace}:{request.get_host()}:{request.accepted_media_type}:{params}'
+
+
+def get_validator(name, compute):
+    """Return the cached validator `name` for the current menu version, calling `compute` on a miss."""
+    backend = get_backend()
+    key = f'littlelemon:catalogue:{backend.get_version()}:validator:{name}'
+    validator = backend.get(key)
+    if validator is None:
+        validator = compute()
+        backend.set(key, validator)
+    return validator
+
+
+async def aget_validator(name, compute):
+    """`get_validator` for async views; `compute` returns an awaitable."""
+    backend = get_backend()
+    key = f'littlelemon:catalogue:{await backend.aget_version()}:validator:{name}'
+    validator = await backend.aget(key)
+    if validator is None:
+        validator = await compute()
+        await backend.aset(key, validator)
+    return validator
+
+
+def bump_version():
+    get_backend().bump_version()
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def _catalogue_changed(sender, **kwargs):
+    bump_version()
@@ -0,0 +1,168 @@
+"""
+The order change feed: an append-only log of order writes (`OrderChange`) and a notifier that wakes
+the feed subscribers waiting for their next change.
+
+Order saves and deletes are logged by the signal handlers below. Bulk `.update()` calls send no
+signal and have to call `record_updates` themselves, as the dispatch functions do.
+
+Subscribers of this process are woken when a change commits. Changes written by other processes are
+picked up by one shared poller per process, so idle subscribers cost no queries. Change ids are the
+feed cursor. On databases where transactions can commit out of id order (PostgreSQL sequences), a
+subscriber that has moved past an id can miss a change that commits later with a lower id.
+"""
+import asyncio
+from threading import Lock
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import roles
+from .models import Order, OrderChange
+
+# Waiter key of subscribers who see every change (managers and superusers).
+ALL = '*'
+
+ROW_FIELDS = ('id', 'user_id', 'delivery_crew_id', 'status')
+
+
+def get_config():
+    config = getattr(settings, 'LITTLELEMON_CHANGE_FEED', {})
+    return {
+        'POLL_INTERVAL': config.get('POLL_INTERVAL', 2),
+        'HEARTBEAT': config.get('HEARTBEAT', 15),
+        'MAX_WAIT': config.get('MAX_WAIT', 30),
+        'STREAM_TIMEOUT': config.get('STREAM_TIMEOUT', 300),
+        'BATCH_SIZE': config.get('BATCH_SIZE', 100),
+    }
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+# The `ChangeNotifier` class wakes waiting subscribers by key: the ids of the users a change concerns,
+# plus `ALL`. `last_id` is the newest change id it has been told about. Waiters are futures on their
+# event loop, so an idle subscriber costs one future and one timer.
+class ChangeNotifier:
+    def __init__(self):
+        self._waiters = {}
+        self._lock = Lock()
+        self._poller = None
+        self.last_id = None
+
+    async def wait(self, key, checked, timeout):
+        """
+        Wait up to `timeout` seconds for a change for `key` newer than `checked`, the `last_id` the
+        subscriber read before its last query. True when woken by a change, False on timeout.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._lock:
+            if self.last_id is not None and (checked is None or self.last_id > checked):
+                return True
+            self._waiters.setdefault(key, set()).add(waiter)
+            if self._poller is None or self._poller.done() or self._poller.get_loop() is not loop:
+                self._poller = loop.create_task(self._poll())
+        handle = loop.call_later(timeout, _resolve, future, False)
+        try:
+            return await future
+        finally:
+            handle.cancel()
+            with self._lock:
+                waiters = self._waiters.get(key)
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[key]
+
+    def notify(self, keys, last_id):
+        """Wake the waiters of `keys` and of `ALL`; callable from any thread."""
+        with self._lock:
+            if self.last_id is None or last_id > self.last_id:
+                self.last_id = last_id
+            waiters = [waiter for key in (*keys, ALL) for waiter in self._waiters.get(key, ())]
+        for loop, future in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve, future, True)
+
+    def subscribers(self):
+        with self._lock:
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def _poll(self):
+        # Picks up changes committed by other processes while anyone is waiting.
+        if self.last_id is None:
+            latest = await alatest_id()
+            with self._lock:
+                if self.last_id is None:
+                    self.last_id = latest
+        while True:
+            await asyncio.sleep(get_config()['POLL_INTERVAL'])
+            with self._lock:
+                if not self._waiters:
+                    self._poller = None
+                    return
+                last_id = self.last_id or 0
+            rows = [row async for row in OrderChange.objects.filter(id__gt=last_id)
+                    .values_list('id', 'user_id', 'delivery_crew_id')]
+            if rows:
+                self.notify({key for row in rows for key in row[1:] if key is not None},
+                            max(row[0] for row in rows))
+
+
+notifier = ChangeNotifier()
+
+
+def record(kind, rows):
+    """
+    Log one change of `kind` per `(order_id, user_id, delivery_crew_id, status)` row, with a single
+    INSERT, and wake the subscribers concerned once the transaction commits.
+    """
+    if not rows:
+        return
+    changes = OrderChange.objects.bulk_create(
+        OrderChange(order_id=order_id, user_id=user_id, delivery_crew_id=crew_id, status=status, kind=kind)
+        for order_id, user_id, crew_id, status in rows
+    )
+    keys = {key for row in rows for key in row[1:3] if key is not None}
+    last_id = max(change.pk for change in changes)
+    transaction.on_commit(lambda: notifier.notify(keys, last_id))
+
+
+def record_updates(order_ids):
+    """Log an update of each order in `order_ids`, for writes made with `.update()`."""
+    record(OrderChange.UPDATED, list(Order.objects.filter(pk__in=order_ids).values_list(*ROW_FIELDS)))
+
+
+def subscriber_key(user):
+    """The notifier key `user` waits on; role checks must not query (see `roles.aget_roles`)."""
+    return ALL if user.is_superuser or roles.is_manager(user) else user.pk
+
+
+def visible(user):
+    """The changes `user` may see: all for managers, else those of their own or assigned orders."""
+    queryset = OrderChange.objects.order_by('id')
+    if subscriber_key(user) == ALL:
+        return queryset
+    return queryset.filter(Q(user=user.pk) | Q(delivery_crew=user.pk))
+
+
+async def alatest_id():
+    return (await OrderChange.objects.aaggregate(last_id=Max('id')))['last_id'] or 0
+
+
+@receiver(post_save, sender=Order)
+def _order_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    kind = OrderChange.CREATED if created else OrderChange.UPDATED
+    record(kind, [(instance.pk, instance.user_id, instance.delivery_crew_id, instance.status)])
+
+
+@receiver(post_delete, sender=Order)
+def _order_deleted(sender, instance, **kwargs):
+    record(OrderChange.DELETED, [(instance.pk, instance.user_id, instance.delivery_crew_id, instance.status)])
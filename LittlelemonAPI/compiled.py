@@ -0,0 +1,94 @@
+from django.conf import settings
+
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.relations import PrimaryKeyRelatedField, RelatedField
+
+from . import metrics
+
+# Fields whose `to_representation` returns database values unchanged.
+PASSTHROUGH_FIELDS = (serializers.IntegerField, serializers.CharField, serializers.SlugField,
+                      serializers.ReadOnlyField, PrimaryKeyRelatedField)
+
+
+class NotCompilable(Exception):
+    pass
+
+
+# The `CompiledSerializer` class is a read-only stand-in for a flat `ModelSerializer`. It reads
+# `.values()` rows and builds the representation with a function generated once per serializer
+# class, skipping per-instance field binding and attribute lookups. The output is identical to
+# `serializer_class(instance).data`; writes and validation still go through DRF.
+class CompiledSerializer:
+    def __init__(self, serializer_class):
+        fields = [field for field in serializer_class().fields.values() if not field.write_only]
+        namespace = {}
+        items = []
+        self.paths = []
+        for index, field in enumerate(fields):
+            if field.source == '*' or isinstance(field, (serializers.BaseSerializer,
+                                                         serializers.SerializerMethodField)):
+                raise NotCompilable(f'{serializer_class.__name__}.{field.field_name}')
+            if isinstance(field, RelatedField) and not (
+                    isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None):
+                raise NotCompilable(f'{serializer_class.__name__}.{field.field_name}')
+
+            path = '__'.join(field.source_attrs)
+            self.paths.append(path)
+            if type(field) in PASSTHROUGH_FIELDS:
+                expression = f'row[{path!r}]'
+            else:
+                namespace[f'f{index}'] = field.to_representation
+                expression = f'(None if row[{path!r}] is None else f{index}(row[{path!r}]))'
+            items.append(f'{field.field_name!r}: {expression}')
+
+        source = 'def render(row):\n    return {%s}\n' % ', '.join(items)
+        exec(compile(source, f'<compiled {serializer_class.__name__}>', 'exec'), namespace)
+        self.render = namespace['render']
+
+    def values(self, queryset, extra=()):
+        """`queryset` as dict rows holding every path the renderer reads, plus `extra` fields."""
+        return queryset.values(*dict.fromkeys([*self.paths, *extra]))
+
+    def render_many(self, rows):
+        render = self.render
+        with metrics.serializing():
+            return [render(row) for row in rows]
+
+
+_compiled = {}
+
+
+def compile_serializer(serializer_class):
+    """Return the cached `CompiledSerializer` for `serializer_class`, or None if it cannot be compiled."""
+    if serializer_class not in _compiled:
+        try:
+            _compiled[serializer_class] = CompiledSerializer(serializer_class)
+        except NotCompilable:
+            _compiled[serializer_class] = None
+    return _compiled[serializer_class]
+
+
+# The `CompiledReadMixin` class renders list responses with the compiled serializer when
+# `LITTLELEMON_COMPILED_SERIALIZERS` is on. Fields used by keyset cursors are fetched as well.
+class CompiledReadMixin:
+    def get_compiled_serializer(self):
+        if getattr(settings, 'LITTLELEMON_COMPILED_SERIALIZERS', False):
+            return compile_serializer(self.get_serializer_class())
+        return None
+
+    def compiled_values(self, compiled, queryset):
+        extra = [term.lstrip('-') for term in getattr(self, 'keyset_ordering', ())]
+        extra += [term.lstrip('-') for term in getattr(self, 'ordering_fields', None) or ()]
+        return compiled.values(queryset, ['id', *extra])
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.get_compiled_serializer()
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = self.compiled_values(compiled, self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(compiled.render_many(page))
+        return Response(compiled.render_many(rows))
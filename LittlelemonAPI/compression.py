@@ -0,0 +1,110 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Each codec compresses whole bodies with `compress` and streams with a compressor object exposing
+# `compress(chunk)` and `flush()`.
+class GzipCodec:
+    name = 'gzip'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compressor(self):
+        # wbits=31 writes a gzip header with a zero mtime, so equal bodies compress identically.
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        compressor = self.compressor()
+        return compressor.compress(data) + compressor.flush()
+
+
+class BrotliCodec:
+    name = 'br'
+
+    def __init__(self, quality=5):
+        self.quality = quality
+
+    def compressor(self):
+        return _BrotliStream(brotli.Compressor(quality=self.quality))
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.quality)
+
+
+class _BrotliStream:
+    def __init__(self, compressor):
+        self._compressor = compressor
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compressor(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+
+def available_codecs(config):
+    """Codecs usable in this process, in order of preference."""
+    codecs = []
+    if brotli is not None:
+        codecs.append(BrotliCodec(config.get('BROTLI_QUALITY', 5)))
+    if zstandard is not None:
+        codecs.append(ZstdCodec(config.get('ZSTD_LEVEL', 3)))
+    codecs.append(GzipCodec(config.get('GZIP_LEVEL', 6)))
+    return codecs
+
+
+def accepted_encodings(header):
+    """Content codings named in an Accept-Encoding header, without the ones given q=0."""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def compress_stream(codec, chunks):
+    compressor = codec.compressor()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def acompress_stream(codec, chunks):
+    compressor = codec.compressor()
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def _configure_sqlite(sender, connection, **kwargs):
+    """
+    Apply `LITTLELEMON_SQLITE_PRAGMAS` to every new SQLite connection. They must be per-connection
+    pragmas: persistent ones, such as the journal mode, would rewrite the database file on every
+    connection (see migration 0014).
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'LITTLELEMON_SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,79 @@
+from django.db import connection, transaction
+from django.db.models import Prefetch
+
+from rest_framework.exceptions import ValidationError
+
+from . import roles, changes, rollups
+from .models import Order, OrderItem
+
+def with_items(queryset):
+    """`queryset` with the order items prefetched in one extra query."""
+    return queryset.prefetch_related(Prefetch('orderitems', queryset=OrderItem.objects.order_by('id')))
+
+
+def queue():
+    """Unassigned open orders, oldest first; served by the partial index `order_crew_open_idx`."""
+    return Order.objects.filter(delivery_crew__isnull=True, status=False).order_by('date', 'id')
+
+
+def open_orders(crew):
+    """Open orders assigned to `crew`, oldest first; served by `order_crew_open_idx`."""
+    return Order.objects.filter(delivery_crew=crew, status=False).order_by('date', 'id')
+
+
+def claim_next(crew):
+    """
+    Assign the oldest unassigned order to `crew` and return its id, or None when the queue is empty.
+    Concurrent claims never get the same order.
+
+    With SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL) each claimer locks the first row nobody else
+    has locked. Elsewhere (SQLite) the select and a conditional UPDATE, which only succeeds while the
+    order is still unassigned, run in one transaction; with IMMEDIATE transactions that takes the
+    write lock up front, so claims are serialized and the first candidate is always won. Without
+    it, a claimer that loses the race retries until the queue is empty, never giving up earlier.
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            order_id = queue().select_for_update(skip_locked=True).values_list('id', flat=True).first()
+            if order_id is not None:
+                Order.objects.filter(pk=order_id).update(delivery_crew=crew)
+                changes.record_updates([order_id])
+                rollups.mark_orders([order_id])
+            return order_id
+
+    while True:
+        with transaction.atomic():
+            order_id = queue().values_list('id', flat=True).first()
+            if order_id is None:
+                return None
+            if Order.objects.filter(pk=order_id, delivery_crew__isnull=True, status=False).update(delivery_crew=crew):
+                changes.record_updates([order_id])
+                rollups.mark_orders([order_id])
+                return order_id
+
+
+def assign(order_ids, crew):
+    """
+    Assign the open orders among `order_ids` to `crew`, reassigning those that already have a crew,
+    with the same number of queries whatever the number of orders. Returns the assigned ids;
+    delivered and unknown orders are left alone.
+    """
+    if not roles.is_delivery_crew(crew):
+        raise ValidationError({'delivery_crew': ['This user is not in the delivery crew.']})
+    with transaction.atomic():
+        assigned = list(Order.objects.select_for_update().filter(pk__in=order_ids, status=False)
+                        .values_list('id', flat=True))
+        Order.objects.filter(pk__in=assigned).update(delivery_crew=crew)
+        changes.record_updates(assigned)
+        rollups.mark_orders(assigned)
+    return assigned
+
+
+def mark_delivered(crew, order_id):
+    """Mark an open order of `crew` as delivered; False when it is not one of theirs."""
+    with transaction.atomic():
+        if not Order.objects.filter(pk=order_id, delivery_crew=crew, status=False).update(status=True):
+            return False
+        changes.record_updates([order_id])
+        rollups.mark_orders([order_id])
+    return True
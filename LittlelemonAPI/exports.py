@@ -0,0 +1,86 @@
+import csv
+import json
+from itertools import islice
+
+from rest_framework.renderers import BaseRenderer
+
+from .models import OrderItem
+
+ORDER_COLUMNS = ('id', 'user', 'delivery_crew', 'status', 'date', 'total')
+ITEM_COLUMNS = ('menuitem', 'quantity', 'unit_price', 'price')
+CSV_HEADER = ('order',) + ORDER_COLUMNS[1:] + ITEM_COLUMNS
+
+
+# The export renderers only make the formats negotiable (`?format=ndjson|csv`); the export view
+# streams its rows itself, so `render` is only used for error responses.
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data) + '\n').encode()
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        buffer = Echo()
+        return ''.join(csv.writer(buffer).writerow([key, value]) for key, value in dict(data).items()).encode()
+
+
+class Echo:
+    """File-like object whose `write` returns the line, so csv.writer can feed a generator."""
+    def write(self, value):
+        return value
+
+
+def iter_orders(queryset, chunk_size=2000):
+    """
+    Yield `(order, items)` tuples from `queryset` without materializing it. Orders are read as plain
+    tuples through `.iterator(chunk_size=...)`; the items of each chunk come from one extra query.
+    """
+    rows = queryset.values_list('id', 'user_id', 'delivery_crew_id', 'status', 'date', 'total') \
+        .iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        items = {}
+        for order_id, *item in OrderItem.objects.filter(order_id__in=[row[0] for row in chunk]) \
+                .order_by('id').values_list('order_id', 'menuitem_id', 'quantity', 'unit_price', 'price'):
+            items.setdefault(order_id, []).append(item)
+        for row in chunk:
+            yield row, items.get(row[0], [])
+
+
+def _value(value):
+    if value is None or isinstance(value, (bool, int)):
+        return value
+    return str(value)
+
+
+def dumps(data):
+    """One NDJSON line; decimals and other non-JSON values are written as strings."""
+    return json.dumps(data, separators=(',', ':'), default=str) + '\n'
+
+
+def ndjson_lines(queryset, chunk_size=2000):
+    for order, items in iter_orders(queryset, chunk_size):
+        data = dict(zip(ORDER_COLUMNS, map(_value, order)))
+        data['orderitem'] = [
+            {'order': order[0], **dict(zip(ITEM_COLUMNS, map(_value, item)))} for item in items
+        ]
+        yield dumps(data)
+
+
+def csv_lines(queryset, chunk_size=2000):
+    """One line per order item; orders without items get a single line with empty item columns."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order, items in iter_orders(queryset, chunk_size):
+        for item in items or [(None,) * len(ITEM_COLUMNS)]:
+            yield writer.writerow(order + tuple(item))
@@ -0,0 +1,114 @@
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+# SQLite FTS5 index over MenuItem.title, created and kept in sync by triggers in migration 0007.
+MENUITEM_FTS_TABLE = 'LittlelemonAPI_menuitem_fts'
+
+
+def parse_bool(value):
+    value = value.lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+
+# The `Filter` class maps one query parameter onto a queryset lookup, e.g.
+# `'price_min': Filter('price__gte', Decimal)`.
+class Filter:
+    def __init__(self, lookup, parse=str):
+        self.lookup = lookup
+        self.parse = parse
+
+    def apply(self, queryset, value):
+        return queryset.filter(**{self.lookup: value})
+
+
+# The `PrefixFilter` class matches values starting with the given text. It is written as a range
+# (field >= 'abc' AND field < 'abd') so the B-tree index on the column can be used, which LIKE
+# 'abc%' cannot do on SQLite.
+class PrefixFilter(Filter):
+    def __init__(self, field):
+        super().__init__(field)
+
+    def apply(self, queryset, value):
+        upper = value[:-1] + chr(ord(value[-1]) + 1)
+        return queryset.filter(**{f'{self.lookup}__gte': value, f'{self.lookup}__lt': upper})
+
+
+# The `FullTextFilter` class searches the FTS5 title index on SQLite: every word of the query must
+# match the start of a word in the title. Other databases fall back to a case-insensitive substring
+# match.
+class FullTextFilter(Filter):
+    def __init__(self, field, table):
+        super().__init__(field)
+        self.table = table
+
+    def apply(self, queryset, value):
+        words = re.findall(r'\w+', value)
+        if not words:
+            return queryset
+        if not fts_available(self.table):
+            return queryset.filter(**{f'{self.lookup}__icontains': value})
+        match = ' '.join('"%s"*' % word for word in words)
+        rowids = RawSQL(f'SELECT rowid FROM "{self.table}" WHERE "{self.table}" MATCH %s', [match])
+        return queryset.filter(pk__in=rowids)
+
+
+_fts_tables = {}
+
+
+def fts_available(table):
+    if table not in _fts_tables:
+        _fts_tables[table] = connection.vendor == 'sqlite' and table in connection.introspection.table_names()
+    return _fts_tables[table]
+
+
+# The `DeclarativeFilterBackend` class applies the `query_filters` mapping of a view. Every
+# parameter is parsed before it reaches the ORM, and bad values are reported together as a 400.
+class DeclarativeFilterBackend(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        errors = {}
+        for name, query_filter in getattr(view, 'query_filters', {}).items():
+            value = request.query_params.get(name)
+            if value in (None, ''):
+                continue
+            try:
+                queryset = query_filter.apply(queryset, query_filter.parse(value))
+            except (ValueError, InvalidOperation, DjangoValidationError):
+                errors[name] = [f'Invalid value "{value}".']
+        if errors:
+            raise ValidationError(errors)
+        return queryset
+
+
+MENUITEM_FILTERS = {
+    'category': Filter('category_id', int),
+    'featured': Filter('featured', parse_bool),
+    'price_min': Filter('price__gte', Decimal),
+    'price_max': Filter('price__lte', Decimal),
+    'title': PrefixFilter('title'),
+    'search': FullTextFilter('title', MENUITEM_FTS_TABLE),
+}
+
+ORDER_FILTERS = {
+    'status': Filter('status', parse_bool),
+    'date_from': Filter('date__gte', date.fromisoformat),
+    'date_to': Filter('date__lte', date.fromisoformat),
+    'delivery_crew': Filter('delivery_crew_id', int),
+    'user': Filter('user_id', int),
+}
+
+ROLLUP_FILTERS = {
+    'date_from': Filter('date__gte', date.fromisoformat),
+    'date_to': Filter('date__lte', date.fromisoformat),
+}
@@ -0,0 +1,135 @@
+"""
+Bulk menu changes for managers: importing categories and menu items, and mass price updates.
+
+Imports read and validate all their rows first, then upsert them in batches with INSERT ... ON
+CONFLICT DO UPDATE, keyed on the category slug and the menu item title, all in one transaction.
+The transaction is only opened once the whole input has been read, so the database is not locked
+while an upload is still being received. Invalid rows are reported and skipped; the others are
+still imported. Bulk writes send no signals, so the catalogue version is bumped once the
+transaction commits.
+"""
+import csv
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Value
+from django.db.models.functions import Greatest, Least, Round
+from django.utils import timezone
+
+from rest_framework.exceptions import ParseError, ValidationError
+
+from . import catalogue
+from .models import Category, MenuItem
+from .serializers import CategoryImportSerializer, MenuItemImportSerializer
+
+BATCH_SIZE = 1000
+
+# Largest price that fits `MenuItem.price`.
+MAX_PRICE = Decimal('9999.99')
+
+
+class ImportAborted(Exception):
+    pass
+
+
+def _upsert_categories(rows, context):
+    Category.objects.bulk_create(
+        [Category(**row) for row in rows],
+        update_conflicts=True, unique_fields=['slug'], update_fields=['title', 'updated_at'],
+    )
+
+
+def _resolve_category(row, context):
+    # Categories are read once per import, not once per row.
+    if context.get('categories') is None:
+        context['categories'] = dict(Category.objects.values_list('slug', 'id'))
+    category_id = context['categories'].get(row['category'])
+    if category_id is None:
+        raise ValidationError({'category': [f'Unknown category "{row["category"]}".']})
+    return {**row, 'category': category_id}
+
+
+def _upsert_menu_items(rows, context):
+    MenuItem.objects.bulk_create(
+        [MenuItem(title=row['title'], price=row['price'], featured=row['featured'], category_id=row['category'])
+         for row in rows],
+        update_conflicts=True, unique_fields=['title'], update_fields=['price', 'featured', 'category', 'updated_at'],
+    )
+
+
+# Kind -> (row serializer, the row field that identifies the object, per-row resolution, upsert).
+KINDS = {
+    'categories': (CategoryImportSerializer, 'slug', None, _upsert_categories),
+    'menu-items': (MenuItemImportSerializer, 'title', _resolve_category, _upsert_menu_items),
+}
+
+
+def validate_rows(kind, rows, context):
+    """Yield `(number, validated row, None)` or `(number, None, errors)` for each of `rows`."""
+    serializer_class, _, resolve, _ = KINDS[kind]
+    serializer = serializer_class()
+    try:
+        for number, row in enumerate(rows, start=1):
+            try:
+                if isinstance(row, ParseError):
+                    raise ValidationError({'non_field_errors': [str(row.detail)]})
+                if not isinstance(row, dict):
+                    raise ValidationError({'non_field_errors': ['Expected an object.']})
+                data = serializer.run_validation(row)
+                if resolve is not None:
+                    data = resolve(data, context)
+            except ValidationError as exc:
+                yield number, None, exc.detail
+            else:
+                yield number, data, None
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise ImportAborted(f'Unreadable input - {exc}')
+
+
+def import_rows(kind, rows, batch_size=BATCH_SIZE):
+    """
+    Import `rows` (dicts) of `kind`, 'categories' or 'menu-items'. Yields `{'row': n, 'errors': {...}}`
+    for every invalid row as it is found, then writes the valid ones in one transaction and yields a
+    summary. When a row repeats the key of an earlier one, the later row wins.
+    """
+    _, key, _, upsert = KINDS[kind]
+    failed = 0
+    valid = {}
+    context = {}
+    try:
+        for number, data, errors in validate_rows(kind, rows, context):
+            if errors is not None:
+                failed += 1
+                yield {'row': number, 'errors': errors}
+            else:
+                valid[data[key]] = data
+    except ImportAborted as exc:
+        yield {'imported': 0, 'failed': failed, 'detail': f'{exc}; nothing was imported.'}
+        return
+    valid = list(valid.values())
+    with transaction.atomic():
+        for start in range(0, len(valid), batch_size):
+            upsert(valid[start:start + batch_size], context)
+        if valid:
+            transaction.on_commit(catalogue.bump_version)
+    yield {'imported': len(valid), 'failed': failed}
+
+
+def update_prices(queryset, percent=None, amount=None):
+    """
+    Change the price of every menu item in `queryset` by `percent` or by `amount`, with a single
+    UPDATE. Prices are rounded to cents and kept between 0 and `MAX_PRICE`. Returns the number of
+    items changed.
+    """
+    field = DecimalField(max_digits=6, decimal_places=2)
+    if percent is not None:
+        price = F('price') * Value(1 + percent / 100, output_field=DecimalField(max_digits=9, decimal_places=4))
+    else:
+        price = F('price') + Value(amount, output_field=field)
+    price = Least(Greatest(Round(price, 2, output_field=field), Value(Decimal('0.00'), output_field=field)),
+                  Value(MAX_PRICE, output_field=field), output_field=field)
+    with transaction.atomic():
+        count = queryset.update(price=price, updated_at=timezone.now())
+        if count:
+            transaction.on_commit(catalogue.bump_version)
+    return count
@@ -0,0 +1,93 @@
+"""
+Data lifecycle: delivered orders are moved out of the live order tables once they are old enough,
+and carts nobody has touched for a while are deleted, so `Order`, `OrderItem` and `Cart` only grow
+with recent activity.
+
+Archiving copies a batch of orders and their items into `ArchivedOrder` and `ArchivedOrderItem`
+with their ids, then deletes them from the live tables, one transaction per batch. Rows are copied
+with INSERT ... SELECT, so they never pass through Python, and the deletes are raw (no signals):
+a move is not a change of the order, so nothing is written to the change feed, and the sales
+rollups count archived orders too, so their days stay valid.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import DateTimeField, Max, Value
+from django.utils import timezone
+
+from .models import Order, OrderItem, ArchivedOrder, ArchivedOrderItem, Cart
+
+ORDER_FIELDS = ('id', 'user', 'delivery_crew', 'status', 'total', 'item_count', 'date', 'archived_at')
+ITEM_FIELDS = ('id', 'order', 'menuitem', 'quantity', 'unit_price', 'price')
+
+
+def get_config():
+    config = getattr(settings, 'LITTLELEMON_LIFECYCLE', {})
+    return {
+        'ARCHIVE_AFTER_DAYS': config.get('ARCHIVE_AFTER_DAYS', 180),
+        'CART_EXPIRY_DAYS': config.get('CART_EXPIRY_DAYS', 30),
+        'BATCH_SIZE': config.get('BATCH_SIZE', 1000),
+    }
+
+
+def archivable(days=None):
+    """Delivered orders dated more than `days` (`ARCHIVE_AFTER_DAYS`) days ago."""
+    days = get_config()['ARCHIVE_AFTER_DAYS'] if days is None else days
+    return Order.objects.filter(status=True, date__lt=timezone.localdate() - timedelta(days=days))
+
+
+def copy_rows(queryset, model, fields):
+    """Insert `fields` of every row of `queryset` into the table of `model`, with one INSERT ... SELECT."""
+    connection = connections[queryset.db]
+    select, params = queryset.values_list(*fields).query.get_compiler(queryset.db).as_sql()
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {table} ({columns}) {select}', params)
+
+
+def archive_orders(days=None, batch_size=None):
+    """
+    Move `archivable(days)` orders and their items to the archive tables, oldest id first, with
+    `batch_size` orders per transaction. Yields the number of orders moved by each batch.
+    """
+    batch_size = batch_size or get_config()['BATCH_SIZE']
+    orders = archivable(days).order_by('id')
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            ids = list(orders.select_for_update().filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return
+            moved = Order.objects.filter(pk__in=ids).annotate(
+                archived_at=Value(timezone.now(), output_field=DateTimeField()))
+            items = OrderItem.objects.filter(order_id__in=ids)
+            copy_rows(moved, ArchivedOrder, ORDER_FIELDS)
+            copy_rows(items, ArchivedOrderItem, ITEM_FIELDS)
+            items._raw_delete(items.db)
+            moved._raw_delete(moved.db)
+        last_id = ids[-1]
+        yield len(ids)
+
+
+def expire_carts(days=None, batch_size=None):
+    """
+    Delete the carts whose rows were all last written more than `days` (`CART_EXPIRY_DAYS`) days
+    ago, `batch_size` users per transaction. Yields the number of cart rows deleted by each batch.
+    """
+    config = get_config()
+    days = config['CART_EXPIRY_DAYS'] if days is None else days
+    batch_size = batch_size or config['BATCH_SIZE']
+    cutoff = timezone.now() - timedelta(days=days)
+    stale = Cart.objects.order_by().values('user').annotate(touched=Max('updated_at')) \
+        .filter(touched__lt=cutoff).values_list('user', flat=True)
+    while True:
+        with transaction.atomic():
+            users = list(stale[:batch_size])
+            if not users:
+                return
+            # A cart touched since it was found stale is kept whole.
+            touched = Cart.objects.filter(user__in=users, updated_at__gte=cutoff).values('user')
+            deleted, _ = Cart.objects.filter(user__in=users).exclude(user__in=touched).delete()
+        yield deleted
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from LittlelemonAPI import lifecycle
+
+
+class Command(BaseCommand):
+    help = 'Move delivered orders older than the archive age, with their items, to the archive tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Archive orders dated more than this many days ago "
+                                                     "(default: LITTLELEMON_LIFECYCLE['ARCHIVE_AFTER_DAYS']).")
+        parser.add_argument('--batch-size', type=int, help='Orders moved per transaction.')
+
+    def handle(self, *args, **options):
+        archived = 0
+        for count in lifecycle.archive_orders(days=options['days'], batch_size=options['batch_size']):
+            archived += count
+            self.stdout.write(f'{archived} order(s) archived')
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} order(s).'))
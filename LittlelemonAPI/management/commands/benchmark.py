@@ -0,0 +1,79 @@
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from LittlelemonAPI.benchmarks import SCENARIOS, compare, save_baseline
+
+
+class Command(BaseCommand):
+    help = 'Run the in-process benchmark scenarios against a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f'Scenarios to run: {", ".join(SCENARIOS)}.')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--rows', type=int, default=100000,
+                            help='Table size for the scaling scenarios, e.g. 1000000 orders.')
+        parser.add_argument('--save-baseline', metavar='FILE', help='Write the results to a JSON baseline file.')
+        parser.add_argument('--baseline', metavar='FILE',
+                            help='Compare the results with a JSON baseline file and fail on regressions.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Share by which latency and throughput may get worse than the baseline.')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            different = {key: value for key, value in baseline['meta'].items()
+                         if key in ('iterations', 'rows') and value != options[key]}
+            if different:
+                self.stderr.write(f'The baseline was recorded with {different}; results may not be comparable.')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        results = {}
+        # Scenarios send far more requests than the rate limits allow; `throttle` turns them back on.
+        throttling_off = override_settings(LITTLELEMON_THROTTLING={**settings.LITTLELEMON_THROTTLING, 'ENABLED': False})
+        throttling_off.enable()
+        try:
+            for name in names:
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                # Each scenario starts from an empty database.
+                if SCENARIOS[name].atomic:
+                    with transaction.atomic():
+                        rows = SCENARIOS[name](options)
+                        transaction.set_rollback(True)
+                else:
+                    try:
+                        rows = SCENARIOS[name](options)
+                    finally:
+                        call_command('flush', interactive=False, verbosity=0)
+                results[name] = rows
+                for row in rows:
+                    self.stdout.write(self.format_row(row))
+            if options['save_baseline']:
+                save_baseline(options['save_baseline'], results, options)
+        finally:
+            throttling_off.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if baseline is not None:
+            regressions = compare(baseline, results, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def format_row(self, row):
+        return '  '.join(
+            f'{key}={value:.3f}' if isinstance(value, float) else f'{key}={value}'
+            for key, value in row.items()
+        )
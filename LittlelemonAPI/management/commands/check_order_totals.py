@@ -0,0 +1,54 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import DecimalField, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+from LittlelemonAPI import rollups
+from LittlelemonAPI.models import Order, OrderItem
+
+
+def expected_totals():
+    """Order totals and item counts recomputed from the items, as expressions on `Order`."""
+    items = OrderItem.objects.filter(order=OuterRef('pk')).values('order')
+    return {
+        # Rounded, since SQLite sums decimals as floating point.
+        'total': Round(Coalesce(Subquery(items.annotate(total=Sum('price')).values('total')), Value(Decimal('0.00'))),
+                       2, output_field=DecimalField(max_digits=10, decimal_places=2)),
+        'item_count': Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')), Value(0)),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Recompute order totals and item counts from the order items and report the orders that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Overwrite drifted orders with the recomputed values.')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Orders checked per query.')
+
+    def handle(self, *args, **options):
+        expected = expected_totals()
+        drifted = Order.objects.annotate(expected_total=expected['total'], expected_count=expected['item_count']) \
+            .filter(~Q(total=F('expected_total')) | ~Q(item_count=F('expected_count'))) \
+            .values_list('id', 'total', 'expected_total', 'item_count', 'expected_count')
+        last_id = Order.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        batch_size = options['batch_size']
+        found = 0
+        for start in range(0, last_id + 1, batch_size):
+            with transaction.atomic():
+                rows = list(drifted.filter(id__gte=start, id__lt=start + batch_size))
+                for order_id, total, expected_total, item_count, expected_count in rows:
+                    self.stdout.write(f'order {order_id}: total {total:.2f} (items: {expected_total:.2f}), '
+                                      f'item_count {item_count} (items: {expected_count})')
+                if rows and options['fix']:
+                    Order.objects.filter(id__in=[row[0] for row in rows]).update(**expected)
+                    rollups.mark_orders([row[0] for row in rows])
+            found += len(rows)
+
+        if not found:
+            self.stdout.write(self.style.SUCCESS('All order totals match their items.'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Fixed {found} order(s).'))
+        else:
+            raise CommandError(f'{found} order(s) drifted from their items; rerun with --fix to repair them.')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from LittlelemonAPI import lifecycle
+
+
+class Command(BaseCommand):
+    help = 'Delete the carts nobody has touched for the cart expiry age.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Expire carts untouched for this many days "
+                                                     "(default: LITTLELEMON_LIFECYCLE['CART_EXPIRY_DAYS']).")
+        parser.add_argument('--batch-size', type=int, help='Carts (users) deleted per transaction.')
+
+    def handle(self, *args, **options):
+        deleted = sum(lifecycle.expire_carts(days=options['days'], batch_size=options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} cart row(s).'))
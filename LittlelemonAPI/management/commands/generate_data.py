@@ -0,0 +1,30 @@
+from dataclasses import fields
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittlelemonAPI.synthetic import Counts, generate
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with reproducible synthetic menu, user, cart and order data using bulk inserts.'
+
+    def add_arguments(self, parser):
+        for field in fields(Counts):
+            parser.add_argument(f'--{field.name.replace("_", "-")}', type=int, default=field.default)
+        parser.add_argument('--seed', type=int, default=0, help='Same counts and seed give the same data.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT.')
+        parser.add_argument('--password', default='pass', help='Password of every generated user.')
+        parser.add_argument('--prefix', default='synthetic', help='Prefix of generated usernames and slugs.')
+
+    def handle(self, *args, **options):
+        counts = Counts(**{field.name: options[field.name] for field in fields(Counts)})
+        if counts.orders and not (counts.customers and counts.menu_items):
+            raise CommandError('Orders need at least one customer and one menu item.')
+        if counts.categories < 1 and counts.menu_items:
+            raise CommandError('Menu items need at least one category.')
+        inserted = generate(counts, seed=options['seed'], batch_size=options['batch_size'],
+                            password=options['password'], prefix=options['prefix'],
+                            log=lambda message: self.stdout.write(f'  {message}'))
+        self.stdout.write(self.style.SUCCESS(
+            'Inserted ' + ', '.join(f'{count} {name.replace("_", " ")}' for name, count in inserted.items()) + '.'
+        ))
@@ -0,0 +1,44 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittlelemonAPI.exports import dumps
+from LittlelemonAPI.imports import BATCH_SIZE, KINDS, import_rows
+from LittlelemonAPI.parsers import CSVRowParser, NDJSONRowParser
+
+FORMATS = ('csv', 'json', 'ndjson')
+
+
+class Command(BaseCommand):
+    help = 'Upsert categories or menu items from a CSV, JSON or NDJSON file in one transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(KINDS))
+        parser.add_argument('file')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per INSERT.')
+
+    def handle(self, *args, **options):
+        path = Path(options['file'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(f'Cannot tell the format of {path}; pass --format.')
+        with path.open('rb') as file:
+            if file_format == 'csv':
+                rows = CSVRowParser().parse(file)
+            elif file_format == 'ndjson':
+                rows = NDJSONRowParser().parse(file)
+            else:
+                rows = json.load(file)
+                if not isinstance(rows, list):
+                    raise CommandError('Expected a JSON array of rows.')
+            for line in import_rows(options['kind'], rows, batch_size=options['batch_size']):
+                if 'row' in line:
+                    self.stdout.write(dumps(line), ending='')
+                    continue
+                if 'detail' in line:
+                    raise CommandError(line['detail'])
+                self.stdout.write(self.style.SUCCESS(
+                    f'Imported {line["imported"]} {options["kind"].replace("-", " ")}, {line["failed"]} row(s) failed.'
+                ))
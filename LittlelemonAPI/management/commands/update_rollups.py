@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from LittlelemonAPI import rollups
+
+
+class Command(BaseCommand):
+    help = ('Refresh the daily sales rollups of the days marked out of date and of the days with orders newer '
+            'than the rollups.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild the rollups of every day.')
+        parser.add_argument('--batch-days', type=int, help='Days refreshed per transaction.')
+
+    def handle(self, *args, **options):
+        refreshed = 0
+        for batch in rollups.catch_up(full=options['full'], batch_days=options['batch_days']):
+            refreshed += len(batch)
+            self.stdout.write(f'{batch[0]} .. {batch[-1]}: {len(batch)} day(s)')
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} day(s).'))
@@ -0,0 +1,31 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittlelemonAPI import rollups
+
+
+def describe(values):
+    if values is None:
+        return 'missing'
+    return ' / '.join(map(str, values)) if isinstance(values, tuple) else str(values)
+
+
+class Command(BaseCommand):
+    help = 'Compare the daily sales rollups with aggregates of the orders and report the rows that differ.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', type=date.fromisoformat, help='First day checked (YYYY-MM-DD).')
+        parser.add_argument('--date-to', type=date.fromisoformat, help='Last day checked (YYYY-MM-DD).')
+
+    def handle(self, *args, **options):
+        mismatches, pending = rollups.verify(options['date_from'], options['date_to'])
+        for table, key, row, expected in mismatches:
+            self.stdout.write(f'{table} {describe(key)}: rollup {describe(row)}, orders {describe(expected)}')
+        if pending:
+            self.stdout.write(f'{len(pending)} day(s) marked out of date were not checked; '
+                              f'run update_rollups first.')
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} rollup row(s) differ from the orders; '
+                               f'rerun update_rollups with --full to rebuild them.')
+        self.stdout.write(self.style.SUCCESS('The rollups match the orders.'))
@@ -0,0 +1,212 @@
+"""
+Per-endpoint request metrics: wall time, database queries and time, serializer time and response
+size, kept as histograms per view and exposed in the Prometheus text format.
+
+`middleware.InstrumentationMiddleware` samples requests and collects a `RequestSample` for each sampled one.
+Queries are timed by an execute wrapper that every new connection gets, and which records into the
+sample of the current request. It finds that sample through a context variable, so it also works for
+queries that async views run in a worker thread. Serializer time is the time spent in compiled
+serializers and in serializer `.data` of the list and retrieve responses of `views.TimedReadMixin`
+and the async views; other serializer use is not timed.
+
+Histograms are per process. Scrape each worker, or run one worker per metrics endpoint.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Name -> (help, buckets) of the per-view histograms.
+HISTOGRAMS = {
+    'littlelemon_request_duration_seconds': ('Wall time of sampled requests.', DURATION_BUCKETS),
+    'littlelemon_db_queries': ('Database queries per sampled request.', QUERY_BUCKETS),
+    'littlelemon_db_duration_seconds': ('Database time per sampled request.', DURATION_BUCKETS),
+    'littlelemon_serializer_duration_seconds': ('Serializer time per sampled request.', DURATION_BUCKETS),
+    'littlelemon_response_size_bytes': ('Body size of sampled non-streaming responses.', SIZE_BUCKETS),
+}
+
+# Queries kept per sample for the slow-request log.
+MAX_LOGGED_QUERIES = 100
+
+_current = ContextVar('littlelemon_request_sample', default=None)
+
+
+def get_config():
+    config = getattr(settings, 'LITTLELEMON_METRICS', {})
+    return {
+        'SAMPLE_RATE': config.get('SAMPLE_RATE', 1.0),
+        'SLOW_REQUEST_SECONDS': config.get('SLOW_REQUEST_SECONDS', 1.0),
+    }
+
+
+# The `Histogram` class counts observations per bucket; `Registry.render` makes the counts cumulative
+# as Prometheus expects.
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# The `Registry` class holds the histograms and request counters by label set.
+class Registry:
+    def __init__(self):
+        self._histograms = {}
+        self._requests = {}
+        self._lock = Lock()
+
+    def observe(self, sample, view, method, status):
+        values = {
+            'littlelemon_request_duration_seconds': sample.duration,
+            'littlelemon_db_queries': sample.queries,
+            'littlelemon_db_duration_seconds': sample.db_time,
+            'littlelemon_serializer_duration_seconds': sample.serializer_time,
+        }
+        if sample.size is not None:
+            values['littlelemon_response_size_bytes'] = sample.size
+        labels = (('view', view), ('method', method))
+        with self._lock:
+            for name, value in values.items():
+                histogram = self._histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self._histograms[(name, labels)] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+            key = labels + (('status', str(status)),)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._requests.clear()
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()}
+            requests = dict(self._requests)
+        lines = []
+        for name, (help_text, _) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (metric, labels), (counts, total, count, buckets) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip((*buckets, '+Inf'), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {count}')
+        lines += ['# HELP littlelemon_requests_total Sampled requests.', '# TYPE littlelemon_requests_total counter']
+        lines += [f'littlelemon_requests_total{format_labels(labels)} {count}'
+                  for labels, count in sorted(requests.items())]
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{%s}' % ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped))
+
+
+registry = Registry()
+
+
+def render():
+    """`registry` plus the sample rate and the token cache counters, for the metrics endpoint."""
+    from .authentication import get_token_cache
+
+    stats = get_token_cache().stats()
+    lines = [
+        '# HELP littlelemon_metrics_sample_rate Share of requests that are sampled.',
+        '# TYPE littlelemon_metrics_sample_rate gauge',
+        f'littlelemon_metrics_sample_rate {get_config()["SAMPLE_RATE"]}',
+        '# HELP littlelemon_token_cache_lookups_total Token cache lookups by outcome.',
+        '# TYPE littlelemon_token_cache_lookups_total counter',
+    ]
+    lines += [f'littlelemon_token_cache_lookups_total{{outcome="{outcome}"}} {stats[outcome]}'
+              for outcome in ('hit', 'negative_hit', 'miss')]
+    return registry.render() + '\n'.join(lines) + '\n'
+
+
+# The `RequestSample` class accumulates the measurements of one sampled request.
+class RequestSample:
+    def __init__(self):
+        self.start = perf_counter()
+        self.duration = 0
+        self.queries = 0
+        self.db_time = 0
+        self.serializer_time = 0
+        self.serializing = False
+        self.size = None
+        self.sql = []
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        if len(self.sql) < MAX_LOGGED_QUERIES:
+            self.sql.append((sql, duration))
+
+
+def _execute(execute, sql, params, many, context):
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.record_query(sql, perf_counter() - start)
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+@contextmanager
+def serializing():
+    """Count the time spent in the block as serializer time of the current sample, once if nested."""
+    sample = _current.get()
+    if sample is None or sample.serializing:
+        yield
+        return
+    sample.serializing = True
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        sample.serializer_time += perf_counter() - start
+        sample.serializing = False
+
+
+def start_sample():
+    """Start measuring the current request; returns the sample and a token for `end_sample`."""
+    sample = RequestSample()
+    return sample, _current.set(sample)
+
+
+def end_sample(token):
+    _current.reset(token)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    view_class = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None)
+    return (view_class or match.func).__name__
@@ -0,0 +1,144 @@
+import logging
+import random
+import re
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from . import catalogue, metrics
+from .compression import available_codecs, accepted_encodings, compress_stream, acompress_stream
+
+logger = logging.getLogger('littlelemon.slow_requests')
+
+# Event streams must reach the client chunk by chunk, so they are never compressed.
+UNCOMPRESSED_TYPES = ('text/event-stream',)
+
+
+# The `CompressionMiddleware` class negotiates br, zstd or gzip (whichever are installed, in that
+# order) from Accept-Encoding. Bodies under `MIN_SIZE` are sent as is, streaming responses are
+# compressed chunk by chunk, and compressed catalogue pages are kept in the catalogue cache next to
+# the uncompressed ones. Configured with `LITTLELEMON_COMPRESSION`.
+class CompressionMiddleware(MiddlewareMixin):
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        config = getattr(settings, 'LITTLELEMON_COMPRESSION', {})
+        self.min_size = config.get('MIN_SIZE', 1024)
+        self.codecs = available_codecs(config)
+
+    def select_codec(self, request):
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        for codec in self.codecs:
+            if codec.name in accepted:
+                return codec
+        return None
+
+    def process_response(self, request, response):
+        if response.status_code != 200 or response.has_header('Content-Encoding'):
+            return response
+        if response.get('Content-Type', '').startswith(UNCOMPRESSED_TYPES):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        # The body depends on Accept-Encoding from here on, even when this client gets it plain.
+        patch_vary_headers(response, ('Accept-Encoding',))
+        codec = self.select_codec(request)
+        if codec is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(codec, response.streaming_content)
+            else:
+                response.streaming_content = compress_stream(codec, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            body = self.compress(codec, response)
+            if len(body) >= len(response.content):
+                return response
+            response.content = body
+            response.headers['Content-Length'] = str(len(body))
+
+        # A strong ETag must change with the content coding.
+        if response.has_header('ETag'):
+            response.headers['ETag'] = re.sub(r'^"', 'W/"', response.headers['ETag'])
+        response.headers['Content-Encoding'] = codec.name
+        return response
+
+    def compress(self, codec, response):
+        key = getattr(response, 'catalogue_key', None)
+        if key is None:
+            return codec.compress(response.content)
+        backend = catalogue.get_backend()
+        compressed_key = f'{key}:{codec.name}'
+        body = backend.get(compressed_key)
+        if body is None:
+            body = codec.compress(response.content)
+            backend.set(compressed_key, body)
+        return body
+
+
+# The `InstrumentationMiddleware` class samples `SAMPLE_RATE` of the requests, records them per view
+# in `metrics.registry`, and logs sampled requests slower than `SLOW_REQUEST_SECONDS` with their SQL to the
+# `littlelemon.slow_requests` logger. Unsampled requests only cost a random number. Configured with
+# `LITTLELEMON_METRICS`. It must be listed above `CompressionMiddleware` in `MIDDLEWARE`, so that it
+# wraps it: the measured time then includes compression, and the recorded size is the compressed
+# body as sent. Listed below it, the size would be the uncompressed body and compression untimed.
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = metrics.get_config()
+        self.sample_rate = config['SAMPLE_RATE']
+        self.slow_request_seconds = config['SLOW_REQUEST_SECONDS']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        sample, token = metrics.start_sample()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_sample(token)
+        self.finish(request, response, sample)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        sample, token = metrics.start_sample()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_sample(token)
+        self.finish(request, response, sample)
+        return response
+
+    def finish(self, request, response, sample):
+        # Streaming bodies are produced after this point; only their setup is timed.
+        sample.duration = perf_counter() - sample.start
+        if not response.streaming:
+            sample.size = len(response.content)
+        view = metrics.view_name(request)
+        metrics.registry.observe(sample, view, request.method, response.status_code)
+        if sample.duration >= self.slow_request_seconds:
+            self.log_slow_request(request, response, sample, view)
+
+    def log_slow_request(self, request, response, sample, view):
+        queries = '\n'.join(f'  {duration * 1000:.1f}ms {sql}' for sql, duration in sample.sql)
+        if sample.queries > len(sample.sql):
+            queries += f'\n  ... {sample.queries - len(sample.sql)} more'
+        logger.warning(
+            'Slow request: %s %s (%s) %s in %.1fms, %d queries in %.1fms, serializers %.1fms\n%s',
+            request.method, request.get_full_path(), view, response.status_code, sample.duration * 1000,
+            sample.queries, sample.db_time * 1000, sample.serializer_time * 1000, queries,
+        )
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def check_no_order_items(apps, schema_editor):
+    # Until now `OrderItem.order` pointed at the user, not at an order. A user may have several orders,
+    # so existing rows cannot be mapped to one, and keeping their ids would attach them to whichever
+    # order happens to share the user's id.
+    OrderItem = apps.get_model('LittlelemonAPI', 'OrderItem')
+    count = OrderItem.objects.using(schema_editor.connection.alias).count()
+    if count:
+        raise RuntimeError(
+            f'{count} order item(s) reference users, not orders, and cannot be converted. Export them if '
+            f'needed, delete them (DELETE FROM "{OrderItem._meta.db_table}") and run migrate again.'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittlelemonAPI', '0004_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_no_order_items, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='orderitems', to='LittlelemonAPI.order'),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, check_no_order_items),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+FTS_TABLE = 'LittlelemonAPI_menuitem_fts'
+
+CREATE_FTS = [
+    f"""CREATE VIRTUAL TABLE "{FTS_TABLE}" USING fts5(
+        title, content='LittlelemonAPI_menuitem', content_rowid='id'
+    )""",
+    f'INSERT INTO "{FTS_TABLE}"(rowid, title) SELECT id, title FROM "LittlelemonAPI_menuitem"',
+    f"""CREATE TRIGGER "{FTS_TABLE}_ai" AFTER INSERT ON "LittlelemonAPI_menuitem" BEGIN
+        INSERT INTO "{FTS_TABLE}"(rowid, title) VALUES (new.id, new.title);
+    END""",
+    f"""CREATE TRIGGER "{FTS_TABLE}_ad" AFTER DELETE ON "LittlelemonAPI_menuitem" BEGIN
+        INSERT INTO "{FTS_TABLE}"("{FTS_TABLE}", rowid, title) VALUES ('delete', old.id, old.title);
+    END""",
+    f"""CREATE TRIGGER "{FTS_TABLE}_au" AFTER UPDATE OF title ON "LittlelemonAPI_menuitem" BEGIN
+        INSERT INTO "{FTS_TABLE}"("{FTS_TABLE}", rowid, title) VALUES ('delete', old.id, old.title);
+        INSERT INTO "{FTS_TABLE}"(rowid, title) VALUES (new.id, new.title);
+    END""",
+]
+
+DROP_FTS = [
+    f'DROP TRIGGER IF EXISTS "{FTS_TABLE}_au"',
+    f'DROP TRIGGER IF EXISTS "{FTS_TABLE}_ad"',
+    f'DROP TRIGGER IF EXISTS "{FTS_TABLE}_ai"',
+    f'DROP TABLE IF EXISTS "{FTS_TABLE}"',
+]
+
+
+def fts5_supported(schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+
+
+# The title search index is SQLite-only; other databases use the substring fallback in filters.py.
+# SQLite drops the triggers when a later migration rebuilds the menu item table, so such a
+# migration has to run CREATE_FTS again.
+def create_fts(apps, schema_editor):
+    if fts5_supported(schema_editor):
+        for statement in CREATE_FTS:
+            schema_editor.execute(statement)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_FTS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittlelemonAPI', '0006_order_checkout'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'date'], name='order_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['delivery_crew', 'status'], name='order_crew_status_idx'),
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:57
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_item_count(apps, schema_editor):
+    Order = apps.get_model('LittlelemonAPI', 'Order')
+    OrderItem = apps.get_model('LittlelemonAPI', 'OrderItem')
+    quantities = OrderItem.objects.filter(order=OuterRef('pk')).values('order').annotate(n=Sum('quantity')).values('n')
+    Order.objects.update(item_count=Coalesce(Subquery(quantities), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittlelemonAPI', '0007_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_item_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:38
+
+import importlib
+
+from django.db import migrations, models
+
+filter_indexes = importlib.import_module('LittlelemonAPI.migrations.0007_filter_indexes')
+
+
+# SQLite rebuilds the menu item table for the unique title, which drops the title search triggers.
+def recreate_fts(apps, schema_editor):
+    filter_indexes.drop_fts(apps, schema_editor)
+    filter_indexes.create_fts(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittlelemonAPI', '0010_orderchange'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='menuitem',
+            name='title',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.RunPython(recreate_fts, recreate_fts),
+    ]
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def set_journal_mode(apps, schema_editor, mode=None):
+    # The journal mode is persistent, so it is set here once instead of on every connection.
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    mode = mode or getattr(settings, 'LITTLELEMON_SQLITE_JOURNAL_MODE', 'WAL')
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode = {mode}')
+
+
+def reset_journal_mode(apps, schema_editor):
+    set_journal_mode(apps, schema_editor, mode='DELETE')
+
+
+class Migration(migrations.Migration):
+    # The journal mode cannot be changed inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('LittlelemonAPI', '0013_order_archive_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_journal_mode, reset_journal_mode),
+    ]
@@ -1,47 +1,184 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 
 # Create your models here.
 
-# The `Category` class defines a model with fields for a slug and title.
+# The `Category` class defines a model with fields for a slug and title. The slug identifies the
+# category in menu imports.
 class Category(models.Model):
-    slug = models.SlugField()
+    slug = models.SlugField(unique=True)
     title = models.CharField(max_length=255, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
 # The `MenuItem` class defines a model with fields for title, price, featured status, and a foreign
-# key reference to a `Category` object.
+# key reference to a `Category` object. The title identifies the item in menu imports.
 class MenuItem(models.Model):
-    title = models.CharField(max_length=255, db_index=True)
+    title = models.CharField(max_length=255, unique=True)
     price = models.DecimalField(max_digits=6, decimal_places=2, db_index=True)
     featured = models.BooleanField(db_index=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
 # The `Cart` class represents a model in Python that stores information about a user's selected menu
-# items, quantities, and prices.
+# items, quantities, and prices. `updated_at` is when the row was last written; a cart whose newest
+# row is older than `LITTLELEMON_LIFECYCLE['CART_EXPIRY_DAYS']` is deleted by `expire_carts`.
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.SmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=2)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         unique_together = ('menuitem','user')
 
 # This Python class represents an order with fields for user, delivery crew, status, total, and date.
+# `total` and `item_count` (the summed quantities) are maintained from the order's items.
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='delivery_crew', null=True)
     status = models.BooleanField(db_index=True, default=0)
-    total = models.DecimalField(max_digits=6, decimal_places=2)
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
     date = models.DateField(db_index=True)
-    
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='unique_order_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'date'], name='order_user_date_idx'),
+            models.Index(fields=['delivery_crew', 'status'], name='order_crew_status_idx'),
+            # Open orders only, so it stays small as delivered orders pile up. Serves both a crew
+            # member's open orders and the dispatch queue (delivery_crew IS NULL), oldest first.
+            models.Index(fields=['delivery_crew', 'date', 'id'], name='order_crew_open_idx',
+                         condition=models.Q(status=False)),
+        ]
+
+    @classmethod
+    def adjust_totals(cls, order_id, price, quantity):
+        """Add `price` and `quantity` (negative to subtract) to an order's totals, in the database."""
+        cls.objects.filter(pk=order_id).update(total=F('total') + price, item_count=F('item_count') + quantity)
+
+# Saving or deleting an item adjusts its order's totals in the same transaction. Bulk writes bypass
+# `save`/`delete` and must adjust the totals themselves; `check_order_totals` reports any drift.
 class OrderItem(models.Model):
-    order = models.ForeignKey(User, on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='orderitems')
     menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.SmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=2)
 
     class Meta:
-        unique_together = ('order','menuitem')
\ No newline at end of file
+        unique_together = ('order','menuitem')
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=router.db_for_write(OrderItem, instance=self)):
+            old = None
+            if self.pk is not None:
+                old = OrderItem.objects.filter(pk=self.pk).values_list('order_id', 'price', 'quantity').first()
+            super().save(*args, **kwargs)
+            if old is not None:
+                Order.adjust_totals(old[0], -old[1], -old[2])
+            Order.adjust_totals(self.order_id, self.price, self.quantity)
+
+    def delete(self, *args, **kwargs):
+        # Marked here rather than by a delete signal, which would keep deleting an order from removing
+        # its items with a single DELETE; the order's own delete signal marks its day.
+        from .rollups import mark_orders
+
+        with transaction.atomic(using=router.db_for_write(OrderItem, instance=self)):
+            result = super().delete(*args, **kwargs)
+            Order.adjust_totals(self.order_id, -self.price, -self.quantity)
+            mark_orders([self.order_id])
+        return result
+
+# The `OrderChange` class is the order change log behind the change feed. Its id is the feed cursor.
+# One row is appended per order write, with the order's user, crew and status after the write. The
+# references have no database constraint, so changes outlive deleted orders and users.
+class OrderChange(models.Model):
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    KIND_CHOICES = [(CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted')]
+
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    # Indexed together with the id below.
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                             related_name='+')
+    delivery_crew = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                                      related_name='+', null=True)
+    status = models.BooleanField()
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='orderchange_user_idx'),
+            models.Index(fields=['delivery_crew', 'id'], name='orderchange_crew_idx'),
+        ]
+
+# The rollup tables below hold daily sales totals keyed by `Order.date`, maintained by
+# `LittlelemonAPI/rollups.py`. Order writes mark their dates in `RollupDirtyDay`, and marked days are
+# recomputed from the orders before the rollups are read.
+
+# The `DailySales` class holds the number of orders, the items sold and the revenue of one day.
+class DailySales(models.Model):
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField()
+    items = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2)
+
+# The `DailyMenuItemSales` class holds the quantity sold and the revenue of one menu item on one day.
+class DailyMenuItemSales(models.Model):
+    date = models.DateField()
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField()
+    revenue = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        unique_together = ('date', 'menuitem')
+
+# The `DailyCrewDeliveries` class holds the number of orders of one day assigned to a delivery crew
+# member, and how many of them are delivered.
+class DailyCrewDeliveries(models.Model):
+    date = models.DateField()
+    delivery_crew = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    assigned = models.PositiveIntegerField()
+    delivered = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('date', 'delivery_crew')
+
+# The `RollupDirtyDay` class lists the days whose rollups are out of date.
+class RollupDirtyDay(models.Model):
+    date = models.DateField(primary_key=True)
+
+# The `ArchivedOrder` and `ArchivedOrderItem` classes hold delivered orders moved out of `Order` and
+# `OrderItem` by `archive_orders`, with their original ids, so the live tables and their indexes
+# only hold recent and open orders. Archived orders are read-only.
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='+', null=True)
+    status = models.BooleanField(default=True)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    item_count = models.PositiveIntegerField()
+    date = models.DateField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date'], name='archivedorder_user_date_idx'),
+        ]
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='orderitems')
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -0,0 +1,36 @@
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Cart, Order, OrderItem
+
+
+def checkout(user, idempotency_key=None):
+    """
+    Turn the user's cart into an `Order` with its `OrderItem` rows and empty the cart, all in one
+    transaction and with the same number of queries whatever the cart size. Returns None when the
+    cart is empty.
+
+    A concurrent checkout with the same `idempotency_key` fails the unique constraint on
+    (user, idempotency_key) with an IntegrityError; callers should then return the existing order.
+    """
+    with transaction.atomic():
+        # Lock the cart rows so a concurrent checkout waits and then finds the cart empty.
+        cart = list(
+            Cart.objects.select_for_update()
+            .filter(user=user)
+            .values_list('menuitem_id', 'quantity', 'unit_price', 'price')
+        )
+        if not cart:
+            return None
+        # The items are bulk-inserted below, so the order starts with their totals.
+        totals = Cart.objects.filter(user=user).aggregate(total=Sum('price'), item_count=Sum('quantity'))
+        order = Order.objects.create(
+            user=user, date=timezone.localdate(), idempotency_key=idempotency_key, **totals
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, menuitem_id=menuitem_id, quantity=quantity, unit_price=unit_price, price=price)
+            for menuitem_id, quantity, unit_price, price in cart
+        )
+        Cart.objects.filter(user=user).delete()
+    return order
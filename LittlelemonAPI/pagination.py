@@ -0,0 +1,179 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.paginator import InvalidPage, Page
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+# The `KeysetPagination` class pages through a queryset with a composite cursor such as (date, id)
+# or (price, id). Each page is a single indexed range scan: there is no COUNT(*) and no OFFSET, so
+# latency stays flat however deep the client pages.
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.fields = [queryset.model._meta.get_field(term.lstrip('-')) for term in self.ordering]
+        reverse, position = self.decode_cursor(request)
+
+        ordering = [self.invert(term) for term in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        if size <= 0:
+            return api_settings.PAGE_SIZE
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        """The client's `ordering`, or the view's `keyset_ordering`, made unique by a trailing id."""
+        ordering = list(OrderingFilter().get_ordering(request, queryset, view) or
+                        getattr(view, 'keyset_ordering', ('id',)))
+        for term in ordering:
+            try:
+                field = queryset.model._meta.get_field(term.lstrip('-'))
+            except FieldDoesNotExist:
+                field = None
+            if field is None or not field.concrete or field.null or field.is_relation:
+                raise ValidationError({'ordering': f"'{term}' cannot be used with cursor pagination."})
+        if not {'id', '-id'} & set(ordering):
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        return ordering
+
+    @staticmethod
+    def invert(term):
+        return term[1:] if term.startswith('-') else '-' + term
+
+    @staticmethod
+    def after(ordering, position):
+        """Rows strictly after `position` in `ordering`: (a > x) OR (a = x AND b > y) ..."""
+        query = Q()
+        for i, term in enumerate(ordering):
+            lookup = 'lt' if term.startswith('-') else 'gt'
+            condition = Q(**{f'{term.lstrip("-")}__{lookup}': position[i]})
+            for previous, value in zip(ordering[:i], position[:i]):
+                condition &= Q(**{previous.lstrip('-'): value})
+            query |= condition
+        # The redundant bound on the leading column lets the planner use its index as a range scan
+        # instead of evaluating the OR for every row.
+        first = ordering[0]
+        lookup = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': position[0]}) & query
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if data['o'] != self.ordering or len(data['p']) != len(self.fields):
+                raise ValueError
+            position = [field.to_python(value) for field, value in zip(self.fields, data['p'])]
+            return bool(data.get('r')), position
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse):
+        data = {'o': self.ordering, 'p': [self.position_value(field, instance) for field in self.fields]}
+        if reverse:
+            data['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    @staticmethod
+    def position_value(field, instance):
+        # Pages may hold `.values()` dicts as well as model instances.
+        if isinstance(instance, dict):
+            value = instance[field.name]
+            return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+        return field.value_to_string(instance)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+# The `KeysetOrPageNumberPagination` class keeps the default page-number pagination and switches to
+# `KeysetPagination` when the request carries a `cursor` parameter (`?cursor=` for the first page).
+class KeysetOrPageNumberPagination(PageNumberPagination):
+    keyset_class = KeysetPagination
+    page_size_query_param = KeysetPagination.page_size_query_param
+    max_page_size = KeysetPagination.max_page_size
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+async def apaginate_queryset(paginator, queryset, request):
+    """
+    Async `paginate_queryset` for page-number paginators, counting and slicing with the async ORM.
+    Afterwards `paginator.get_paginated_response` works as usual. Cursor requests are not supported.
+    """
+    page_size = paginator.get_page_size(request)
+    if not page_size:
+        return None
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    django_paginator.count = await queryset.acount()
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        number = django_paginator.validate_number(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    bottom = (number - 1) * page_size
+    paginator.page = Page([obj async for obj in queryset[bottom:bottom + page_size]], number, django_paginator)
+    paginator.request = request
+    if isinstance(paginator, KeysetOrPageNumberPagination):
+        paginator.keyset = None
+    return list(paginator.page)
@@ -0,0 +1,63 @@
+import codecs
+import csv
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from .renderers import FastJSONRenderer, MessagePackRenderer, orjson, msgpack
+
+
+# The `FastJSONParser` class parses request bodies with orjson when it is installed, and with DRF's
+# stdlib-based `JSONParser` otherwise. Like DRF's strict mode, orjson rejects NaN and Infinity.
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None or not self.strict:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+    renderer_class = MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
+
+
+# The row parsers return an iterator that reads the body while it is consumed, so views can process
+# uploads larger than memory. A malformed NDJSON line becomes a `ParseError` in place of its row, and
+# empty CSV cells are left out, so that field defaults apply.
+class NDJSONRowParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return self.rows(stream) if stream is not None else iter(())
+
+    def rows(self, stream):
+        loads = orjson.loads if orjson is not None else json.loads
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                yield loads(line)
+            except ValueError as exc:
+                yield ParseError('JSON parse error - %s' % str(exc))
+
+
+class CSVRowParser(BaseParser):
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return iter(())
+        reader = csv.DictReader(codecs.iterdecode(stream, 'utf-8-sig'))
+        return ({key: value for key, value in row.items() if value != ''} for row in reader)
@@ -0,0 +1,85 @@
+import datetime
+import decimal
+import uuid
+
+from django.utils.functional import Promise
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_drf_encoder = encoders.JSONEncoder()
+
+
+def encode_default(obj):
+    """`default` hook for the C encoders, matching DRF's `JSONEncoder` for everything else."""
+    if isinstance(obj, decimal.Decimal):
+        # Serializers already coerce decimals to strings unless COERCE_DECIMAL_TO_STRING is off.
+        return float(obj)
+    if isinstance(obj, Promise):
+        return str(obj)
+    return _drf_encoder.default(obj)
+
+
+# The `FastJSONRenderer` class renders with orjson when it is installed and falls back to DRF's
+# stdlib-based `JSONRenderer` otherwise, or when indented output is requested. The compact output
+# is the same as DRF's, including the escaping of U+2028/U+2029.
+class FastJSONRenderer(JSONRenderer):
+    if orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=encode_default, option=self.options)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+def msgpack_default(obj):
+    # Decimals keep their exact value as strings; dates and times use ISO 8601.
+    if isinstance(obj, (decimal.Decimal, uuid.UUID, Promise)):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    return _drf_encoder.default(obj)
+
+
+# The `MessagePackRenderer` class serves `application/msgpack` (or `?format=msgpack`) to clients
+# that ask for it, such as the POS terminals. msgpack uses its pure-Python implementation when the
+# C extension is not built.
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=msgpack_default, use_bin_type=True)
+
+
+# The `PrometheusRenderer` class serves the metrics endpoint in the Prometheus text format. Error
+# responses are rendered as comments.
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, str):
+            data = ''.join(f'# {key}: {value}\n' for key, value in data.items())
+        return data.encode(self.charset)
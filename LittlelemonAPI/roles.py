@@ -0,0 +1,164 @@
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import TTLCache
+
+MANAGER = 'Manager'
+DELIVERY_CREW = 'Delivery Crew'
+
+# Group name -> id, loaded with a single query the first time a group is needed.
+_group_ids = None
+_group_lock = Lock()
+
+# User id -> frozenset of group names, see `LITTLELEMON_ROLE_CACHE` in settings. Invalidated by the
+# signal handlers below, in this process only; other processes notice a change once the entry expires.
+_user_roles = None
+
+# Attribute used to memoize the role set on the request's user object.
+_REQUEST_ATTR = '_littlelemon_roles'
+
+
+def _load_groups():
+    global _group_ids
+    groups = _group_ids
+    if groups is None:
+        with _group_lock:
+            if _group_ids is None:
+                _group_ids = dict(Group.objects.values_list('name', 'id'))
+            groups = _group_ids
+    return groups
+
+
+def _role_cache():
+    global _user_roles
+    cache = _user_roles
+    if cache is None:
+        config = getattr(settings, 'LITTLELEMON_ROLE_CACHE', {})
+        with _group_lock:
+            if _user_roles is None:
+                _user_roles = TTLCache(maxsize=config.get('MAXSIZE', 10000), timeout=config.get('TIMEOUT', 300))
+            cache = _user_roles
+    return cache
+
+
+def group_id(name):
+    """Return the cached primary key of the group called `name`."""
+    try:
+        return _load_groups()[name]
+    except KeyError:
+        raise Group.DoesNotExist(f"Group '{name}' does not exist.")
+
+
+def get_roles(user):
+    """Return the set of group names `user` belongs to, hitting the DB at most once per user."""
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, _REQUEST_ATTR, None)
+    if roles is not None:
+        return roles
+    roles = _role_cache().get(user.pk)
+    if roles is None:
+        names = {pk: name for name, pk in _load_groups().items()}
+        ids = User.groups.through.objects.filter(user_id=user.pk).values_list('group_id', flat=True)
+        roles = frozenset(names[pk] for pk in ids if pk in names)
+        _role_cache().set(user.pk, roles)
+    setattr(user, _REQUEST_ATTR, roles)
+    return roles
+
+
+async def _aload_groups():
+    global _group_ids
+    groups = _group_ids
+    if groups is None:
+        groups = {name: pk async for name, pk in Group.objects.values_list('name', 'id')}
+        with _group_lock:
+            if _group_ids is None:
+                _group_ids = groups
+    return groups
+
+
+async def aget_roles(user):
+    """`get_roles` for async views, using the async ORM on a cache miss."""
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, _REQUEST_ATTR, None)
+    if roles is not None:
+        return roles
+    roles = _role_cache().get(user.pk)
+    if roles is None:
+        names = {pk: name for name, pk in (await _aload_groups()).items()}
+        ids = User.groups.through.objects.filter(user_id=user.pk).values_list('group_id', flat=True)
+        roles = frozenset([names[pk] async for pk in ids if pk in names])
+        _role_cache().set(user.pk, roles)
+    setattr(user, _REQUEST_ATTR, roles)
+    return roles
+
+
+def get_group_ids(user):
+    """Ids of the groups `user` belongs to, from the cached role set."""
+    groups = _load_groups()
+    return frozenset(groups[name] for name in get_roles(user) if name in groups)
+
+
+async def aget_group_ids(user):
+    roles = await aget_roles(user)
+    groups = await _aload_groups()
+    return frozenset(groups[name] for name in roles if name in groups)
+
+
+def prime(user, group_ids):
+    """Memoize the roles of `user` from known group ids, when that needs no query."""
+    groups = _group_ids
+    if groups is not None:
+        names = {pk: name for name, pk in groups.items()}
+        setattr(user, _REQUEST_ATTR, frozenset(names[pk] for pk in group_ids if pk in names))
+
+
+def is_manager(user):
+    return MANAGER in get_roles(user)
+
+
+def is_delivery_crew(user):
+    return DELIVERY_CREW in get_roles(user)
+
+
+def invalidate_user(user_id):
+    _role_cache().delete(user_id)
+
+
+def clear():
+    """Drop every cached group id and role set; the role cache is rebuilt from settings when next used."""
+    global _group_ids, _user_roles
+    with _group_lock:
+        _group_ids = None
+        _user_roles = None
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def _user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_user(instance.pk)
+        instance.__dict__.pop(_REQUEST_ATTR, None)
+    elif pk_set:
+        for user_id in pk_set:
+            invalidate_user(user_id)
+    else:
+        # `group.user_set.clear()` does not report which users were affected.
+        _role_cache().clear()
+
+
+@receiver(post_delete, sender=User)
+def _user_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def _group_changed(sender, **kwargs):
+    clear()
@@ -0,0 +1,218 @@
+"""
+Daily sales rollups: orders, items and revenue per day, quantity and revenue per menu item and day,
+and assigned and delivered orders per delivery crew member and day, keyed by `Order.date`.
+
+Order writes mark their days in `RollupDirtyDay` in the same transaction: saves and deletes of orders
+and saves of order items through the signal handlers below, deletes of order items in
+`OrderItem.delete`, bulk `.update()` and `.delete()` calls through `mark_orders`, as the dispatch
+functions do. Order items have no delete signal handler, so an order's items are removed with it in
+a single DELETE. `refresh` recomputes whole days from the live and archived orders, so
+a day is always rebuilt from scratch and never drifts. The analytics endpoints refresh the marked
+days before they read (see `LITTLELEMON_ROLLUPS`), and the `update_rollups` command catches up on
+marked days and on days newer than the rollups, e.g. after bulk loads, which send no signals.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, Max, Q, Sum
+from django.db.models.functions import Round
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (Order, OrderItem, ArchivedOrder, ArchivedOrderItem, DailySales, DailyMenuItemSales,
+                     DailyCrewDeliveries, RollupDirtyDay)
+
+ROLLUP_MODELS = (DailySales, DailyMenuItemSales, DailyCrewDeliveries)
+
+# Order and item tables the rollups are computed from; see lifecycle.py for the archive.
+SOURCES = ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem))
+
+
+def get_config():
+    config = getattr(settings, 'LITTLELEMON_ROLLUPS', {})
+    return {
+        'REFRESH_ON_READ': config.get('REFRESH_ON_READ', True),
+        'BATCH_DAYS': config.get('BATCH_DAYS', 31),
+        'TOP_ITEMS': config.get('TOP_ITEMS', 10),
+    }
+
+
+def revenue(field):
+    # Rounded, since SQLite sums decimals as floating point.
+    return Round(Sum(field), 2, output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def mark_dates(dates):
+    """Mark `dates` as out of date, with a single INSERT."""
+    RollupDirtyDay.objects.bulk_create([RollupDirtyDay(date=date) for date in set(dates)], ignore_conflicts=True)
+
+
+def mark_orders(order_ids):
+    """Mark the days of the orders in `order_ids`, for writes made with `.update()`."""
+    if order_ids:
+        mark_dates(Order.objects.filter(pk__in=order_ids).values_list('date', flat=True).distinct())
+
+
+def _add(totals, key, row, fields):
+    values = totals.setdefault(key, dict.fromkeys(fields, 0))
+    for field in fields:
+        values[field] += row[field] or 0
+
+
+def compute(**lookups):
+    """
+    The rollup rows of the live and archived orders matching `lookups` on `Order` (e.g.
+    `date__in=...`), as unsaved `DailySales`, `DailyMenuItemSales` and `DailyCrewDeliveries` lists.
+    Three aggregate queries per pair of order tables, however many orders there are.
+    """
+    daily, menu_items, crew = {}, {}, {}
+    item_lookups = {f'order__{lookup}': value for lookup, value in lookups.items()}
+    for order_model, item_model in SOURCES:
+        orders = order_model.objects.filter(**lookups).order_by()
+        for row in orders.values('date').annotate(orders=Count('id'), items=Sum('item_count'),
+                                                  revenue=revenue('total')):
+            _add(daily, row['date'], row, ('orders', 'items', 'revenue'))
+        for row in item_model.objects.filter(**item_lookups).order_by().values('order__date', 'menuitem') \
+                .annotate(quantity=Sum('quantity'), revenue=revenue('price')):
+            _add(menu_items, (row['order__date'], row['menuitem']), row, ('quantity', 'revenue'))
+        for row in orders.filter(delivery_crew__isnull=False).values('date', 'delivery_crew') \
+                .annotate(assigned=Count('id'), delivered=Count('id', filter=Q(status=True))):
+            _add(crew, (row['date'], row['delivery_crew']), row, ('assigned', 'delivered'))
+    return (
+        [DailySales(date=date, **values) for date, values in daily.items()],
+        [DailyMenuItemSales(date=date, menuitem_id=menuitem, **values)
+         for (date, menuitem), values in menu_items.items()],
+        [DailyCrewDeliveries(date=date, delivery_crew_id=crew_id, **values)
+         for (date, crew_id), values in crew.items()],
+    )
+
+
+def refresh(dates):
+    """Recompute the rollups of `dates` from their orders and unmark them, in one transaction."""
+    dates = sorted(set(dates))
+    if not dates:
+        return
+    with transaction.atomic():
+        # Unmarked first: a write that commits while the days are recomputed marks them again.
+        RollupDirtyDay.objects.filter(date__in=dates).delete()
+        daily, menu_items, crew = compute(date__in=dates)
+        for model in ROLLUP_MODELS:
+            model.objects.filter(date__in=dates).delete()
+        # Upserts, in case a concurrent refresh of the same days inserted rows since the delete.
+        DailySales.objects.bulk_create(daily, update_conflicts=True, unique_fields=['date'],
+                                       update_fields=['orders', 'items', 'revenue'])
+        DailyMenuItemSales.objects.bulk_create(menu_items, update_conflicts=True,
+                                               unique_fields=['date', 'menuitem'],
+                                               update_fields=['quantity', 'revenue'])
+        DailyCrewDeliveries.objects.bulk_create(crew, update_conflicts=True,
+                                                unique_fields=['date', 'delivery_crew'],
+                                                update_fields=['assigned', 'delivered'])
+
+
+def dirty_dates():
+    return sorted(RollupDirtyDay.objects.values_list('date', flat=True))
+
+
+def refresh_dirty():
+    """Refresh the marked days; returns them. One query when none are marked."""
+    dates = dirty_dates()
+    refresh(dates)
+    return dates
+
+
+def pending_dates(full=False):
+    """
+    The days to refresh: the marked ones and those with orders newer than the newest rolled up day,
+    or every day with live or archived orders or rollups when `full`.
+    """
+    dates = set(dirty_dates())
+    orders = Order.objects.order_by().values_list('date', flat=True).distinct()
+    if full:
+        dates.update(ArchivedOrder.objects.order_by().values_list('date', flat=True).distinct())
+        dates.update(DailySales.objects.values_list('date', flat=True))
+        dates.update(DailyMenuItemSales.objects.order_by().values_list('date', flat=True).distinct())
+        dates.update(DailyCrewDeliveries.objects.order_by().values_list('date', flat=True).distinct())
+    else:
+        latest = DailySales.objects.aggregate(latest=Max('date'))['latest']
+        if latest is not None:
+            orders = orders.filter(date__gt=latest)
+    dates.update(orders)
+    return sorted(dates)
+
+
+def catch_up(full=False, batch_days=None):
+    """Refresh `pending_dates(full)`, `batch_days` days per transaction. Yields each batch once done."""
+    dates = pending_dates(full)
+    batch_days = batch_days or get_config()['BATCH_DAYS']
+    for start in range(0, len(dates), batch_days):
+        batch = dates[start:start + batch_days]
+        refresh(batch)
+        yield batch
+
+
+def _rows(daily, menu_items, crew):
+    return {
+        'sales': {row.date: (row.orders, row.items, row.revenue) for row in daily},
+        'menu item sales': {(row.date, row.menuitem_id): (row.quantity, row.revenue) for row in menu_items},
+        'crew deliveries': {(row.date, row.delivery_crew_id): (row.assigned, row.delivered) for row in crew},
+    }
+
+
+def verify(date_from=None, date_to=None):
+    """
+    Compare the rollups between `date_from` and `date_to` (inclusive, either may be None) with
+    aggregates of the orders. Returns `(mismatches, pending)`: `(table, key, rollup row, expected row)`
+    tuples, None for a missing row, and the marked days, which are not compared.
+    """
+    span = {}
+    if date_from is not None:
+        span['date__gte'] = date_from
+    if date_to is not None:
+        span['date__lte'] = date_to
+    pending = set(RollupDirtyDay.objects.filter(**span).values_list('date', flat=True))
+    expected = _rows(*compute(**span))
+    actual = _rows(*(model.objects.filter(**span) for model in ROLLUP_MODELS))
+    mismatches = []
+    for table, rows in expected.items():
+        for key in sorted(rows.keys() | actual[table].keys()):
+            date = key[0] if isinstance(key, tuple) else key
+            if date in pending:
+                continue
+            row, expected_row = actual[table].get(key), rows.get(key)
+            if row != expected_row:
+                mismatches.append((table, key, row, expected_row))
+    return mismatches, sorted(pending)
+
+
+@receiver(pre_save, sender=Order)
+def _order_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    # A saved order may move to another day, whose rollups change too.
+    if raw or instance._state.adding or (update_fields is not None and 'date' not in update_fields):
+        return
+    instance._rollup_old_date = Order.objects.filter(pk=instance.pk).values_list('date', flat=True).first()
+
+
+@receiver(post_save, sender=Order)
+def _order_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    mark_dates(filter(None, [instance.date, instance.__dict__.pop('_rollup_old_date', None)]))
+
+
+@receiver(post_delete, sender=Order)
+def _order_deleted(sender, instance, **kwargs):
+    mark_dates([instance.date])
+
+
+@receiver(pre_save, sender=OrderItem)
+def _order_item_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    # An item moved to another order changes the day of its old order too.
+    if raw or instance._state.adding or (update_fields is not None and 'order' not in update_fields):
+        return
+    instance._rollup_old_order = OrderItem.objects.filter(pk=instance.pk).values_list('order', flat=True).first()
+
+
+@receiver(post_save, sender=OrderItem)
+def _order_item_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    mark_orders(list(filter(None, {instance.order_id, instance.__dict__.pop('_rollup_old_order', None)})))
@@ -0,0 +1,47 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Set while a read-only request runs; context variables follow the request across sync_to_async.
+_replica_reads = ContextVar('littlelemon_replica_reads', default=False)
+
+
+@contextmanager
+def replica_reads():
+    """Route the reads made inside the block to a read replica, when any are configured."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+# The `ReadReplicaRouter` class sends reads made under `replica_reads()` to a random alias from
+# `LITTLELEMON_READ_REPLICAS`. Objects read from a replica are written back to the default database,
+# and migrations never run on replicas.
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.LITTLELEMON_READ_REPLICAS
+        if replicas and _replica_reads.get():
+            return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in settings.LITTLELEMON_READ_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.LITTLELEMON_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.LITTLELEMON_READ_REPLICAS:
+            return False
+        return None
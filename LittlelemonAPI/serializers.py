@@ -36,6 +36,49 @@ class CartSerializer(serializers.ModelSerializer):
         }
 
 
+# Output of the cart summary endpoint.
+class CartSummarySerializer(serializers.Serializer):
+    lines = serializers.IntegerField()
+    quantity = serializers.IntegerField()
+    total = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+# Input rows of the batch cart endpoint; menu items are resolved in bulk by the view.
+class CartItemInputSerializer(serializers.Serializer):
+    menuitem = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, max_value=32767)
+
+
+# Input of the bulk dispatch endpoint: the crew member and the orders to hand them.
+class DispatchAssignSerializer(serializers.Serializer):
+    delivery_crew = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    orders = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+
+
+
+# Rows of the menu import; categories are referenced by slug and resolved in bulk by `imports`.
+class CategoryImportSerializer(serializers.Serializer):
+    slug = serializers.SlugField(max_length=50)
+    title = serializers.CharField(max_length=255)
+
+
+class MenuItemImportSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=0)
+    featured = serializers.BooleanField(default=False)
+    category = serializers.SlugField(max_length=50)
+
+
+# Input of the mass price update: exactly one of a percentage or an absolute amount to add.
+class PriceUpdateSerializer(serializers.Serializer):
+    percent = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=-100, required=False)
+    amount = serializers.DecimalField(max_digits=6, decimal_places=2, required=False)
+
+    def validate(self, attrs):
+        if len(attrs) != 1:
+            raise serializers.ValidationError('Give either percent or amount.')
+        return attrs
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
@@ -43,10 +86,56 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
 
 class OrderSerializer(serializers.ModelSerializer):
-    orderitem = OrderItemSerializer(many=True, read_only=True, source='order')
+    orderitem = OrderItemSerializer(many=True, read_only=True, source='orderitems')
 
     class Meta:
         model = Order
         fields = ['id', 'user', 'delivery_crew',
-                  'status', 'date', 'total', 'orderitem']
+                  'status', 'date', 'total', 'item_count', 'orderitem']
+        # Maintained from the order items.
+        read_only_fields = ['total', 'item_count']
+
+
+class ArchivedOrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ['order', 'menuitem', 'quantity', 'price']
+
+
+# Archived orders have the fields of live ones, plus when they were archived, and are read-only.
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    orderitem = ArchivedOrderItemSerializer(many=True, read_only=True, source='orderitems')
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'user', 'delivery_crew',
+                  'status', 'date', 'total', 'item_count', 'orderitem', 'archived_at']
+        read_only_fields = fields
+
+
+class OrderChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderChange
+        fields = ['id', 'order', 'user', 'delivery_crew', 'status', 'kind', 'created_at']
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = ['date', 'orders', 'items', 'revenue']
+
+
+# Output of the menu item analytics: one menu item's sales summed over the requested days.
+class MenuItemSalesSerializer(serializers.Serializer):
+    menuitem = serializers.IntegerField()
+    title = serializers.CharField(source='menuitem__title')
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+
 
+# Output of the crew analytics: one crew member's orders summed over the requested days.
+class CrewDeliveriesSerializer(serializers.Serializer):
+    delivery_crew = serializers.IntegerField()
+    username = serializers.CharField(source='delivery_crew__username')
+    assigned = serializers.IntegerField()
+    delivered = serializers.IntegerField()
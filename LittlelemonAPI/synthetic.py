@@ -0,0 +1,142 @@
+"""
+Synthetic data for load tests and benchmarks, written with bulk inserts in batches so that millions
+of orders fit in memory and take minutes rather than hours.
+
+Everything is derived from a seeded `random.Random`, so the same counts and seed give the same
+rows. Bulk inserts send no signals: order totals are computed here, no order changes are logged,
+the days of the orders are marked for the sales rollups per batch, and the catalogue version is
+bumped once at the end.
+"""
+import random
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.db import transaction
+from django.utils import timezone
+
+from . import roles, catalogue, rollups
+from .models import Category, MenuItem, Cart, Order, OrderItem
+
+WORDS = ('lemon', 'greek', 'salad', 'bruschetta', 'grilled', 'fish', 'pasta', 'baklava', 'feta',
+         'olive', 'lamb', 'souvlaki', 'hummus', 'pita', 'tomato', 'basil', 'honey', 'yogurt')
+
+
+@dataclass
+class Counts:
+    categories: int = 10
+    menu_items: int = 500
+    managers: int = 5
+    crew: int = 50
+    customers: int = 5000
+    cart_rows: int = 10000
+    orders: int = 100000
+    max_items_per_order: int = 5
+    # Orders are spread over this many days before today; the newest `open_days` are not delivered.
+    days: int = 365
+    open_days: int = 2
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(counts, seed=0, batch_size=5000, password='pass', prefix='synthetic', log=None):
+    """
+    Insert `counts` rows of every kind. Users are named `<prefix>-<role>-<n>` and share `password`,
+    hashed once; slugs and menu item titles contain the prefix too, as they are unique. Returns a
+    dict of the number of rows inserted per model.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    inserted = {}
+
+    with transaction.atomic():
+        categories = Category.objects.bulk_create(
+            Category(slug=f'{prefix}-{i}', title=f'{rng.choice(WORDS).title()} {i}') for i in range(counts.categories)
+        )
+        menu_items = []
+        for batch in batched(range(counts.menu_items), batch_size):
+            menu_items += MenuItem.objects.bulk_create(
+                MenuItem(title=f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} ({prefix} {i})',
+                         price=Decimal(rng.randrange(250, 4000)) / 100, featured=rng.random() < 0.1,
+                         category=rng.choice(categories))
+                for i in batch
+            )
+        inserted.update(categories=len(categories), menu_items=len(menu_items))
+        log(f'{len(categories)} categories, {len(menu_items)} menu items')
+
+        password = make_password(password)
+        users = {}
+        for role, count in (('manager', counts.managers), ('crew', counts.crew), ('customer', counts.customers)):
+            users[role] = []
+            for batch in batched(range(count), batch_size):
+                users[role] += User.objects.bulk_create(
+                    User(username=f'{prefix}-{role}-{i}', password=password) for i in batch
+                )
+        memberships = []
+        for role, name in (('manager', roles.MANAGER), ('crew', roles.DELIVERY_CREW)):
+            group, _ = Group.objects.get_or_create(name=name)
+            memberships += [User.groups.through(user=user, group=group) for user in users[role]]
+        User.groups.through.objects.bulk_create(memberships, batch_size=batch_size)
+        inserted['users'] = sum(len(role_users) for role_users in users.values())
+        log(f'{inserted["users"]} users')
+
+        # Carts hold distinct menu items per customer.
+        customers = users['customer']
+        per_customer = min(len(menu_items), counts.cart_rows // max(len(customers), 1) + 1) if customers else 0
+        rows = (
+            Cart(user=customer, menuitem=item, quantity=quantity, unit_price=item.price, price=quantity * item.price)
+            for customer in customers
+            for item, quantity in ((item, rng.randint(1, 3)) for item in rng.sample(menu_items, per_customer))
+        )
+        inserted['cart_rows'] = 0
+        for batch in batched((row for _, row in zip(range(counts.cart_rows), rows)), batch_size):
+            inserted['cart_rows'] += len(Cart.objects.bulk_create(batch))
+        log(f'{inserted["cart_rows"]} cart rows')
+
+    inserted.update(orders=0, order_items=0)
+    today = timezone.localdate()
+    # Ids and prices instead of instances: setting related objects is most of the cost of building rows.
+    prices = [(item.pk, item.price) for item in menu_items]
+    customer_ids = [user.pk for user in customers]
+    crew_ids = [user.pk for user in users['crew']]
+    for batch in batched(range(counts.orders), batch_size):
+        # One transaction per batch keeps the journal small on SQLite.
+        with transaction.atomic():
+            lines = []
+            orders = []
+            for _ in batch:
+                age = rng.randrange(counts.days)
+                delivered = age >= counts.open_days
+                order_lines = [(menuitem_id, price, rng.randint(1, 3)) for menuitem_id, price in
+                               rng.sample(prices, rng.randint(1, min(counts.max_items_per_order, len(prices))))]
+                lines.append(order_lines)
+                orders.append(Order(
+                    user_id=rng.choice(customer_ids), date=today - timedelta(days=age), status=delivered,
+                    delivery_crew_id=rng.choice(crew_ids) if crew_ids and (delivered or rng.random() < 0.5) else None,
+                    total=sum(price * quantity for _, price, quantity in order_lines),
+                    item_count=sum(quantity for _, _, quantity in order_lines),
+                ))
+            orders = Order.objects.bulk_create(orders)
+            items = OrderItem.objects.bulk_create(
+                OrderItem(order_id=order.pk, menuitem_id=menuitem_id, quantity=quantity, unit_price=price,
+                          price=quantity * price)
+                for order, order_lines in zip(orders, lines) for menuitem_id, price, quantity in order_lines
+            )
+            rollups.mark_dates(order.date for order in orders)
+        inserted['orders'] += len(orders)
+        inserted['order_items'] += len(items)
+        log(f'{inserted["orders"]}/{counts.orders} orders')
+
+    catalogue.bump_version()
+    return inserted
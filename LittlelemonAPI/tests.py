@@ -1,3 +1,1828 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import threading
+import warnings
+from datetime import date, timedelta
+from decimal import Decimal
+from time import perf_counter
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User, Group
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .models import *
+from . import roles, catalogue, exports, imports, orders, authentication, routers, deliveries, changes, metrics, synthetic, benchmarks, throttling, rollups, lifecycle, carts
+from .filters import PrefixFilter, FullTextFilter, MENUITEM_FTS_TABLE
+from .compiled import compile_serializer
+from .serializers import CartSerializer, OrderSerializer
+from .renderers import FastJSONRenderer, msgpack
+from .compression import accepted_encodings
 
 # Create your tests here.
+
+
+class LittlelemonTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager_group = Group.objects.create(name=roles.MANAGER)
+        cls.crew_group = Group.objects.create(name=roles.DELIVERY_CREW)
+        cls.manager = User.objects.create_user('manager', password='pass')
+        cls.manager.groups.add(cls.manager_group)
+        cls.crew = User.objects.create_user('crew', password='pass')
+        cls.crew.groups.add(cls.crew_group)
+        cls.customer = User.objects.create_user('customer', password='pass')
+
+    def setUp(self):
+        # Process-wide caches outlive the per-test transaction rollback.
+        roles.clear()
+        catalogue.reset_backend()
+        authentication.reset_token_cache()
+        throttling.reset_backend()
+        self.client = APIClient()
+
+    def login(self, user):
+        # Re-fetch so no per-request state leaks between requests.
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+
+    def count_queries(self, path):
+        self.client.get(path)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, path, add_rows, sizes=(1, 5, 20)):
+        """Fail when the queries needed to GET `path` grow with the number of rows."""
+        counts = []
+        for size in sizes:
+            add_rows(size)
+            counts.append(self.count_queries(path))
+        self.assertEqual(len(set(counts)), 1, f'Query count grows with rows: {dict(zip(sizes, counts))}')
+
+
+class RoleResolutionTests(LittlelemonTestCase):
+    def test_roles_are_cached_per_user(self):
+        with self.assertNumQueries(2):
+            self.assertTrue(roles.is_manager(self.manager))
+        with self.assertNumQueries(0):
+            self.assertTrue(roles.is_manager(self.manager))
+        with self.assertNumQueries(1):
+            self.assertTrue(roles.is_delivery_crew(self.crew))
+            self.assertFalse(roles.is_manager(self.crew))
+
+    def test_group_change_invalidates_cache(self):
+        self.assertFalse(roles.is_manager(self.customer))
+        self.customer.groups.add(self.manager_group)
+        self.assertTrue(roles.is_manager(self.customer))
+        self.manager_group.user_set.remove(self.customer)
+        self.assertFalse(roles.is_manager(User.objects.get(pk=self.customer.pk)))
+
+    def test_roles_expire(self):
+        from time import monotonic
+        with self.settings(LITTLELEMON_ROLE_CACHE={'TIMEOUT': 60}):
+            roles.clear()
+            self.assertTrue(roles.is_manager(self.manager))
+            # Another process demotes the manager; no signal reaches this one.
+            User.groups.through.objects.filter(user=self.manager).delete()
+            now = monotonic()
+            with mock.patch('LittlelemonAPI.cache.monotonic', return_value=now + 30):
+                self.assertTrue(roles.is_manager(User.objects.get(pk=self.manager.pk)))
+            with mock.patch('LittlelemonAPI.cache.monotonic', return_value=now + 3600):
+                self.assertFalse(roles.is_manager(User.objects.get(pk=self.manager.pk)))
+
+    def test_manager_permission_query_count(self):
+        self.login(self.manager)
+        # Group ids + memberships + paginated count + page.
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/groups/delivery-crew/users')
+        self.assertEqual(response.status_code, 200)
+        self.login(self.manager)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/groups/delivery-crew/users')
+        self.assertEqual(response.status_code, 200)
+
+    def test_customer_is_not_manager(self):
+        self.login(self.customer)
+        response = self.client.get('/api/groups/delivery-crew/users')
+        self.assertEqual(response.status_code, 403)
+
+    def test_order_scoping_query_count(self):
+        Order.objects.create(user=self.customer, total=10, date=date(2024, 1, 1))
+        self.login(self.manager)
+        self.client.get('/api/cart/orders')
+        self.login(self.manager)
+        # Roles come from the cache: only the paginated count, page and order items remain.
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cart/orders')
+        self.assertEqual(response.data['count'], 1)
+        self.login(self.customer)
+        response = self.client.get('/api/cart/orders')
+        self.assertEqual(response.data['count'], 1)
+        self.login(self.crew)
+        response = self.client.get('/api/cart/orders')
+        self.assertEqual(response.data['count'], 0)
+
+
+class CatalogueCacheTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.category = Category.objects.create(slug='mains', title='Mains')
+        for i in range(5):
+            MenuItem.objects.create(title=f'Item {i}', price=i + 1, featured=False, category=cls.category)
+
+    def test_hit_skips_orm(self):
+        self.login(self.customer)
+        first = self.client.get('/api/menu-items?ordering=-price')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/menu-items?ordering=-price')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second['Content-Type'], 'application/json')
+
+    def test_distinct_params_are_cached_separately(self):
+        self.login(self.customer)
+        page1 = self.client.get('/api/menu-items?page=1')
+        page2 = self.client.get('/api/menu-items?page=2')
+        self.assertNotEqual(page1.content, page2.content)
+        self.assertEqual(self.client.get('/api/menu-items?page=2').content, page2.content)
+
+    def test_media_type_params_are_cached_separately(self):
+        self.login(self.customer)
+        indented = self.client.get('/api/categories', headers={'Accept': 'application/json; indent=4'})
+        self.assertEqual(indented['Content-Type'], 'application/json; indent=4')
+        plain = self.client.get('/api/categories')
+        self.assertNotEqual(plain.content, indented.content)
+        self.assertEqual(plain.json(), json.loads(indented.content))
+
+    def test_save_and_delete_bump_version(self):
+        self.login(self.customer)
+        self.client.get('/api/categories')
+        Category.objects.create(slug='drinks', title='Drinks')
+        self.assertEqual(self.client.get('/api/categories').json()['count'], 2)
+        item = MenuItem.objects.get(title='Item 0')
+        self.client.get('/api/menu-items')
+        item.delete()
+        self.assertEqual(self.client.get('/api/menu-items').json()['count'], 4)
+
+    def test_lru_bound(self):
+        backend = catalogue.LocalCatalogueBackend(maxsize=2)
+        for key in 'abc':
+            backend.set(key, b'{}')
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.get('c'), b'{}')
+
+
+class ConditionalGetTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.category = Category.objects.create(slug='mains', title='Mains')
+        cls.item = MenuItem.objects.create(title='Soup', price=5, featured=False, category=cls.category)
+
+    def test_etag_revalidation_is_query_free(self):
+        self.login(self.customer)
+        for path in ('/api/menu-items', f'/api/menu-items/{self.item.pk}',
+                     '/api/categories', f'/api/categories/{self.category.pk}'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.login(self.customer)
+            with self.assertNumQueries(0):
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since(self):
+        self.login(self.customer)
+        path = f'/api/menu-items/{self.item.pk}'
+        response = self.client.get(path)
+        response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_lists_have_no_last_modified(self):
+        # Deleting a row leaves Max(updated_at) alone, so only the ETag can tell the list changed.
+        MenuItem.objects.create(title='Salad', price=4, featured=False, category=self.category)
+        self.login(self.customer)
+        response = self.client.get('/api/menu-items')
+        self.assertNotIn('Last-Modified', response)
+        self.item.delete()
+        response = self.client.get('/api/menu-items', HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['title'] for item in json.loads(response.content)['results']], ['Salad'])
+
+    def test_change_invalidates_etag(self):
+        self.login(self.customer)
+        etag = self.client.get(f'/api/menu-items/{self.item.pk}')['ETag']
+        self.item.price = 6
+        self.item.save()
+        response = self.client.get(f'/api/menu-items/{self.item.pk}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_query_string_changes_etag(self):
+        self.login(self.customer)
+        self.assertNotEqual(self.client.get('/api/menu-items?ordering=price')['ETag'],
+                            self.client.get('/api/menu-items?ordering=-price')['ETag'])
+
+
+class KeysetPaginationTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        MenuItem.objects.bulk_create(
+            MenuItem(title=f'Item {i}', price=i % 4 + 1, featured=False, category=category) for i in range(10)
+        )
+        Order.objects.bulk_create(
+            Order(user=cls.customer, total=i, date=date(2024, 1, i % 3 + 1)) for i in range(7)
+        )
+
+    def walk(self, url, max_queries=1):
+        # Warm the role and validator caches so each page is a single range scan.
+        self.client.get(url)
+        seen = []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                data = self.client.get(url).json()
+            self.assertLessEqual(len(ctx.captured_queries), max_queries)
+            for query in ctx.captured_queries:
+                self.assertNotIn('COUNT(', query['sql'])
+                self.assertNotIn('OFFSET', query['sql'])
+            seen.extend(data['results'])
+            url = data['next']
+        return seen
+
+    def test_menu_items_by_price(self):
+        self.login(self.customer)
+        items = self.walk('/api/menu-items?cursor=&ordering=-price&page_size=3')
+        self.assertEqual(len(items), 10)
+        self.assertEqual(len({item['id'] for item in items}), 10)
+        keys = [(-float(item['price']), -item['id']) for item in items]
+        self.assertEqual(keys, sorted(keys))
+
+    def test_orders_by_date_and_previous_link(self):
+        self.login(self.customer)
+        # One range scan plus the order item prefetch per page.
+        orders = self.walk('/api/cart/orders?cursor=&page_size=2', max_queries=2)
+        self.assertEqual([o['id'] for o in orders],
+                         list(Order.objects.order_by('-date', '-id').values_list('id', flat=True)))
+        first = self.client.get('/api/cart/orders?cursor=&page_size=2').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+
+    def test_page_size_cap_and_invalid_cursor(self):
+        self.login(self.customer)
+        data = self.client.get('/api/menu-items?cursor=&page_size=1000').json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertNotIn('count', data)
+        self.assertEqual(self.client.get('/api/menu-items?cursor=bogus').status_code, 404)
+
+    def test_page_number_mode_is_unchanged(self):
+        self.login(self.customer)
+        data = self.client.get('/api/menu-items').json()
+        self.assertEqual(data['count'], 10)
+        self.assertEqual(len(data['results']), 3)
+
+
+class ReadPathQueryTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.items = MenuItem.objects.bulk_create(
+            MenuItem(title=f'Item {i}', price=i + 1, featured=False, category=category) for i in range(25)
+        )
+
+    def add_orders(self, count):
+        Order.objects.filter(user=self.customer).delete()
+        for i in range(count):
+            order = Order.objects.create(user=self.customer, delivery_crew=self.crew, total=3, date=date(2024, 1, 1))
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, menuitem=item, quantity=1, unit_price=1, price=1) for item in self.items[:3]
+            )
+
+    def add_cart(self, count):
+        Cart.objects.filter(user=self.customer).delete()
+        Cart.objects.bulk_create(
+            Cart(user=self.customer, menuitem=item, quantity=1, unit_price=item.price, price=item.price)
+            for item in self.items[:count]
+        )
+
+    def test_order_list_queries_are_constant(self):
+        self.login(self.customer)
+        self.assertConstantQueries('/api/cart/orders?page_size=50', self.add_orders)
+        self.assertConstantQueries('/api/cart/orders?cursor=&page_size=50', self.add_orders)
+
+    def test_cart_list_queries_are_constant(self):
+        self.login(self.customer)
+        self.assertConstantQueries('/api/cart/menu-items?page_size=50', self.add_cart)
+
+    def test_order_items_belong_to_order(self):
+        self.add_orders(2)
+        self.login(self.customer)
+        order = self.client.get('/api/cart/orders').json()['results'][0]
+        self.assertEqual(len(order['orderitem']), 3)
+        self.assertEqual({item['order'] for item in order['orderitem']}, {order['id']})
+
+
+class CheckoutTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.items = MenuItem.objects.bulk_create(
+            MenuItem(title=f'Item {i}', price=i + 1, featured=False, category=category) for i in range(30)
+        )
+
+    def fill_cart(self, count):
+        Cart.objects.bulk_create(
+            Cart(user=self.customer, menuitem=item, quantity=2, unit_price=item.price, price=2 * item.price)
+            for item in self.items[:count]
+        )
+
+    def checkout(self, **headers):
+        self.login(self.customer)
+        return self.client.post('/api/cart/orders', **headers)
+
+    def test_checkout_creates_order_and_empties_cart(self):
+        self.fill_cart(3)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total'], '12.00')
+        self.assertEqual(len(response.data['orderitem']), 3)
+        self.assertFalse(Cart.objects.filter(user=self.customer).exists())
+        self.assertEqual(self.checkout().status_code, 400)
+
+    def test_checkout_queries_are_constant(self):
+        counts = []
+        for size in (1, 10, 30):
+            self.fill_cart(size)
+            self.checkout()  # warm the role cache for this client
+            self.fill_cart(size)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.checkout().status_code, 201)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(len(set(counts)), 1, counts)
+
+    def test_idempotency_key(self):
+        self.fill_cart(2)
+        first = self.checkout(HTTP_IDEMPOTENCY_KEY='abc')
+        self.fill_cart(5)
+        second = self.checkout(HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(first.data['id'], second.data['id'])
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+        # The second submit left the new cart untouched.
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 5)
+
+    def test_concurrent_submit_with_same_key_returns_the_order(self):
+        self.fill_cart(2)
+        checkout = orders.checkout
+
+        def concurrent_checkout(user, idempotency_key=None):
+            # The other request takes the cart lock first; this one then finds the cart empty.
+            self.first = checkout(user, idempotency_key=idempotency_key)
+            return checkout(user, idempotency_key=idempotency_key)
+
+        with mock.patch.object(orders, 'checkout', side_effect=concurrent_checkout):
+            response = self.checkout(HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.first.pk)
+        self.assertEqual(Order.objects.filter(user=self.customer).count(), 1)
+        with mock.patch.object(orders, 'checkout', return_value=None):
+            self.assertEqual(self.checkout(HTTP_IDEMPOTENCY_KEY='other').status_code, 400)
+
+    def test_long_idempotency_key_is_rejected(self):
+        self.fill_cart(1)
+        response = self.checkout(HTTP_IDEMPOTENCY_KEY='k' * 65)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'Idempotency-Key': ['Ensure this value has at most 64 characters.']})
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.checkout(HTTP_IDEMPOTENCY_KEY='k' * 64).status_code, 201)
+
+
+class CartBatchTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.items = MenuItem.objects.bulk_create(
+            MenuItem(title=f'Item {i}', price=i + 1, featured=False, category=category) for i in range(30)
+        )
+
+    def post_batch(self, entries):
+        return self.client.post('/api/cart/menu-items/batch', entries, format='json')
+
+    def test_upsert_and_remove(self):
+        self.login(self.customer)
+        a, b, c = self.items[:3]
+        self.post_batch([{'menuitem': a.pk, 'quantity': 1}, {'menuitem': b.pk, 'quantity': 2}])
+        response = self.post_batch([{'menuitem': a.pk, 'quantity': 0}, {'menuitem': b.pk, 'quantity': 5},
+                                    {'menuitem': c.pk, 'quantity': 1}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['menuitem'], row['quantity'], row['price']) for row in response.data],
+                         [(b.pk, 5, '10.00'), (c.pk, 1, '3.00')])
+
+    def test_queries_are_constant(self):
+        counts = []
+        for size in (1, 10, 30):
+            self.login(self.customer)
+            entries = [{'menuitem': item.pk, 'quantity': 2} for item in self.items[:size]]
+            self.post_batch(entries)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.post_batch(entries).status_code, 200)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(len(set(counts)), 1, counts)
+
+    def test_unknown_menu_item(self):
+        self.login(self.customer)
+        response = self.post_batch([{'menuitem': 999999, 'quantity': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_single_add_updates_quantity(self):
+        self.login(self.customer)
+        item = self.items[0]
+        self.client.post('/api/cart/menu-items', {'menuitem': item.pk, 'quantity': 1})
+        response = self.client.post('/api/cart/menu-items', {'menuitem': item.pk, 'quantity': 3})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], 3)
+        self.assertEqual(Cart.objects.get(user=self.customer).price, 3)
+
+
+class FilterTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.mains = Category.objects.create(slug='mains', title='Mains')
+        cls.drinks = Category.objects.create(slug='drinks', title='Drinks')
+        MenuItem.objects.create(title='Tomato Soup', price=5, featured=True, category=cls.mains)
+        MenuItem.objects.create(title='Greek Salad', price=8, featured=False, category=cls.mains)
+        MenuItem.objects.create(title='Tonic Water', price=2, featured=False, category=cls.drinks)
+        Order.objects.create(user=cls.customer, total=5, date=date(2024, 1, 1))
+        Order.objects.create(user=cls.customer, delivery_crew=cls.crew, status=True, total=5, date=date(2024, 2, 1))
+        Order.objects.create(user=cls.manager, total=5, date=date(2024, 3, 1))
+
+    def titles(self, query):
+        self.login(self.customer)
+        response = self.client.get(f'/api/menu-items?page_size=100&{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(item['title'] for item in response.json()['results'])
+
+    def test_menu_item_filters(self):
+        self.assertEqual(self.titles(f'category={self.drinks.pk}'), ['Tonic Water'])
+        self.assertEqual(self.titles('featured=true'), ['Tomato Soup'])
+        self.assertEqual(self.titles('price_min=3&price_max=6'), ['Tomato Soup'])
+        self.assertEqual(self.titles('title=To'), ['Tomato Soup', 'Tonic Water'])
+        self.assertEqual(self.titles('search=sal'), ['Greek Salad'])
+        self.assertEqual(self.titles('search=water tonic'), ['Tonic Water'])
+
+    def test_search_index_follows_saves(self):
+        item = MenuItem.objects.get(title='Greek Salad')
+        item.title = 'Caesar Salad'
+        item.save()
+        self.assertEqual(self.titles('search=greek'), [])
+        self.assertEqual(self.titles('search=caesar'), ['Caesar Salad'])
+        item.delete()
+        self.assertEqual(self.titles('search=salad'), [])
+
+    def test_invalid_values(self):
+        self.login(self.customer)
+        response = self.client.get('/api/menu-items?price_min=cheap&featured=maybe')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'price_min', 'featured'})
+
+    def test_order_filters(self):
+        self.login(self.manager)
+
+        def ids(query):
+            return len(self.client.get(f'/api/cart/orders?page_size=100&{query}').json()['results'])
+
+        self.assertEqual(ids('status=1'), 1)
+        self.assertEqual(ids('date_from=2024-01-15&date_to=2024-02-15'), 1)
+        self.assertEqual(ids(f'delivery_crew={self.crew.pk}'), 1)
+        self.assertEqual(ids(f'user={self.customer.pk}'), 2)
+        self.login(self.customer)
+        self.assertEqual(ids(f'user={self.manager.pk}'), 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is SQLite specific')
+class IndexUsageTests(LittlelemonTestCase):
+    def test_order_user_date_index(self):
+        plan = Order.objects.filter(user=self.customer, date__gte=date(2024, 1, 1)).order_by('-date').explain()
+        self.assertIn('order_user_date_idx', plan)
+
+    def test_order_crew_status_index(self):
+        # Open orders use the smaller partial index below.
+        plan = Order.objects.filter(delivery_crew=self.crew, status=True).explain()
+        self.assertIn('order_crew_status_idx', plan)
+
+    def test_order_crew_open_index(self):
+        plan = deliveries.open_orders(self.crew).explain()
+        self.assertIn('order_crew_open_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_dispatch_queue_index(self):
+        plan = deliveries.queue().explain()
+        self.assertIn('order_crew_open_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_title_prefix_uses_index(self):
+        queryset = PrefixFilter('title').apply(MenuItem.objects.all(), 'To')
+        self.assertRegex(queryset.explain(), r'USING (COVERING )?INDEX \S+ \(title')
+
+    def test_search_uses_fts(self):
+        queryset = FullTextFilter('title', MENUITEM_FTS_TABLE).apply(MenuItem.objects.all(), 'soup')
+        self.assertIn('VIRTUAL TABLE INDEX', queryset.explain())
+
+
+class OrderExportTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        item = MenuItem.objects.create(title='Soup', price=5, featured=False, category=category)
+        for day in (1, 2, 3):
+            order = Order.objects.create(user=cls.customer, date=date(2024, 1, day))
+            OrderItem.objects.create(order=order, menuitem=item, quantity=2, unit_price=5, price=10)
+        Order.objects.create(user=cls.customer, date=date(2024, 1, 4))
+
+    def export(self, query):
+        self.login(self.manager)
+        response = self.client.get(f'/api/cart/orders/export?{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        lines = [json.loads(line) for line in self.export('format=ndjson').splitlines()]
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0]['total'], '10.00')
+        self.assertEqual(lines[0]['orderitem'][0]['quantity'], 2)
+        self.assertEqual(lines[3]['orderitem'], [])
+
+    def test_csv_with_date_range(self):
+        lines = self.export('format=csv&date_from=2024-01-02&date_to=2024-01-04').splitlines()
+        self.assertEqual(lines[0], 'order,user,delivery_crew,status,date,total,menuitem,quantity,unit_price,price')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[-1].endswith(',,,,'))
+
+    def test_one_item_query_per_chunk(self):
+        with CaptureQueriesContext(connection) as ctx:
+            list(exports.ndjson_lines(Order.objects.order_by('id'), chunk_size=2))
+        # One streamed order query, plus one order item query for each of the two chunks.
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+    def test_managers_only(self):
+        self.login(self.customer)
+        self.assertEqual(self.client.get('/api/cart/orders/export?format=csv').status_code, 403)
+
+
+class CompiledSerializerTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        items = MenuItem.objects.bulk_create(
+            MenuItem(title=f'Item "{i}" é', price=Decimal(f'{i}.{i % 10}5'), featured=i % 2 == 0, category=category)
+            for i in range(12)
+        )
+        Cart.objects.bulk_create(
+            Cart(user=cls.customer, menuitem=item, quantity=2, unit_price=item.price, price=2 * item.price)
+            for item in items[:4]
+        )
+
+    def get_both(self, path):
+        contents = []
+        for enabled in (False, True):
+            catalogue.reset_backend()
+            with self.settings(LITTLELEMON_COMPILED_SERIALIZERS=enabled):
+                self.login(self.customer)
+                contents.append(self.client.get(path).content)
+        return contents
+
+    def test_identical_output(self):
+        for path in ('/api/menu-items?page_size=100', '/api/menu-items?ordering=-price&page=2',
+                     '/api/menu-items?cursor=&ordering=price&page_size=5', '/api/categories',
+                     '/api/cart/menu-items?page_size=100'):
+            drf, compiled = self.get_both(path)
+            self.assertEqual(drf, compiled, path)
+
+    def test_cursor_from_compiled_page(self):
+        with self.settings(LITTLELEMON_COMPILED_SERIALIZERS=True):
+            self.login(self.customer)
+            first = self.client.get('/api/menu-items?cursor=&ordering=price&page_size=5').json()
+            second = self.client.get(first['next']).json()
+        self.assertLess(first['results'][-1]['price'], second['results'][0]['price'])
+
+    def test_nested_serializers_are_not_compiled(self):
+        self.assertIsNone(compile_serializer(OrderSerializer))
+        self.assertIsNotNone(compile_serializer(CartSerializer))
+
+
+class RendererTests(LittlelemonTestCase):
+    payload = {
+        'title': 'Crème brûlée\u2028"quoted"',
+        'price': Decimal('5.50'),
+        'date': date(2024, 1, 2),
+        'items': [{'id': 1, 'featured': True, 'crew': None}],
+    }
+
+    def test_matches_drf_json(self):
+        self.assertEqual(FastJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+
+    def test_pure_python_fallback(self):
+        with mock.patch('LittlelemonAPI.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.payload), JSONRenderer().render(self.payload))
+
+    def test_indent_falls_back(self):
+        rendered = FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+
+    def test_json_parser(self):
+        self.login(self.customer)
+        response = self.client.post('/api/cart/menu-items/batch', b'[{"menuitem": 1,', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack_negotiation(self):
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.login(self.customer)
+        response = self.client.get('/api/categories', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['results'][0]['id'], category.pk)
+
+
+class CompressionTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        MenuItem.objects.bulk_create(
+            MenuItem(title=f'Menu item number {i}', price=i + 1, featured=False, category=category) for i in range(60)
+        )
+        Order.objects.bulk_create(Order(user=cls.customer, total=1, date=date(2024, 1, 1)) for _ in range(50))
+
+    def test_gzip_large_body(self):
+        self.login(self.customer)
+        plain = self.client.get('/api/menu-items?page_size=100')
+        response = self.client.get('/api/menu-items?page_size=100', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertLess(len(response.content), len(plain.content))
+
+    def test_small_body_and_refused_coding(self):
+        self.login(self.customer)
+        response = self.client.get('/api/categories', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        response = self.client.get('/api/menu-items?page_size=100', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_compressed_catalogue_page_is_cached(self):
+        self.login(self.customer)
+        first = self.client.get('/api/menu-items?page_size=100', HTTP_ACCEPT_ENCODING='gzip')
+        with mock.patch('LittlelemonAPI.compression.GzipCodec.compress') as compress:
+            second = self.client.get('/api/menu-items?page_size=100', HTTP_ACCEPT_ENCODING='gzip')
+        compress.assert_not_called()
+        self.assertEqual(first.content, second.content)
+
+    def test_streaming_export(self):
+        self.login(self.manager)
+        response = self.client.get('/api/cart/orders/export?format=ndjson', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 50)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip;q=1.0, br; q=0, zstd'), {'gzip', 'zstd'})
+
+
+@override_settings(LITTLELEMON_ASYNC_VIEWS=True)
+class AsyncViewTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.items = MenuItem.objects.bulk_create(
+            MenuItem(title=f'Item {i}', price=i + 1, featured=i % 2 == 0, category=category) for i in range(7)
+        )
+        Cart.objects.create(user=cls.customer, menuitem=cls.items[0], quantity=2, unit_price=1, price=2)
+        cls.order = Order.objects.create(user=cls.customer, total=3, date=date(2024, 1, 2))
+        OrderItem.objects.create(order=cls.order, menuitem=cls.items[1], quantity=1, unit_price=2, price=2)
+        cls.manager_order = Order.objects.create(user=cls.manager, total=1, date=date(2024, 1, 1))
+        cls.tokens = {user.pk: Token.objects.create(user=user).key for user in (cls.customer, cls.manager)}
+
+    def headers(self, user):
+        return {'Authorization': f'Token {self.tokens[user.pk]}'} if user else {}
+
+    def aget(self, path, user=None, **headers):
+        return async_to_sync(AsyncClient().get)(path, headers={**self.headers(user), **headers})
+
+    def sync_get(self, path, user=None, **headers):
+        with self.settings(LITTLELEMON_ASYNC_VIEWS=False):
+            return APIClient().get(path, headers={**self.headers(user), **headers})
+
+    def assertSameResponse(self, path, user=None, **headers):
+        expected = self.sync_get(path, user, **headers)
+        roles.clear()
+        catalogue.reset_backend()
+        response = self.aget(path, user, **headers)
+        self.assertEqual(response.status_code, expected.status_code, path)
+        self.assertEqual(response.content, expected.content, path)
+        for header in ('Content-Type', 'ETag', 'Allow', 'Vary', 'WWW-Authenticate'):
+            self.assertEqual(response.get(header), expected.get(header), f'{path} {header}')
+        return response
+
+    def test_responses_match_sync_views(self):
+        paths = ['/api/menu-items', '/api/menu-items?page=3', '/api/menu-items?featured=true&ordering=-price',
+                 '/api/menu-items?page=9', '/api/menu-items?price_min=abc', '/api/categories',
+                 '/api/cart/menu-items', '/api/cart/orders', '/api/cart/orders?page_size=1&page=2',
+                 f'/api/cart/orders/{self.order.pk}', f'/api/cart/orders/{self.manager_order.pk}']
+        for path in paths:
+            self.assertSameResponse(path, self.customer)
+        self.assertSameResponse('/api/cart/orders', self.manager)
+        self.assertSameResponse(f'/api/cart/orders/{self.manager_order.pk}', self.manager)
+
+    def test_views_are_chosen_per_request(self):
+        from django.urls import resolve
+        from . import async_views, views
+        self.assertIs(resolve('/api/menu-items').func.view_class, async_views.MenuItemView)
+        with self.settings(LITTLELEMON_ASYNC_VIEWS=False):
+            self.assertIs(resolve('/api/menu-items').func.view_class, views.MenuItemView)
+            self.assertIs(resolve(f'/api/cart/orders/{self.order.pk}').func.view_class, views.SingleOrderView)
+        self.assertIs(resolve(f'/api/cart/orders/{self.order.pk}').func.view_class, async_views.SingleOrderView)
+
+    def test_authentication_errors_match_sync_views(self):
+        response = self.assertSameResponse('/api/cart/orders')
+        self.assertEqual(response.status_code, 401)
+        response = self.assertSameResponse('/api/menu-items', Authorization='Token nope')
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+
+    def test_session_authentication(self):
+        client = AsyncClient()
+        client.force_login(self.customer)
+        response = async_to_sync(client.get)('/api/cart/menu-items')
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_conditional_get(self):
+        etag = self.aget('/api/menu-items', self.customer)['ETag']
+        response = self.aget('/api/menu-items', self.customer, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_other_requests_use_sync_views(self):
+        response = async_to_sync(AsyncClient().post)('/api/cart/menu-items', {'menuitem': self.items[3].pk, 'quantity': 1},
+                                                     content_type='application/json', headers=self.headers(self.customer))
+        self.assertEqual(response.status_code, 201)
+        self.assertSameResponse('/api/menu-items?cursor=', self.customer)
+        self.assertSameResponse('/api/menu-items?search=item', self.customer)
+        response = self.aget('/api/categories', self.customer, Accept='text/html')
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+
+class TokenCacheTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.token = Token.objects.create(user=cls.manager).key
+
+    def get(self, path='/api/groups/delivery-crew/users', key=None):
+        return self.client.get(path, headers={'Authorization': f'Token {key or self.token}'})
+
+    def token_queries(self, key=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.get(key=key)
+        # The token/user join and the role lookup; the view's own queries are not counted.
+        auth_queries = [q['sql'] for q in ctx.captured_queries
+                        if 'authtoken_token' in q['sql'] or q['sql'].startswith('SELECT "auth_user_groups"."group_id"')]
+        return response, auth_queries
+
+    def test_repeated_requests_skip_token_and_role_queries(self):
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 2)
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+        self.assertEqual(authentication.get_token_cache().stats()['hit'], 1)
+
+    def test_unknown_tokens_are_cached(self):
+        bad_key = 'f' * 40
+        self.assertEqual(self.token_queries(bad_key)[0].status_code, 401)
+        response, queries = self.token_queries(bad_key)
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+        self.assertEqual(queries, [])
+        Token.objects.create(user=self.customer, key=bad_key)
+        self.assertEqual(self.get('/api/cart/orders', bad_key).status_code, 200)
+
+    def test_invalidation(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.manager.groups.remove(self.manager_group)
+        self.assertEqual(self.get().status_code, 403)
+        self.manager_group.user_set.add(self.manager)
+        self.assertEqual(self.get().status_code, 200)
+
+        User.objects.filter(pk=self.manager.pk).first().save(update_fields=['last_login'])
+        self.assertEqual(self.token_queries()[1], [])
+        manager = User.objects.get(pk=self.manager.pk)
+        manager.is_active = False
+        manager.save()
+        self.assertEqual(self.get().json(), {'detail': 'User inactive or deleted.'})
+
+        manager.is_active = True
+        manager.save()
+        self.assertEqual(self.get().status_code, 200)
+        Token.objects.filter(key=self.token).delete()
+        self.assertEqual(self.get().json(), {'detail': 'Invalid token.'})
+
+    def test_snapshot_read_before_invalidation_is_not_cached(self):
+        cache = authentication.get_token_cache()
+        generation = cache.generation()
+        user = User.objects.get(pk=self.manager.pk)
+        cache.invalidate_user(user.pk)
+        snapshot = cache.set(self.token, user, frozenset(), generation)
+        self.assertEqual(snapshot.id, user.pk)
+        self.assertIsNone(cache.get(self.token))
+
+    def test_generations_are_bounded(self):
+        cache = authentication.TokenCache(maxsize=2)
+        user = User.objects.get(pk=self.manager.pk)
+        snapshot = cache.set('key', user, frozenset(), cache.generation())
+        cache.invalidate_user(user.pk)
+        for user_id in range(1000, 1010):
+            cache.invalidate_user(user_id)
+        self.assertEqual(len(cache._generations), 2)
+        # The evicted user's snapshot stays retired.
+        cache._entries.set('key', snapshot)
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', user, frozenset(), cache.generation())
+        self.assertIsNotNone(cache.get('key'))
+
+    def test_snapshot_user_loads_other_fields_lazily(self):
+        user, token = authentication.CachedTokenAuthentication().authenticate_credentials(self.token)
+        user, token = authentication.CachedTokenAuthentication().authenticate_credentials(self.token)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.username, 'manager')
+            self.assertTrue(roles.is_manager(user))
+        with self.assertNumQueries(1):
+            self.assertTrue(user.check_password('pass'))
+
+    def test_metrics_hook(self):
+        hook = mock.Mock()
+        with self.settings(LITTLELEMON_TOKEN_CACHE={'METRICS': hook}):
+            authentication.reset_token_cache()
+            self.get()
+            self.get()
+            self.get(key='0' * 40)
+        self.assertEqual([c.args[0] for c in hook.call_args_list], ['miss', 'hit', 'miss'])
+        self.assertAlmostEqual(authentication.get_token_cache().stats()['hit_rate'], 1 / 3)
+
+
+class DatabaseProfileTests(LittlelemonTestCase):
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite profile')
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite profile')
+    def test_journal_mode_is_set_by_migration_only(self):
+        from importlib import import_module
+        from tempfile import TemporaryDirectory
+        from types import SimpleNamespace
+
+        migration = import_module('LittlelemonAPI.migrations.0014_sqlite_journal_mode')
+        with TemporaryDirectory() as directory:
+            wrapper = type(connections['default'])({**connection.settings_dict, 'NAME': f'{directory}/db.sqlite3'},
+                                                   'journal')
+            try:
+                with wrapper.cursor() as cursor:
+                    # Opening a connection leaves the file's journal mode alone.
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'delete')
+                    migration.set_journal_mode(None, SimpleNamespace(connection=wrapper))
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+            finally:
+                wrapper.close()
+
+    @override_settings(LITTLELEMON_READ_REPLICAS=['replica1', 'replica2'])
+    def test_router(self):
+        router = routers.ReadReplicaRouter()
+        self.assertIsNone(router.db_for_read(MenuItem))
+        with routers.replica_reads():
+            self.assertIn(router.db_for_read(MenuItem), ('replica1', 'replica2'))
+            item = MenuItem()
+            item._state.db = 'replica1'
+            self.assertEqual(router.db_for_write(MenuItem, instance=item), 'default')
+        self.assertIsNone(router.db_for_read(MenuItem))
+        self.assertFalse(router.allow_migrate('replica1', 'LittlelemonAPI'))
+
+    def test_read_views_use_replicas_for_get_only(self):
+        seen = []
+
+        def db_for_read(model, **hints):
+            seen.append((model, routers._replica_reads.get()))
+
+        self.login(self.manager)
+        with mock.patch.object(routers.ReadReplicaRouter, 'db_for_read', side_effect=db_for_read):
+            self.client.get('/api/menu-items')
+            self.assertTrue(seen and all(replica for model, replica in seen))
+            seen.clear()
+            self.client.get('/api/cart/menu-items')
+            self.assertTrue(seen and not any(replica for model, replica in seen))
+
+
+class OrderTotalsTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.items = MenuItem.objects.bulk_create(
+            MenuItem(title=f'Item {i}', price=i + 1, featured=False, category=category) for i in range(3)
+        )
+
+    def test_order_item_retarget_migration_refuses_existing_rows(self):
+        from importlib import import_module
+        from types import SimpleNamespace
+        from django.apps import apps
+
+        migration = import_module('LittlelemonAPI.migrations.0005_orderitem_order')
+        schema_editor = SimpleNamespace(connection=connection)
+        migration.check_no_order_items(apps, schema_editor)
+        order = Order.objects.create(user=self.customer, date=date(2024, 1, 1))
+        OrderItem.objects.create(order=order, menuitem=self.items[0], quantity=1, unit_price=1, price=1)
+        with self.assertRaisesMessage(RuntimeError, '1 order item(s) reference users'):
+            migration.check_no_order_items(apps, schema_editor)
+
+    def test_item_writes_maintain_order_totals(self):
+        order = Order.objects.create(user=self.customer, date=date(2024, 1, 1))
+        item = OrderItem.objects.create(order=order, menuitem=self.items[0], quantity=2, unit_price=1, price=2)
+        OrderItem.objects.create(order=order, menuitem=self.items[1], quantity=1, unit_price=2, price=2)
+        item.quantity, item.price = 3, 3
+        item.save()
+        order.refresh_from_db()
+        self.assertEqual((order.total, order.item_count), (Decimal('5.00'), 4))
+
+        other = Order.objects.create(user=self.customer, date=date(2024, 1, 1))
+        item.order = other
+        item.save()
+        item.delete()
+        order.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((order.total, order.item_count), (Decimal('2.00'), 1))
+        self.assertEqual((other.total, other.item_count), (Decimal('0.00'), 0))
+
+    def test_checkout_sets_totals_and_clients_cannot(self):
+        self.login(self.customer)
+        self.client.post('/api/cart/menu-items/batch', [{'menuitem': self.items[1].pk, 'quantity': 3}], format='json')
+        order = self.client.post('/api/cart/orders').data
+        self.assertEqual((order['total'], order['item_count']), ('6.00', 3))
+        response = self.client.patch(f'/api/cart/orders/{order["id"]}', {'total': '0.01'}, format='json')
+        self.assertEqual(response.data['total'], '6.00')
+
+    def test_cart_summary_is_one_query(self):
+        self.login(self.customer)
+        self.assertEqual(self.client.get('/api/cart/summary').data, {'lines': 0, 'quantity': 0, 'total': '0.00'})
+        self.client.post('/api/cart/menu-items/batch', [{'menuitem': self.items[0].pk, 'quantity': 2},
+                                                        {'menuitem': self.items[2].pk, 'quantity': 1}], format='json')
+        self.assertEqual(self.count_queries('/api/cart/summary'), 1)
+        self.assertEqual(self.client.get('/api/cart/summary').data, {'lines': 2, 'quantity': 3, 'total': '5.00'})
+
+    def test_check_order_totals(self):
+        good = Order.objects.create(user=self.customer, date=date(2024, 1, 1))
+        OrderItem.objects.create(order=good, menuitem=self.items[0], quantity=1, unit_price=1, price=1)
+        bad = Order.objects.create(user=self.customer, date=date(2024, 1, 1))
+        OrderItem.objects.bulk_create([OrderItem(order=bad, menuitem=self.items[0], quantity=2, unit_price=1, price=2)])
+        Order.objects.create(user=self.customer, total=9, date=date(2024, 1, 1))
+
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '2 order(s) drifted'):
+            call_command('check_order_totals', batch_size=2, stdout=out)
+        self.assertIn(f'order {bad.pk}: total 0.00 (items: 2.00), item_count 0 (items: 2)', out.getvalue())
+        call_command('check_order_totals', fix=True, stdout=io.StringIO())
+        bad.refresh_from_db()
+        self.assertEqual((bad.total, bad.item_count), (Decimal('2.00'), 2))
+        out = io.StringIO()
+        call_command('check_order_totals', stdout=out)
+        self.assertIn('All order totals match', out.getvalue())
+
+
+class DispatchTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_crew = User.objects.create_user('other-crew', password='pass')
+        cls.other_crew.groups.add(cls.crew_group)
+
+    def make_orders(self, count, day=1):
+        return Order.objects.bulk_create(
+            Order(user=self.customer, date=date(2024, 1, day)) for _ in range(count)
+        )
+
+    def test_claims_oldest_order_first(self):
+        newer = self.make_orders(1, day=2)[0]
+        older = self.make_orders(1)[0]
+        self.login(self.crew)
+        response = self.client.post('/api/dispatch/claim')
+        self.assertEqual((response.status_code, response.data['id']), (200, older.pk))
+        self.assertEqual(response.data['delivery_crew'], self.crew.pk)
+        self.assertEqual(self.client.post('/api/dispatch/claim').data['id'], newer.pk)
+        self.assertEqual(self.client.post('/api/dispatch/claim').status_code, 204)
+
+    def test_skip_locked_path(self):
+        orders = self.make_orders(2)
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', True):
+            self.assertEqual(deliveries.claim_next(self.crew), orders[0].pk)
+            self.assertEqual(deliveries.claim_next(self.other_crew), orders[1].pk)
+            self.assertIsNone(deliveries.claim_next(self.crew))
+        self.assertEqual(deliveries.open_orders(self.other_crew).get().pk, orders[1].pk)
+
+    def test_lost_races_retry_until_the_queue_is_empty(self):
+        taken, free = self.make_orders(2)
+        deliveries.assign([taken.pk], self.other_crew)
+        # The first candidates were claimed by others between the select and the update.
+        candidates = [Order.objects.filter(pk=taken.pk)] * 20 + [deliveries.queue()]
+        with mock.patch.object(deliveries, 'queue', side_effect=candidates):
+            self.assertEqual(deliveries.claim_next(self.crew), free.pk)
+
+    def test_claim_queries_are_constant(self):
+        counts = []
+        for size in (20, 200):
+            self.make_orders(size)
+            with CaptureQueriesContext(connection) as ctx:
+                deliveries.claim_next(self.crew)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_mine_and_delivered(self):
+        mine, theirs = self.make_orders(2)
+        deliveries.assign([mine.pk], self.crew)
+        deliveries.assign([theirs.pk], self.other_crew)
+        self.login(self.crew)
+        self.assertEqual([order['id'] for order in self.client.get('/api/dispatch/mine').data['results']], [mine.pk])
+        self.assertEqual(self.client.post(f'/api/dispatch/orders/{theirs.pk}/delivered').status_code, 404)
+        self.assertEqual(self.client.post(f'/api/dispatch/orders/{mine.pk}/delivered').status_code, 204)
+        self.assertEqual(self.client.get('/api/dispatch/mine').data['results'], [])
+        self.assertEqual(self.client.post(f'/api/dispatch/orders/{mine.pk}/delivered').status_code, 404)
+
+    def test_bulk_assign(self):
+        open_orders = self.make_orders(3)
+        delivered = Order.objects.create(user=self.customer, date=date(2024, 1, 1), status=True)
+        self.login(self.manager)
+        response = self.client.post('/api/dispatch/assign', {
+            'delivery_crew': self.crew.pk, 'orders': [order.pk for order in open_orders] + [delivered.pk, 9999],
+        }, format='json')
+        self.assertEqual(response.data, {'assigned': [order.pk for order in open_orders],
+                                         'skipped': sorted([delivered.pk, 9999])})
+        self.assertEqual(deliveries.open_orders(self.crew).count(), 3)
+        self.assertIsNone(Order.objects.get(pk=delivered.pk).delivery_crew)
+
+        response = self.client.post('/api/dispatch/assign', {
+            'delivery_crew': self.customer.pk, 'orders': [open_orders[0].pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('delivery_crew', response.data)
+
+    def test_bulk_assign_queries_are_constant(self):
+        roles.is_delivery_crew(self.crew)
+        counts = []
+        for size in (1, 50):
+            ids = [order.pk for order in self.make_orders(size)]
+            with CaptureQueriesContext(connection) as ctx:
+                deliveries.assign(ids, self.crew)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_permissions(self):
+        self.login(self.customer)
+        for path in ('/api/dispatch/queue', '/api/dispatch/mine'):
+            self.assertEqual(self.client.get(path).status_code, 403)
+        self.assertEqual(self.client.post('/api/dispatch/claim').status_code, 403)
+        self.login(self.crew)
+        self.assertEqual(self.client.post('/api/dispatch/assign', {}, format='json').status_code, 403)
+        self.assertEqual(self.client.get('/api/dispatch/queue').status_code, 200)
+        self.login(self.manager)
+        self.assertEqual(self.client.get('/api/dispatch/queue').status_code, 200)
+
+
+class DispatchConcurrencyTests(TransactionTestCase):
+    workers = 8
+
+    def setUp(self):
+        roles.clear()
+        crew_group = Group.objects.create(name=roles.DELIVERY_CREW)
+        self.crew = [User.objects.create_user(f'crew-{i}') for i in range(self.workers)]
+        crew_group.user_set.add(*self.crew)
+        customer = User.objects.create_user('customer')
+        self.orders = Order.objects.bulk_create(
+            Order(user=customer, date=date(2024, 1, 1)) for _ in range(60)
+        )
+
+    def tearDown(self):
+        roles.clear()
+
+    def claim_all(self, crew, barrier, claimed):
+        barrier.wait()
+        try:
+            while True:
+                try:
+                    order_id = deliveries.claim_next(crew)
+                except OperationalError:
+                    # The test database is a shared-cache in-memory SQLite database, where concurrent
+                    # writers fail with "table is locked" instead of waiting for busy_timeout.
+                    continue
+                if order_id is None:
+                    return
+                claimed.append((order_id, crew.pk))
+        finally:
+            connection.close()
+
+    def test_parallel_claims_never_assign_an_order_twice(self):
+        barrier = threading.Barrier(self.workers)
+        claimed = []
+        threads = [threading.Thread(target=self.claim_all, args=(crew, barrier, claimed)) for crew in self.crew]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        order_ids = [order_id for order_id, crew_id in claimed]
+        self.assertEqual(len(order_ids), len(set(order_ids)))
+        self.assertEqual(sorted(order_ids), [order.pk for order in self.orders])
+        self.assertEqual(set(claimed), set(Order.objects.values_list('id', 'delivery_crew_id')))
+
+
+class OrderChangeFeedTests(LittlelemonTestCase):
+    def setUp(self):
+        super().setUp()
+        changes.notifier = changes.ChangeNotifier()
+
+    def login(self, user):
+        # The feed is a plain Django view, so it needs real credentials.
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def make_order(self, user=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Order.objects.create(user=user or self.customer, date=date(2024, 1, 1))
+
+    def test_order_writes_are_logged(self):
+        order = self.make_order()
+        deliveries.claim_next(self.crew)
+        deliveries.mark_delivered(self.crew, order.pk)
+        order.refresh_from_db()
+        order.delete()
+        self.assertEqual(list(OrderChange.objects.order_by('id').values_list('kind', 'delivery_crew', 'status')), [
+            ('created', None, False), ('updated', self.crew.pk, False),
+            ('updated', self.crew.pk, True), ('deleted', self.crew.pk, True),
+        ])
+
+    def test_long_poll_returns_visible_deltas_after_cursor(self):
+        self.login(self.customer)
+        cursor = json.loads(self.client.get('/api/cart/orders/changes').content)['cursor']
+        mine = self.make_order()
+        other = self.make_order(self.manager)
+        deliveries.assign([other.pk], self.crew)
+
+        data = json.loads(self.client.get(f'/api/cart/orders/changes?after={cursor}').content)
+        self.assertEqual([(change['order'], change['kind']) for change in data['results']], [(mine.pk, 'created')])
+        self.assertEqual(data['cursor'], data['results'][-1]['id'])
+        self.assertEqual(json.loads(self.client.get(f'/api/cart/orders/changes?after={data["cursor"]}').content),
+                         {'cursor': data['cursor'], 'results': []})
+
+        self.login(self.crew)
+        data = json.loads(self.client.get(f'/api/cart/orders/changes?after={cursor}').content)
+        self.assertEqual([change['order'] for change in data['results']], [other.pk])
+        self.login(self.manager)
+        data = json.loads(self.client.get(f'/api/cart/orders/changes?after={cursor}').content)
+        self.assertEqual(len(data['results']), 3)
+
+    def test_feed_errors(self):
+        self.assertEqual(self.client.get('/api/cart/orders/changes').status_code, 401)
+        self.login(self.customer)
+        self.assertEqual(self.client.get('/api/cart/orders/changes?after=x').status_code, 400)
+
+    def test_event_stream_under_wsgi_polls(self):
+        order = self.make_order()
+        self.login(self.customer)
+        # Never held open under WSGI, even when asked to wait.
+        response = self.client.get('/api/cart/orders/changes?after=0&wait=30', HTTP_ACCEPT='text/event-stream')
+        change = OrderChange.objects.get()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = response.content.decode()
+        self.assertTrue(body.startswith('retry: 2000\nid: 0\n\n'))
+        self.assertIn(f'id: {change.pk}\nevent: order\ndata: {{"id":{change.pk},"order":{order.pk}', body)
+
+    def test_long_poll_waits_for_change_under_asgi(self):
+        token = Token.objects.create(user=self.customer)
+        client = AsyncClient()
+        self.make_order()
+        cursor = OrderChange.objects.latest('id').pk
+
+        async def run():
+            async def change_later():
+                await asyncio.sleep(0.2)
+                return await sync_to_async(self.make_order)()
+
+            poll = client.get(f'/api/cart/orders/changes?after={cursor}&wait=10',
+                              headers={'Authorization': f'Token {token.key}'})
+            start = perf_counter()
+            response, order = await asyncio.gather(poll, change_later())
+            return response, order, perf_counter() - start
+
+        response, order, elapsed = async_to_sync(run)()
+        self.assertLess(elapsed, 5)
+        self.assertEqual([change['order'] for change in json.loads(response.content)['results']], [order.pk])
+
+    def test_event_stream_under_asgi(self):
+        token = Token.objects.create(user=self.customer)
+        client = AsyncClient()
+
+        async def run():
+            response = await client.get('/api/cart/orders/changes', headers={
+                'Authorization': f'Token {token.key}', 'Accept': 'text/event-stream'})
+            chunks = aiter(response.streaming_content)
+            preamble = await anext(chunks)
+            order = await sync_to_async(self.make_order)()
+            event = await asyncio.wait_for(anext(chunks), 5)
+            await chunks.aclose()
+            return preamble, event, order
+
+        preamble, event, order = async_to_sync(run)()
+        self.assertTrue(preamble.startswith(b'retry: '))
+        self.assertIn(b'event: order\ndata: {"id":', event)
+        self.assertIn(b'"order":%d' % order.pk, event)
+
+
+class MetricsTests(LittlelemonTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        Order.objects.bulk_create(Order(user=self.customer, date=date(2024, 1, 1)) for _ in range(3))
+
+    def histogram(self, name, view, method='GET'):
+        return metrics.registry._histograms[(name, (('view', view), ('method', method)))]
+
+    def test_records_requests_per_view(self):
+        self.login(self.customer)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/cart/orders')
+        self.assertEqual(self.histogram('littlelemon_request_duration_seconds', 'OrderView').count, 1)
+        self.assertEqual(self.histogram('littlelemon_db_queries', 'OrderView').sum, len(ctx.captured_queries))
+        self.assertGreater(self.histogram('littlelemon_db_duration_seconds', 'OrderView').sum, 0)
+        self.assertGreater(self.histogram('littlelemon_serializer_duration_seconds', 'OrderView').sum, 0)
+        self.assertEqual(self.histogram('littlelemon_response_size_bytes', 'OrderView').sum, len(response.content))
+
+    def test_serializer_time_of_retrieve_without_patching_drf(self):
+        from rest_framework.serializers import BaseSerializer
+        self.login(self.customer)
+        self.client.get(f'/api/cart/orders/{Order.objects.first().pk}')
+        self.assertGreater(self.histogram('littlelemon_serializer_duration_seconds', 'SingleOrderView').sum, 0)
+        self.assertEqual(BaseSerializer.data.fget.__module__, 'rest_framework.serializers')
+
+    @override_settings(LITTLELEMON_ASYNC_VIEWS=True)
+    def test_records_queries_of_async_views(self):
+        token = Token.objects.create(user=self.customer)
+        response = async_to_sync(AsyncClient().get)('/api/cart/orders',
+                                                    headers={'Authorization': f'Token {token.key}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.histogram('littlelemon_db_queries', 'OrderView').sum, 0)
+
+    def test_metrics_endpoint(self):
+        self.login(self.customer)
+        self.client.get('/api/cart/orders')
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+        self.login(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('# TYPE littlelemon_request_duration_seconds histogram', body)
+        self.assertIn('littlelemon_request_duration_seconds_bucket{view="OrderView",method="GET",le="+Inf"} 1', body)
+        self.assertIn('littlelemon_requests_total{view="OrderView",method="GET",status="200"} 1', body)
+        self.assertIn('littlelemon_token_cache_lookups_total{outcome="hit"}', body)
+
+    @override_settings(LITTLELEMON_METRICS={'SAMPLE_RATE': 0})
+    def test_unsampled_requests_are_not_recorded(self):
+        self.login(self.customer)
+        self.client.get('/api/cart/orders')
+        self.assertEqual(metrics.registry._histograms, {})
+
+    @override_settings(LITTLELEMON_METRICS={'SLOW_REQUEST_SECONDS': 0})
+    def test_slow_requests_are_logged_with_sql(self):
+        self.login(self.customer)
+        with self.assertLogs('littlelemon.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/cart/orders')
+        self.assertIn('GET /api/cart/orders (OrderView) 200', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class SyntheticDataTests(LittlelemonTestCase):
+    counts = dict(categories=2, menu_items=20, managers=1, crew=2, customers=5, cart_rows=12, orders=30,
+                  max_items_per_order=3, days=10, open_days=2)
+
+    def test_generate_data(self):
+        out = io.StringIO()
+        call_command('generate_data', batch_size=7, stdout=out, **self.counts)
+        self.assertIn('Inserted 2 categories, 20 menu items, 8 users, 12 cart rows, 30 orders', out.getvalue())
+        generated = User.objects.filter(username__startswith='synthetic-')
+        self.assertEqual(generated.filter(groups__name=roles.MANAGER).count(), 1)
+        self.assertEqual(generated.filter(groups__name=roles.DELIVERY_CREW).count(), 2)
+        self.assertEqual(Cart.objects.count(), 12)
+        self.assertFalse(Order.objects.filter(status=True, delivery_crew=None).exists())
+        self.assertTrue(User.objects.get(username='synthetic-customer-0').check_password('pass'))
+        out = io.StringIO()
+        call_command('check_order_totals', stdout=out)
+        self.assertIn('All order totals match', out.getvalue())
+
+    def test_same_seed_gives_same_data(self):
+        def orders(prefix):
+            synthetic.generate(synthetic.Counts(**self.counts), seed=3, prefix=prefix)
+            return list(Order.objects.filter(user__username__startswith=prefix)
+                        .order_by('id').values_list('date', 'total', 'item_count', 'status'))
+
+        self.assertEqual(orders('first'), orders('second'))
+
+    def test_generate_data_rejects_orders_without_customers(self):
+        with self.assertRaisesMessage(CommandError, 'at least one customer'):
+            call_command('generate_data', customers=0, stdout=io.StringIO())
+
+
+class BenchmarkBaselineTests(LittlelemonTestCase):
+    baseline = {'meta': {}, 'scenarios': {'endpoints': {
+        'GET /a': {'label': 'GET /a', 'p50_ms': 10.0, 'p95_ms': 20.0, 'req_per_s': 100.0, 'queries': 2.0},
+        'GET /b': {'label': 'GET /b', 'p50_ms': 0.1, 'p95_ms': 0.2, 'req_per_s': 5000.0, 'queries': 1.0},
+    }}}
+
+    def test_compare(self):
+        results = {'endpoints': [
+            {'label': 'GET /a', 'p50_ms': 12.0, 'p95_ms': 30.0, 'req_per_s': 70.0, 'queries': 3.0},
+            # Below the absolute noise floor, however large relatively.
+            {'label': 'GET /b', 'p50_ms': 0.2, 'p95_ms': 0.3, 'req_per_s': 4000.0, 'queries': 1.0},
+            {'label': 'GET /new', 'p50_ms': 99.0},
+        ]}
+        self.assertEqual(benchmarks.compare(self.baseline, results, 0.25), [
+            'endpoints: GET /a: queries 2.00 -> 3.00',
+            'endpoints: GET /a: p95_ms 20.000 -> 30.000',
+            'endpoints: GET /a: req_per_s 100.000 -> 70.000',
+        ])
+        self.assertEqual(benchmarks.compare(self.baseline, {'endpoints': results['endpoints'][1:]}, 0.25), [])
+
+    def test_endpoints_scenario_reaches_every_endpoint(self):
+        rows = benchmarks.endpoints({'iterations': 1, 'rows': 200})
+        paths = {row['label'].split()[1].split('?')[0] for row in rows}
+        from .urls import urlpatterns
+        routes = {'/api/' + str(pattern.pattern).replace('<int:pk>', '<id>') for pattern in urlpatterns}
+        self.assertEqual(routes - paths, set())
+        self.assertTrue(all(row['req_per_s'] > 0 for row in rows))
+
+
+@override_settings(LITTLELEMON_THROTTLING={'RATES': {'catalogue': '2/min', 'cart': {'rate': '60/min', 'burst': 1}}})
+class ThrottlingTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.item = MenuItem.objects.create(title='Item', price=2, featured=False, category=category)
+
+    def test_gcra(self):
+        # One request per 10 s with bursts of 3.
+        tat = None
+        for remaining_slack in (20, 10, 0):
+            allowed, tat, slack, _ = throttling.gcra(tat, 100, 10, 3)
+            self.assertEqual((allowed, slack), (True, remaining_slack))
+        allowed, _, wait, reset_after = throttling.gcra(tat, 100, 10, 3)
+        self.assertEqual((allowed, wait, reset_after), (False, 10, 30))
+        self.assertTrue(throttling.gcra(tat, 110, 10, 3)[0])
+
+    def test_parse_rate(self):
+        self.assertEqual(throttling.parse_rate('30/min'), (30, 60, 30))
+        self.assertEqual(throttling.parse_rate('100/5m'), (100, 300, 100))
+        self.assertEqual(throttling.parse_rate({'rate': '10/hour', 'burst': 2}), (10, 3600, 2))
+
+    def test_scope_limit_and_headers(self):
+        self.login(self.customer)
+        first = self.client.get('/api/menu-items')
+        self.assertEqual((first['RateLimit-Limit'], first['RateLimit-Remaining']), ('2', '1'))
+        self.assertEqual(first['RateLimit-Policy'], '2;w=60;burst=2')
+        self.assertEqual(self.client.get(f'/api/menu-items/{self.item.pk}')['RateLimit-Remaining'], '0')
+        denied = self.client.get('/api/categories')
+        self.assertEqual(denied.status_code, 429)
+        self.assertEqual(denied['Retry-After'], '30')
+        self.assertEqual(denied['RateLimit-Remaining'], '0')
+        # Other scopes and other users have their own buckets; scopes without a rate are not limited.
+        self.assertEqual(self.client.get('/api/cart/summary').status_code, 200)
+        self.assertNotIn('RateLimit-Limit', self.client.get('/api/cart/summary'))
+        self.login(self.manager)
+        self.assertEqual(self.client.get('/api/menu-items').status_code, 200)
+
+    def test_write_scope(self):
+        self.login(self.customer)
+        batch = [{'menuitem': self.item.pk, 'quantity': 1}]
+        self.assertEqual(self.client.post('/api/cart/menu-items/batch', batch, format='json').status_code, 200)
+        self.assertEqual(self.client.post('/api/cart/menu-items', {'menuitem': self.item.pk, 'quantity': 1},
+                                          format='json').status_code, 429)
+        self.assertEqual(self.client.get('/api/cart/menu-items').status_code, 200)
+
+    def test_cache_backend(self):
+        from django.core.cache import cache
+        cache.clear()
+        backend = throttling.CacheThrottleBackend()
+        self.assertEqual(backend.hit('key', 30, 2)[:3], (True, 1, 0))
+        self.assertEqual(backend.hit('key', 30, 2)[:3], (True, 0, 0))
+        allowed, remaining, retry_after, reset_after = backend.hit('key', 30, 2)
+        self.assertEqual((allowed, remaining), (False, 0))
+        self.assertTrue(0 < retry_after == reset_after <= 60)
+        self.assertTrue(backend.hit('other', 30, 2)[0])
+
+    @override_settings(LITTLELEMON_ASYNC_VIEWS=True)
+    def test_async_views_are_throttled(self):
+        token = Token.objects.create(user=self.customer)
+        headers = {'Authorization': f'Token {token.key}'}
+        statuses = [async_to_sync(AsyncClient().get)('/api/menu-items', headers=headers) for _ in range(3)]
+        self.assertEqual([response.status_code for response in statuses], [200, 200, 429])
+        self.assertEqual(statuses[0]['RateLimit-Remaining'], '1')
+        self.assertEqual(statuses[2]['Retry-After'], '30')
+
+
+    @override_settings(LITTLELEMON_ASYNC_VIEWS=True,
+                       LITTLELEMON_CATALOGUE_CACHE={'BACKEND': 'LittlelemonAPI.catalogue.DjangoCatalogueBackend'})
+    def test_async_views_keep_shared_backends_off_the_event_loop(self):
+        from django.core.cache import caches
+        cache = caches['default']
+        cache.clear()
+        catalogue.reset_backend()
+        token = Token.objects.create(user=self.customer)
+        on_loop = []
+        hit, get = throttling.CacheThrottleBackend.hit, type(cache).get
+
+        def spy(method):
+            def wrapper(*args, **kwargs):
+                on_loop.append(asyncio._get_running_loop() is not None)
+                return method(*args, **kwargs)
+            return wrapper
+
+        with self.settings(LITTLELEMON_THROTTLING={'BACKEND': 'LittlelemonAPI.throttling.CacheThrottleBackend',
+                                                   'RATES': {'catalogue': '2/min'}}), \
+                mock.patch.object(throttling.CacheThrottleBackend, 'hit', spy(hit)), \
+                mock.patch.object(type(cache), 'get', spy(get)):
+            response = async_to_sync(AsyncClient().get)('/api/menu-items', headers={'Authorization': f'Token {token.key}'})
+        catalogue.reset_backend()
+        self.assertEqual((response.status_code, response['RateLimit-Remaining']), (200, '1'))
+        self.assertTrue(on_loop)
+        self.assertNotIn(True, on_loop)
+
+class MenuImportTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.mains = Category.objects.create(slug='mains', title='Mains')
+        cls.soup = MenuItem.objects.create(title='Soup', price=5, featured=False, category=cls.mains)
+
+    def import_rows(self, path, body, content_type):
+        response = self.client.post(path, body, content_type=content_type)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_csv_import_upserts_and_reports_bad_rows(self):
+        self.login(self.manager)
+        self.assertEqual(self.import_rows('/api/categories/import', 'slug,title\ndrinks,Drinks\nmains,Main Courses\n',
+                                          'text/csv'), [{'imported': 2, 'failed': 0}])
+        body = ('title,price,featured,category\n'
+                'Soup,6.50,true,mains\n'
+                'Lemonade,3,,drinks\n'
+                'Cake,-1,false,mains\n'
+                'Tea,2,false,desserts\n')
+        with CaptureQueriesContext(connection) as ctx:
+            report = self.import_rows('/api/menu-items/import', body, 'text/csv')
+        self.assertEqual(report, [
+            {'row': 3, 'errors': {'price': ['Ensure this value is greater than or equal to 0.']}},
+            {'row': 4, 'errors': {'category': ['Unknown category "desserts".']}},
+            {'imported': 2, 'failed': 2},
+        ])
+        # The category lookup and one upsert, plus the transaction's savepoint queries.
+        self.assertLessEqual(len(ctx.captured_queries), 4)
+        self.soup.refresh_from_db()
+        self.assertEqual((self.soup.price, self.soup.featured), (Decimal('6.50'), True))
+        lemonade = MenuItem.objects.get(title='Lemonade')
+        self.assertEqual((lemonade.category.slug, lemonade.featured), ('drinks', False))
+        self.assertEqual(Category.objects.get(slug='mains').title, 'Main Courses')
+        # Bulk upserts keep the title search index in sync.
+        results = json.loads(self.client.get('/api/menu-items?search=lemonade').content)['results']
+        self.assertEqual([item['title'] for item in results], ['Lemonade'])
+
+    def test_json_and_ndjson_import(self):
+        self.login(self.manager)
+        rows = [{'title': 'Salad', 'price': '4.00', 'category': 'mains'},
+                {'title': 'Salad', 'price': '4.50', 'category': 'mains'}, 'nope']
+        self.assertEqual(self.import_rows('/api/menu-items/import', json.dumps(rows), 'application/json'), [
+            {'row': 3, 'errors': {'non_field_errors': ['Expected an object.']}},
+            {'imported': 1, 'failed': 1},
+        ])
+        self.assertEqual(MenuItem.objects.get(title='Salad').price, Decimal('4.50'))
+        body = '{"title": "Fries", "price": "2", "category": "mains"}\n\n{"title": \n'
+        report = self.import_rows('/api/menu-items/import', body, 'application/x-ndjson')
+        self.assertEqual(report[0]['row'], 2)
+        self.assertIn('JSON parse error', report[0]['errors']['non_field_errors'][0])
+        self.assertEqual(report[1], {'imported': 1, 'failed': 1})
+
+    def test_undecodable_csv_imports_nothing(self):
+        self.login(self.manager)
+        body = 'slug,title\ndrinks,Drinks\n'.encode() + b'bad,\xff\xfe\n'
+        report = self.import_rows('/api/categories/import', body, 'text/csv')
+        self.assertIn('Unreadable input', report[-1]['detail'])
+        self.assertFalse(Category.objects.filter(slug='drinks').exists())
+
+    def test_rows_are_read_before_the_transaction(self):
+        depth = len(connection.atomic_blocks)
+        seen = []
+
+        def rows():
+            for slug in ('drinks', 'sides'):
+                seen.append(len(connection.atomic_blocks))
+                yield {'slug': slug, 'title': slug.title()}
+
+        report = list(imports.import_rows('categories', rows(), batch_size=1))
+        self.assertEqual(seen, [depth, depth])
+        self.assertEqual(report, [{'imported': 2, 'failed': 0}])
+
+    def test_import_bumps_catalogue_version(self):
+        self.login(self.manager)
+        version = catalogue.get_backend().get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_rows('/api/categories/import', '[{"slug": "drinks", "title": "Drinks"}]', 'application/json')
+        self.assertGreater(catalogue.get_backend().get_version(), version)
+
+    def test_import_permissions(self):
+        self.login(self.customer)
+        self.assertEqual(self.client.post('/api/categories/import', [], format='json').status_code, 403)
+        self.login(self.manager)
+        self.assertEqual(self.client.post('/api/categories/import', {}, format='json').status_code, 400)
+
+    def test_import_command(self):
+        from tempfile import NamedTemporaryFile
+        with NamedTemporaryFile('w', suffix='.csv') as file:
+            file.write('title,price,category\nSoup,7,mains\nBread,x,mains\n')
+            file.flush()
+            out = io.StringIO()
+            call_command('import_menu', 'menu-items', file.name, stdout=out)
+        self.assertIn('"row":2', out.getvalue())
+        self.assertIn('Imported 1 menu items, 1 row(s) failed.', out.getvalue())
+        self.soup.refresh_from_db()
+        self.assertEqual(self.soup.price, Decimal('7.00'))
+
+    def test_price_update(self):
+        drinks = Category.objects.create(slug='drinks', title='Drinks')
+        tea = MenuItem.objects.create(title='Tea', price=Decimal('2.05'), featured=False, category=drinks)
+        self.login(self.manager)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/api/menu-items/prices?category={drinks.pk}', {'percent': '10'}, format='json')
+        self.assertEqual(response.data, {'updated': 1})
+        self.assertEqual(len([query for query in ctx.captured_queries if 'menuitem' in query['sql']]), 1)
+        tea.refresh_from_db()
+        self.soup.refresh_from_db()
+        self.assertEqual((tea.price, self.soup.price), (Decimal('2.26'), Decimal('5.00')))
+        self.assertEqual(self.client.post('/api/menu-items/prices', {'amount': '-3'}, format='json').data,
+                         {'updated': 2})
+        tea.refresh_from_db()
+        self.soup.refresh_from_db()
+        self.assertEqual((tea.price, self.soup.price), (Decimal('0.00'), Decimal('2.00')))
+        self.assertGreater(self.soup.updated_at, tea.updated_at.replace(year=2000))
+        self.assertEqual(self.client.post('/api/menu-items/prices', {'percent': '1', 'amount': '1'},
+                                          format='json').status_code, 400)
+        self.login(self.customer)
+        self.assertEqual(self.client.post('/api/menu-items/prices', {'amount': '1'}, format='json').status_code, 403)
+
+
+class RollupTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        mains = Category.objects.create(slug='mains', title='Mains')
+        cls.soup = MenuItem.objects.create(title='Soup', price=5, featured=False, category=mains)
+        cls.cake = MenuItem.objects.create(title='Cake', price=Decimal('3.50'), featured=False, category=mains)
+
+    def make_order(self, day, *lines, **fields):
+        order = Order.objects.create(user=self.customer, date=date(2024, 1, day), **fields)
+        for menuitem, quantity in lines:
+            OrderItem.objects.create(order=order, menuitem=menuitem, quantity=quantity, unit_price=menuitem.price,
+                                     price=menuitem.price * quantity)
+        return order
+
+    def get(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_writes_mark_days_refreshed_on_read(self):
+        order = self.make_order(1, (self.soup, 2), (self.cake, 1))
+        self.make_order(2, (self.cake, 2))
+        self.assertEqual(rollups.dirty_dates(), [date(2024, 1, 1), date(2024, 1, 2)])
+        self.login(self.manager)
+        self.assertEqual(self.get('/api/analytics/sales'), [
+            {'date': '2024-01-01', 'orders': 1, 'items': 3, 'revenue': '13.50'},
+            {'date': '2024-01-02', 'orders': 1, 'items': 2, 'revenue': '7.00'},
+        ])
+        self.assertEqual(rollups.dirty_dates(), [])
+
+        # Moving an order refreshes the day it left as well as the one it moved to.
+        order.refresh_from_db()
+        order.date = date(2024, 1, 2)
+        order.save()
+        self.assertEqual(self.get('/api/analytics/sales'), [
+            {'date': '2024-01-02', 'orders': 2, 'items': 5, 'revenue': '20.50'},
+        ])
+        order.orderitems.get(menuitem=self.cake).delete()
+        self.assertEqual(self.get('/api/analytics/sales?date_from=2024-01-02')[0]['revenue'], '17.00')
+        order.delete()
+        self.assertEqual(self.get('/api/analytics/menu-items'), [
+            {'menuitem': self.cake.pk, 'title': 'Cake', 'quantity': 2, 'revenue': '7.00'},
+        ])
+
+    def test_deleting_an_order_removes_its_items_with_one_delete(self):
+        order = self.make_order(1, (self.soup, 1), (self.cake, 2))
+        rollups.refresh_dirty()
+        with CaptureQueriesContext(connection) as ctx:
+            order.delete()
+        item_queries = [q['sql'] for q in ctx.captured_queries if '"LittlelemonAPI_orderitem"' in q['sql']]
+        self.assertEqual(len(item_queries), 1)
+        self.assertTrue(item_queries[0].startswith('DELETE'))
+        self.assertEqual(rollups.dirty_dates(), [date(2024, 1, 1)])
+
+    def test_reads_never_touch_orders(self):
+        self.make_order(1, (self.soup, 1))
+        rollups.refresh_dirty()
+        self.login(self.manager)
+        for path in ('/api/analytics/sales', '/api/analytics/menu-items', '/api/analytics/crew'):
+            self.client.get(path)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(path).status_code, 200)
+            for query in ctx.captured_queries:
+                self.assertNotIn('"LittlelemonAPI_order', query['sql'])
+
+    def test_top_menu_items(self):
+        self.make_order(1, (self.soup, 1), (self.cake, 4))
+        self.make_order(2, (self.soup, 2))
+        self.login(self.manager)
+        by_revenue = self.get('/api/analytics/menu-items')
+        self.assertEqual([(row['title'], row['quantity'], row['revenue']) for row in by_revenue],
+                         [('Soup', 3, '15.00'), ('Cake', 4, '14.00')])
+        self.assertEqual([row['title'] for row in self.get('/api/analytics/menu-items?by=quantity&limit=1')],
+                         ['Cake'])
+        self.assertEqual([row['title'] for row in self.get('/api/analytics/menu-items?date_to=2024-01-01')],
+                         ['Cake', 'Soup'])
+        for query in ('by=price', 'limit=0', 'limit=x', 'date_from=soon'):
+            self.assertEqual(self.client.get(f'/api/analytics/menu-items?{query}').status_code, 400)
+
+    def test_crew_deliveries(self):
+        first, second = self.make_order(1), self.make_order(2)
+        deliveries.assign([first.pk, second.pk], self.crew)
+        deliveries.mark_delivered(self.crew, first.pk)
+        self.login(self.manager)
+        self.assertEqual(self.get('/api/analytics/crew'), [
+            {'delivery_crew': self.crew.pk, 'username': 'crew', 'assigned': 2, 'delivered': 1},
+        ])
+        self.assertEqual(self.get('/api/analytics/crew?date_from=2024-01-02')[0]['delivered'], 0)
+
+    def test_permissions(self):
+        for user in (self.customer, self.crew):
+            self.login(user)
+            self.assertEqual(self.client.get('/api/analytics/sales').status_code, 403)
+
+    def test_catch_up_and_verify_commands(self):
+        # Bulk inserts send no signals, so their days are only picked up by the catch-up.
+        Order.objects.bulk_create(Order(user=self.customer, date=date(2024, 1, day), total=2, item_count=1)
+                                  for day in (1, 2, 2))
+        with self.assertRaises(CommandError):
+            call_command('verify_rollups', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('update_rollups', batch_days=1, stdout=out)
+        self.assertIn('Refreshed 2 day(s).', out.getvalue())
+        call_command('verify_rollups', stdout=io.StringIO())
+        self.assertEqual(DailySales.objects.get(date=date(2024, 1, 2)).revenue, Decimal('4.00'))
+
+        # Only days newer than the rollups are caught up, unless rebuilding them all.
+        Order.objects.bulk_create([Order(user=self.customer, date=date(2024, 1, 1), total=1, item_count=1),
+                                   Order(user=self.customer, date=date(2024, 1, 3), total=1, item_count=1)])
+        call_command('update_rollups', stdout=io.StringIO())
+        self.assertTrue(DailySales.objects.filter(date=date(2024, 1, 3)).exists())
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_rollups', stdout=out)
+        self.assertIn('sales 2024-01-01: rollup 1 / 1 / 2.00, orders 2 / 2 / 3', out.getvalue())
+        call_command('verify_rollups', date_from=date(2024, 1, 2), stdout=io.StringIO())
+        call_command('update_rollups', full=True, stdout=io.StringIO())
+        call_command('verify_rollups', stdout=io.StringIO())
+
+    def test_dirty_days_are_not_verified(self):
+        self.make_order(1, (self.soup, 1))
+        out = io.StringIO()
+        call_command('verify_rollups', stdout=out)
+        self.assertIn('1 day(s) marked out of date were not checked', out.getvalue())
+
+
+class LifecycleTests(LittlelemonTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        mains = Category.objects.create(slug='mains', title='Mains')
+        cls.soup = MenuItem.objects.create(title='Soup', price=5, featured=False, category=mains)
+        cls.cake = MenuItem.objects.create(title='Cake', price=Decimal('3.50'), featured=False, category=mains)
+
+    def make_order(self, age, delivered=True, user=None):
+        order = Order.objects.create(user=user or self.customer, date=date.today() - timedelta(days=age),
+                                     status=delivered, delivery_crew=self.crew)
+        for menuitem, quantity in ((self.soup, 2), (self.cake, 1)):
+            OrderItem.objects.create(order=order, menuitem=menuitem, quantity=quantity, unit_price=menuitem.price,
+                                     price=menuitem.price * quantity)
+        return Order.objects.get(pk=order.pk)
+
+    def test_archive_moves_old_delivered_orders(self):
+        old = [self.make_order(100), self.make_order(60)]
+        kept = [self.make_order(100, delivered=False), self.make_order(5)]
+        rollups.refresh_dirty()
+        changes_before = OrderChange.objects.count()
+        out = io.StringIO()
+        call_command('archive_orders', days=30, batch_size=1, stdout=out)
+        self.assertIn('Archived 2 order(s).', out.getvalue())
+        self.assertEqual(sorted(Order.objects.values_list('id', flat=True)), [order.pk for order in kept])
+        self.assertFalse(OrderItem.objects.filter(order__in=[order.pk for order in old]).exists())
+        for order in old:
+            archived = ArchivedOrder.objects.get(pk=order.pk)
+            self.assertEqual((archived.user_id, archived.delivery_crew_id, archived.date, archived.total,
+                              archived.item_count), (order.user_id, order.delivery_crew_id, order.date,
+                                                     Decimal('13.50'), 3))
+            self.assertIsNotNone(archived.archived_at)
+            self.assertEqual(sorted(archived.orderitems.values_list('menuitem', 'quantity', 'price')),
+                             [(self.soup.pk, 2, Decimal('10.00')), (self.cake.pk, 1, Decimal('3.50'))])
+        # Moving orders is not a change of them, and the rollups count archived orders.
+        self.assertEqual(OrderChange.objects.count(), changes_before)
+        self.assertEqual(rollups.dirty_dates(), [])
+        self.assertEqual(rollups.verify(), ([], []))
+        call_command('update_rollups', full=True, stdout=io.StringIO())
+        self.assertEqual(DailySales.objects.get(date=old[0].date).orders, 2)
+
+        call_command('archive_orders', stdout=out)
+        self.assertIn('Archived 0 order(s).', out.getvalue())
+
+    def test_archived_order_endpoints(self):
+        mine = self.make_order(400)
+        theirs = self.make_order(400, user=self.manager)
+        self.assertEqual(sum(lifecycle.archive_orders()), 2)
+        self.login(self.customer)
+        response = self.client.get('/api/cart/orders/archive')
+        self.assertEqual([order['id'] for order in response.data['results']], [mine.pk])
+        self.assertEqual(len(response.data['results'][0]['orderitem']), 2)
+        self.assertEqual(self.client.get(f'/api/cart/orders/archive/{mine.pk}').data['total'], '13.50')
+        self.assertEqual(self.client.get(f'/api/cart/orders/archive/{theirs.pk}').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/cart/orders/{mine.pk}').status_code, 404)
+        self.assertEqual(self.client.delete(f'/api/cart/orders/archive/{mine.pk}').status_code, 405)
+        self.login(self.manager)
+        self.assertEqual(self.client.get('/api/cart/orders/archive?ordering=id').data['count'], 2)
+        self.assertEqual(self.count_queries('/api/cart/orders/archive'), 3)
+
+    def test_archived_order_pages_are_newest_first(self):
+        orders = [self.make_order(age) for age in (500, 300, 400, 300)]
+        self.assertEqual(sum(lifecycle.archive_orders()), 4)
+        self.login(self.customer)
+        expected = [orders[3].pk, orders[1].pk, orders[2].pk, orders[0].pk]
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            response = self.client.get('/api/cart/orders/archive?page_size=2')
+            pages = response.data['results'] + self.client.get(response.data['next']).data['results']
+        self.assertEqual([order['id'] for order in pages], expected)
+
+    def test_carts_expire_when_untouched(self):
+        other = User.objects.create_user('other', password='pass')
+        carts.set_quantities(self.customer, {self.soup.pk: 1})
+        carts.set_quantities(other, {self.soup.pk: 1, self.cake.pk: 2})
+        Cart.objects.update(updated_at=timezone.now() - timedelta(days=40))
+        # Touching one line keeps the customer's whole cart.
+        self.login(self.customer)
+        self.client.post('/api/cart/menu-items', {'menuitem': self.cake.pk, 'quantity': 1}, format='json')
+        out = io.StringIO()
+        call_command('expire_carts', days=30, batch_size=1, stdout=out)
+        self.assertIn('Deleted 2 cart row(s).', out.getvalue())
+        self.assertEqual(sorted(Cart.objects.values_list('user', 'menuitem')),
+                         [(self.customer.pk, self.soup.pk), (self.customer.pk, self.cake.pk)])
+
+        # Upserting an existing line touches it too.
+        Cart.objects.update(updated_at=timezone.now() - timedelta(days=40))
+        carts.set_quantities(self.customer, {self.soup.pk: 3})
+        self.assertEqual(sum(lifecycle.expire_carts(days=30)), 0)
+        Cart.objects.update(updated_at=timezone.now() - timedelta(days=40))
+        self.assertEqual(sum(lifecycle.expire_carts(days=30)), 2)
@@ -0,0 +1,253 @@
+"""
+Rate limiting with the generic cell rate algorithm (GCRA), a token bucket that stores one timestamp
+per client: the theoretical arrival time (TAT) of its next request. A request is allowed when the
+TAT is at most `burst` emission intervals ahead of now, and moves the TAT one interval forward. DRF's
+`SimpleRateThrottle` instead reads, filters and rewrites a list of request timestamps per client.
+
+`GCRAThrottle` is the DRF throttle class. Views pick their scope with `throttle_scope` for reads
+and `throttle_write_scope` for writes, and every throttled response carries `RateLimit-*` headers.
+Rates and the backend are configured in `LITTLELEMON_THROTTLING`:
+
+- `LocalThrottleBackend` keeps the TATs in process, so each worker enforces the limit on its own.
+- `RedisThrottleBackend` runs the algorithm in a Lua script in Redis: one round trip, atomic
+  across workers.
+- `CacheThrottleBackend` works with any Django cache (e.g. Memcached) by counting requests per
+  fixed window of `burst` intervals with `incr`. Up to twice the burst can pass around a window
+  boundary.
+"""
+import math
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic, time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'sec': 1, 'second': 1, 'm': 60, 'min': 60, 'minute': 60, 'h': 3600, 'hour': 3600,
+           'd': 86400, 'day': 86400}
+
+# Scope of views and methods without one of their own.
+DEFAULT_SCOPE = 'default'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# KEYS[1]: the TAT key. ARGV: emission interval and burst tolerance in seconds. Returns whether the
+# request is allowed, then the slack (allowed) or the wait (denied), then the time until the bucket
+# is full again, as strings because Redis truncates Lua numbers to integers.
+GCRA_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+local allow_at = tat + interval - tolerance
+if now < allow_at then
+    return {0, tostring(allow_at - now), tostring(tat - now)}
+end
+redis.call('SET', KEYS[1], tostring(tat + interval), 'PX', math.ceil((tat + interval - now) * 1000))
+return {1, tostring(now - allow_at), tostring(tat + interval - now)}
+"""
+
+
+def get_config():
+    config = getattr(settings, 'LITTLELEMON_THROTTLING', {})
+    return {
+        'ENABLED': config.get('ENABLED', True),
+        'BACKEND': config.get('BACKEND', 'LittlelemonAPI.throttling.LocalThrottleBackend'),
+        'OPTIONS': config.get('OPTIONS', {}),
+        'RATES': config.get('RATES', {}),
+    }
+
+
+def parse_rate(rate):
+    """
+    `'<count>/<period>'` or `{'rate': '<count>/<period>', 'burst': n}` as `(count, period seconds,
+    burst)`. The burst defaults to the count, so a full period's worth may be sent at once.
+    """
+    burst = None
+    if isinstance(rate, dict):
+        rate, burst = rate['rate'], rate.get('burst')
+    count, period = rate.split('/')
+    # The period may have a multiplier, as in '100/5min'.
+    unit = period.lstrip('0123456789')
+    number = period[:len(period) - len(unit)] or '1'
+    return int(count), int(number) * PERIODS[unit], burst or int(count)
+
+
+def gcra(tat, now, interval, burst):
+    """
+    One GCRA step: `(allowed, new TAT, slack or wait, seconds until full)`. The slack is how far the
+    request was from being denied, the wait how long until one would be allowed.
+    """
+    if tat is None or tat < now:
+        tat = now
+    allow_at = tat + interval - interval * burst
+    if now < allow_at:
+        return False, tat, allow_at - now, tat - now
+    return True, tat + interval, now - allow_at, tat + interval - now
+
+
+# Backends return `(allowed, remaining, retry_after, reset_after)` from `hit(key, interval, burst)`,
+# with `retry_after` 0 for allowed requests and `reset_after` the seconds until the bucket is full.
+# `in_process` backends never block, so async views call them on the event loop; the others do
+# network I/O and are called from a worker thread.
+
+# The `LocalThrottleBackend` class keeps the TAT of the `maxsize` most recent clients in process.
+# Evicting a client only forgets requests it made, so a full table never denies anyone wrongly.
+class LocalThrottleBackend:
+    in_process = True
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._tats = OrderedDict()
+        self._lock = Lock()
+
+    def hit(self, key, interval, burst):
+        now = monotonic()
+        with self._lock:
+            allowed, tat, slack, reset_after = gcra(self._tats.get(key), now, interval, burst)
+            if allowed:
+                self._tats[key] = tat
+                self._tats.move_to_end(key)
+                if len(self._tats) > self.maxsize:
+                    self._tats.popitem(last=False)
+        if not allowed:
+            return False, 0, slack, reset_after
+        return True, int(slack / interval), 0, reset_after
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+
+
+# The `RedisThrottleBackend` class runs `GCRA_SCRIPT` on the Redis server of a Django `RedisCache`,
+# with EVALSHA after the first call. The clock is Redis's, so workers need not agree on the time.
+class RedisThrottleBackend:
+    in_process = False
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self._scripts = {}
+
+    def hit(self, key, interval, burst):
+        cache = caches[self.alias]
+        key = cache.make_and_validate_key(key)
+        client = cache._cache.get_client(key, write=True)
+        script = self._scripts.get(id(client))
+        if script is None:
+            script = self._scripts[id(client)] = client.register_script(GCRA_SCRIPT)
+        allowed, slack, reset_after = script(keys=[key], args=[interval, interval * burst])
+        slack, reset_after = float(slack), float(reset_after)
+        if not allowed:
+            return False, 0, slack, reset_after
+        return True, int(slack / interval), 0, reset_after
+
+
+# The `CacheThrottleBackend` class counts requests per window of `burst` intervals with one `incr` on
+# any Django cache; the first request of a window adds the counter instead.
+class CacheThrottleBackend:
+    in_process = False
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    def hit(self, key, interval, burst):
+        cache = caches[self.alias]
+        window = interval * burst
+        now = time()
+        index = int(now // window)
+        key = f'{key}:{index}'
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            if cache.add(key, 1, timeout=math.ceil(window) + 1):
+                count = 1
+            else:
+                count = cache.incr(key)
+        reset_after = (index + 1) * window - now
+        if count > burst:
+            return False, 0, reset_after, reset_after
+        return True, burst - count, 0, reset_after
+
+
+_backend = None
+_rates = None
+
+
+def get_backend():
+    """Return the configured throttle backend, see `LITTLELEMON_THROTTLING` in settings."""
+    global _backend
+    if _backend is None:
+        config = get_config()
+        _backend = import_string(config['BACKEND'])(**config['OPTIONS'])
+    return _backend
+
+
+def get_rates():
+    """Scope -> `(count, period, burst)`; scopes without a rate are not throttled."""
+    global _rates
+    if _rates is None:
+        _rates = {scope: parse_rate(rate) for scope, rate in get_config()['RATES'].items() if rate}
+    return _rates
+
+
+def reset_backend():
+    global _backend, _rates
+    _backend = None
+    _rates = None
+
+
+@receiver(setting_changed, dispatch_uid='littlelemon-throttling')
+def _throttling_changed(setting, **kwargs):
+    if setting == 'LITTLELEMON_THROTTLING':
+        reset_backend()
+
+
+# The `GCRAThrottle` class limits each user, or each client address for anonymous requests, per
+# scope. The scope is the view's `throttle_write_scope` for unsafe methods and its `throttle_scope`
+# otherwise, falling back to `DEFAULT_SCOPE`.
+class GCRAThrottle(BaseThrottle):
+    retry_after = None
+
+    def get_scope(self, request, view):
+        scope = None
+        if request.method not in SAFE_METHODS:
+            scope = getattr(view, 'throttle_write_scope', None)
+        return scope or getattr(view, 'throttle_scope', None) or DEFAULT_SCOPE
+
+    def get_key(self, request, scope):
+        user = request.user
+        ident = f'user:{user.pk}' if user and user.is_authenticated else f'anon:{self.get_ident(request)}'
+        return f'littlelemon:throttle:{scope}:{ident}'
+
+    def allow_request(self, request, view):
+        if not get_config()['ENABLED']:
+            return True
+        scope = self.get_scope(request, view)
+        rate = get_rates().get(scope)
+        if rate is None:
+            return True
+        count, period, burst = rate
+        allowed, remaining, retry_after, reset_after = get_backend().hit(
+            self.get_key(request, scope), period / count, burst)
+        self.retry_after = retry_after
+        headers = getattr(view, 'headers', None)
+        if headers is not None:
+            headers.update({
+                'RateLimit-Limit': str(burst),
+                'RateLimit-Remaining': str(remaining),
+                'RateLimit-Reset': str(math.ceil(reset_after)),
+                'RateLimit-Policy': f'{count};w={period};burst={burst}',
+            })
+        return allowed
+
+    def wait(self):
+        return self.retry_after
@@ -1,17 +1,37 @@
 from django.urls import path
-from . import views
+from . import views, async_views
+from .async_views import read_path
 
 from rest_framework.authtoken.views import obtain_auth_token
 
 urlpatterns = [
-    path('menu-items', views.MenuItemView.as_view()),
+    read_path('menu-items', async_views.MenuItemView),
     path('menu-items/<int:pk>', views.SingleMenuItemView.as_view()),
-    path('categories', views.CategoryListView.as_view()),
+    path('menu-items/import', views.MenuImportView.as_view(kind='menu-items')),
+    path('menu-items/prices', views.PriceUpdateView.as_view()),
+    read_path('categories', async_views.CategoryListView),
     path('categories/<int:pk>', views.SingleCategoryView.as_view()),
-    path('cart/menu-items', views.CartView.as_view()),
-    path('cart/orders', views.OrderView.as_view()),
-    path('cart/orders/<int:pk>', views.SingleOrderView.as_view()),
+    path('categories/import', views.MenuImportView.as_view(kind='categories')),
+    read_path('cart/menu-items', async_views.CartView),
+    path('cart/menu-items/batch', views.CartBatchView.as_view()),
+    path('cart/summary', views.CartSummaryView.as_view()),
+    read_path('cart/orders', async_views.OrderView),
+    read_path('cart/orders/<int:pk>', async_views.SingleOrderView),
+    path('cart/orders/archive', views.ArchivedOrderView.as_view()),
+    path('cart/orders/archive/<int:pk>', views.SingleArchivedOrderView.as_view()),
+    path('cart/orders/export', views.OrderExportView.as_view()),
+    path('cart/orders/changes', async_views.OrderChangeFeedView.as_view()),
+    path('dispatch/queue', views.DispatchQueueView.as_view()),
+    path('dispatch/mine', views.CrewOrdersView.as_view()),
+    path('dispatch/claim', views.DispatchClaimView.as_view()),
+    path('dispatch/assign', views.DispatchAssignView.as_view()),
+    path('dispatch/orders/<int:pk>/delivered', views.DeliveredView.as_view()),
+    path('analytics/sales', views.SalesAnalyticsView.as_view()),
+    path('analytics/menu-items', views.MenuItemAnalyticsView.as_view()),
+    path('analytics/crew', views.CrewAnalyticsView.as_view()),
     path('api-token-auth', obtain_auth_token),
+    path('metrics', views.MetricsView.as_view()),
     path('groups/manager/users', views.ManagerUsersView.as_view()),
     path('groups/delivery-crew/users', views.DeliveryCrewUsersView.as_view()),
-]
\ No newline at end of file
+]
+
@@ -1,4 +1,7 @@
 from django.shortcuts import render, get_object_or_404
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db import IntegrityError
+from django.db.models import Prefetch, Sum
 
 from django.contrib.auth.models import User, Group
 
@@ -7,12 +10,21 @@ from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, BasePermission
-from rest_framework.generics import ListCreateAPIView, ListAPIView, RetrieveUpdateDestroyAPIView, RetrieveAPIView
+from rest_framework.generics import ListCreateAPIView, ListAPIView, RetrieveUpdateDestroyAPIView, RetrieveAPIView, GenericAPIView
 from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
 from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
 
 from .models import *
 from .serializers import *
+from . import roles, catalogue, orders, carts, exports, routers, deliveries, metrics, imports, rollups
+from .conditional import ConditionalGetMixin
+from .pagination import KeysetOrPageNumberPagination
+from .filters import DeclarativeFilterBackend, MENUITEM_FILTERS, ORDER_FILTERS, ROLLUP_FILTERS
+from .exports import NDJSONRenderer, CSVRenderer
+from .renderers import PrometheusRenderer
+from .parsers import FastJSONParser, NDJSONRowParser, CSVRowParser
+from .compiled import CompiledReadMixin
 # Create your views here.
 
 class IsAdminOrManager(BasePermission):
@@ -20,17 +32,70 @@ class IsAdminOrManager(BasePermission):
         if request.user.is_superuser:
             return True
         
-        manager_group = Group.objects.get(name='Manager')
-        if manager_group in request.user.groups.all():
-            return True
-        
-        return False
+        return roles.is_manager(request.user)
+
+class IsDeliveryCrew(BasePermission):
+    def has_permission(self, request, view):
+        return roles.is_delivery_crew(request.user)
+
+# The `ReplicaReadMixin` class runs GET and HEAD requests under `routers.replica_reads()`, so their
+# queries go to a read replica when one is configured.
+class ReplicaReadMixin:
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        with routers.replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+# The `TimedReadMixin` class lists and retrieves like DRF's mixins, but counts the time spent in the
+# serializer's `.data` as serializer time of the sampled request (see metrics.py). The page or
+# queryset is evaluated first, so its queries are not counted as serializer time.
+class TimedReadMixin:
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        objects = list(queryset) if page is None else page
+        with metrics.serializing():
+            data = self.get_serializer(objects, many=True).data
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        with metrics.serializing():
+            data = self.get_serializer(instance).data
+        return Response(data)
+
+# The `CachedCatalogueMixin` class serves list responses from the catalogue cache. Pages are stored
+# as rendered JSON bytes keyed on the menu version, so a hit never touches the ORM or serializers.
+class CachedCatalogueMixin:
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+
+        backend = catalogue.get_backend()
+        key = catalogue.make_key(self.cache_namespace, backend.get_version(), request)
+        body = backend.get(key)
+        if body is None:
+            response = super().list(request, *args, **kwargs)
+            body = renderer.render(response.data, request.accepted_media_type, self.get_renderer_context())
+            backend.set(key, body)
+        response = HttpResponse(body, content_type=request.accepted_media_type)
+        # Lets CompressionMiddleware cache the compressed variants next to the page.
+        response.catalogue_key = key
+        return response
 
 # The `CategoryListView` class in Python defines a view for listing and creating Category objects,
 # with a check to ensure only admin users can add a new category.
-class CategoryListView(ListCreateAPIView):
+class CategoryListView(ReplicaReadMixin, ConditionalGetMixin, CachedCatalogueMixin, CompiledReadMixin, TimedReadMixin, ListCreateAPIView):
+    cache_namespace = 'categories'
     queryset = Category.objects.all().order_by('id')
     serializer_class = CategorySerializer
+    throttle_scope = 'catalogue'
     # permission_classes = [IsAdminUser]
 
     def get_permissions(self):
@@ -38,9 +103,10 @@ class CategoryListView(ListCreateAPIView):
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
-class SingleCategoryView(RetrieveAPIView, RetrieveUpdateDestroyAPIView):
+class SingleCategoryView(ReplicaReadMixin, ConditionalGetMixin, TimedReadMixin, RetrieveAPIView, RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    throttle_scope = 'catalogue'
     
     def get_permissions(self):
         if self.request.method == 'POST' or self.request.method == 'PUT' \
@@ -51,12 +117,15 @@ class SingleCategoryView(RetrieveAPIView, RetrieveUpdateDestroyAPIView):
 # The `MenuItemListView` class extends `ListCreateAPIView` to handle GET and POST requests for menu
 # items, with a custom permission check for admin users before allowing item creation.
 
-class MenuItemView(ListAPIView, ListCreateAPIView):
+class MenuItemView(ReplicaReadMixin, ConditionalGetMixin, CachedCatalogueMixin, CompiledReadMixin, TimedReadMixin, ListAPIView, ListCreateAPIView):
+    cache_namespace = 'menu-items'
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
+    pagination_class = KeysetOrPageNumberPagination
+    keyset_ordering = ('id',)
     ordering_fields = ['price']
-    search_fields = ['title']
-    # throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    query_filters = MENUITEM_FILTERS
+    throttle_scope = 'catalogue'
     def get_permissions(self):
         if self.request.method == 'POST':
             return [IsAdminUser()]
@@ -64,9 +133,10 @@ class MenuItemView(ListAPIView, ListCreateAPIView):
             return [IsAdminOrManager()]
         return [IsAuthenticated()]
     
-class SingleMenuItemView(RetrieveAPIView, RetrieveUpdateDestroyAPIView):
+class SingleMenuItemView(ReplicaReadMixin, ConditionalGetMixin, TimedReadMixin, RetrieveAPIView, RetrieveUpdateDestroyAPIView):
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
+    throttle_scope = 'catalogue'
     def get_permissions(self):
         if self.request.method == 'POST' or self.request.method == 'PUT' \
                 or self.request.method == 'DELETE' or self.request.method == 'PATCH':
@@ -74,73 +144,324 @@ class SingleMenuItemView(RetrieveAPIView, RetrieveUpdateDestroyAPIView):
         return [IsAuthenticated()]
 
 
+# The `MenuImportView` class upserts `kind` rows ('categories' or 'menu-items') from a JSON array,
+# NDJSON or CSV body. The body is read while the report is streamed back as NDJSON: one line per
+# invalid row, then a summary line once the valid rows are written, after the whole body was read.
+class MenuImportView(APIView):
+    permission_classes = [IsAdminOrManager]
+    parser_classes = [FastJSONParser, NDJSONRowParser, CSVRowParser]
+    renderer_classes = [NDJSONRenderer]
+    kind = None
+
+    def post(self, request):
+        rows = request.data
+        if isinstance(rows, dict):
+            raise ValidationError({'non_field_errors': ['Expected a list of rows.']})
+        lines = (exports.dumps(line) for line in imports.import_rows(self.kind, rows))
+        return StreamingHttpResponse(lines, content_type=request.accepted_renderer.media_type)
+
+# The `PriceUpdateView` class changes the price of every menu item matching the menu filters (e.g.
+# `?category=3`) by a percentage or an amount, with one UPDATE.
+class PriceUpdateView(GenericAPIView):
+    permission_classes = [IsAdminOrManager]
+    filter_backends = [DeclarativeFilterBackend]
+    query_filters = MENUITEM_FILTERS
+    queryset = MenuItem.objects.all()
+
+    def post(self, request):
+        serializer = PriceUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        count = imports.update_prices(self.filter_queryset(self.get_queryset()), **serializer.validated_data)
+        return Response({'updated': count})
+
 # The `ManagerUsersView` class is a Django API view that lists and creates users who belong to the
 # 'Manager' group.
-class ManagerUsersView(ListCreateAPIView):
+class ManagerUsersView(TimedReadMixin, ListCreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [IsAdminUser]
     
     def get_queryset(self):
-        managers = Group.objects.get(name='Manager')
-        return User.objects.filter(groups=managers)
+        return User.objects.filter(groups=roles.group_id(roles.MANAGER))
     
     def perform_create(self, serializer):
-        managers = Group.objects.get(name='Manager')
         user = serializer.save()
-        user.groups.add(managers)
+        user.groups.add(roles.group_id(roles.MANAGER))
 
 # This class is a Django REST framework view for managing users belonging to the "Delivery Crew"
 # group.
-class DeliveryCrewUsersView(ListCreateAPIView):
+class DeliveryCrewUsersView(TimedReadMixin, ListCreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [IsAdminOrManager]
     
     def get_queryset(self):
-        delivery_crew = Group.objects.get(name='Delivery Crew')
-        return User.objects.filter(groups=delivery_crew)
+        return User.objects.filter(groups=roles.group_id(roles.DELIVERY_CREW))
     
     def perform_create(self, serializer):
-        delivery_crew = Group.objects.get(name='Delivery Crew')
         user = serializer.save()
-        user.groups.add(delivery_crew)
+        user.groups.add(roles.group_id(roles.DELIVERY_CREW))
 
-class CartView(ListCreateAPIView):
+class CartView(CompiledReadMixin, TimedReadMixin, ListCreateAPIView):
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
+    throttle_write_scope = 'cart'
     
     def get_queryset(self):
         user = self.request.user
-        return Cart.objects.filter(user=user)
+        return Cart.objects.filter(user=user).select_related('menuitem')
 
     def perform_create(self, serializer):
-        menuitem_id = self.request.data.get('menuitem')
-        quantity = self.request.data.get('quantity')
-        unit_price = MenuItem.objects.get(pk=menuitem_id).price
-        quantity = int(quantity)
-        price = quantity * unit_price
-        serializer.save(user=self.request.user, price=price, unit_price=unit_price)
+        # Adding an item that is already in the cart updates its quantity.
+        user = self.request.user
+        menuitem = serializer.validated_data['menuitem']
+        quantity = serializer.validated_data['quantity']
+        if quantity < 1:
+            raise ValidationError({'quantity': ['Ensure this value is greater than or equal to 1.']})
+        carts.set_quantities(user, {menuitem.pk: quantity})
+        serializer.instance = self.get_queryset().filter(menuitem=menuitem).first()
 
     def delete(self, request):
         user = self.request.user
         Cart.objects.filter(user=user).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
     
-class OrderView(ListCreateAPIView):
-    serializer_class = OrderSerializer
+# The `CartBatchView` class applies a list of `{menuitem, quantity}` entries to the cart in one
+# request (quantity 0 removes the item) and returns the updated cart.
+class CartBatchView(APIView):
     permission_classes = [IsAuthenticated]
-    
+    throttle_write_scope = 'cart'
+
+    def post(self, request):
+        serializer = CartItemInputSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        # Later entries for the same menu item win.
+        quantities = {entry['menuitem']: entry['quantity'] for entry in serializer.validated_data}
+        carts.set_quantities(request.user, quantities)
+        cart = Cart.objects.filter(user=request.user).select_related('menuitem').order_by('id')
+        return Response(CartSerializer(cart, many=True).data)
+
+# The `CartSummaryView` class returns the number of lines, the summed quantity and the total of the
+# user's cart without loading its rows.
+class CartSummaryView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(CartSummarySerializer(carts.summary(request.user)).data)
+
+# The `OrderQuerysetMixin` class scopes orders to the requesting user (managers see every order)
+# and prefetches the order items in one extra query, whatever the page size. Archive views swap in
+# the archive tables with `order_model` and `item_model`.
+class OrderQuerysetMixin:
+    order_model = Order
+    item_model = OrderItem
+
     def get_queryset(self):
         user = self.request.user
-        if user.groups.filter(name='Manager').exists():
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+        queryset = self.order_model.objects.prefetch_related(
+            Prefetch('orderitems', queryset=self.item_model.objects.order_by('id'))
+        )
+        if roles.is_manager(user):
+            return queryset
+        return queryset.filter(user=user)
 
-class SingleOrderView(RetrieveAPIView, RetrieveUpdateDestroyAPIView):
+# The `OrderView` class lists the user's orders. POST checks the cart out into a new order; an
+# `Idempotency-Key` header makes retries and double submits return the same order.
+class OrderView(ReplicaReadMixin, OrderQuerysetMixin, TimedReadMixin, ListCreateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
-    
+    pagination_class = KeysetOrPageNumberPagination
+    keyset_ordering = ('-date', '-id')
+    query_filters = ORDER_FILTERS
+    throttle_write_scope = 'orders'
+
+    def create(self, request, *args, **kwargs):
+        user = request.user
+        key = request.headers.get('Idempotency-Key')
+        max_length = Order._meta.get_field('idempotency_key').max_length
+        if key and len(key) > max_length:
+            raise ValidationError({'Idempotency-Key': [f'Ensure this value has at most {max_length} characters.']})
+        if key:
+            existing = self.get_queryset().filter(user=user, idempotency_key=key).first()
+            if existing is not None:
+                return Response(self.get_serializer(existing).data, status=status.HTTP_200_OK)
+
+        try:
+            order = orders.checkout(user, idempotency_key=key)
+        except IntegrityError:
+            # A concurrent request with the same key created the order first.
+            existing = self.get_queryset().get(user=user, idempotency_key=key)
+            return Response(self.get_serializer(existing).data, status=status.HTTP_200_OK)
+        if order is None:
+            # A concurrent request with the same key may have checked the cart out while this one
+            # waited for the cart lock.
+            existing = key and self.get_queryset().filter(user=user, idempotency_key=key).first()
+            if existing:
+                return Response(self.get_serializer(existing).data, status=status.HTTP_200_OK)
+            return Response({'detail': 'Your cart is empty.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(order).data, status=status.HTTP_201_CREATED)
+
+class SingleOrderView(ReplicaReadMixin, OrderQuerysetMixin, TimedReadMixin, RetrieveAPIView, RetrieveUpdateDestroyAPIView):
+    serializer_class = OrderSerializer
+    permission_classes = [IsAuthenticated]
+
+# The `ArchivedOrderView` class lists the user's archived orders (see lifecycle.py), newest first,
+# with the same filters and pagination as the live order list.
+class ArchivedOrderView(ReplicaReadMixin, OrderQuerysetMixin, TimedReadMixin, ListAPIView):
+    serializer_class = ArchivedOrderSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetOrPageNumberPagination
+    keyset_ordering = ('-date', '-id')
+    query_filters = ORDER_FILTERS
+    order_model = ArchivedOrder
+    item_model = ArchivedOrderItem
+
     def get_queryset(self):
-        user = self.request.user
-        if user.groups.filter(name='Manager').exists():
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
\ No newline at end of file
+        # Page numbers then walk the same order as cursors.
+        return super().get_queryset().order_by(*self.keyset_ordering)
+
+class SingleArchivedOrderView(ReplicaReadMixin, OrderQuerysetMixin, TimedReadMixin, RetrieveAPIView):
+    serializer_class = ArchivedOrderSerializer
+    permission_classes = [IsAuthenticated]
+    order_model = ArchivedOrder
+    item_model = ArchivedOrderItem
+
+# The `OrderExportView` class streams the order history to managers as NDJSON or CSV
+# (`?format=ndjson|csv`), optionally limited with `date_from`/`date_to`. Rows are read in chunks
+# and written as they are produced, so memory stays flat whatever the size of the table.
+class OrderExportView(GenericAPIView):
+    permission_classes = [IsAdminOrManager]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    filter_backends = [DeclarativeFilterBackend]
+    query_filters = ORDER_FILTERS
+    queryset = Order.objects.order_by('id')
+    throttle_scope = 'export'
+
+    def get(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        if request.accepted_renderer.format == 'csv':
+            lines, filename = exports.csv_lines(queryset), 'orders.csv'
+        else:
+            lines, filename = exports.ndjson_lines(queryset), 'orders.ndjson'
+        response = StreamingHttpResponse(lines, content_type=request.accepted_renderer.media_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+# The `DispatchQueueView` class lists the unassigned open orders, oldest first, to managers and the
+# delivery crew.
+class DispatchQueueView(TimedReadMixin, ListAPIView):
+    serializer_class = OrderSerializer
+    permission_classes = [IsAdminOrManager | IsDeliveryCrew]
+    pagination_class = KeysetOrPageNumberPagination
+    keyset_ordering = ('date', 'id')
+
+    def get_queryset(self):
+        return deliveries.with_items(deliveries.queue())
+
+# The `CrewOrdersView` class lists the requesting crew member's open orders, oldest first.
+class CrewOrdersView(TimedReadMixin, ListAPIView):
+    serializer_class = OrderSerializer
+    permission_classes = [IsDeliveryCrew]
+    pagination_class = KeysetOrPageNumberPagination
+    keyset_ordering = ('date', 'id')
+
+    def get_queryset(self):
+        return deliveries.with_items(deliveries.open_orders(self.request.user))
+
+# The `DispatchClaimView` class assigns the oldest unassigned order to the requesting crew member and
+# returns it, or 204 when the queue is empty. Concurrent claims never return the same order.
+class DispatchClaimView(APIView):
+    permission_classes = [IsDeliveryCrew]
+    throttle_write_scope = 'dispatch'
+
+    def post(self, request):
+        order_id = deliveries.claim_next(request.user)
+        if order_id is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        order = deliveries.with_items(Order.objects.filter(pk=order_id)).get()
+        return Response(OrderSerializer(order).data)
+
+# The `DispatchAssignView` class lets managers hand a list of open orders to a crew member in one
+# request. Orders that are delivered or do not exist are reported back as skipped.
+class DispatchAssignView(APIView):
+    permission_classes = [IsAdminOrManager]
+    throttle_write_scope = 'dispatch'
+
+    def post(self, request):
+        serializer = DispatchAssignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order_ids = list(dict.fromkeys(serializer.validated_data['orders']))
+        assigned = deliveries.assign(order_ids, serializer.validated_data['delivery_crew'])
+        skipped = sorted(set(order_ids) - set(assigned))
+        return Response({'assigned': sorted(assigned), 'skipped': skipped})
+
+# The `DeliveredView` class lets a crew member mark one of their open orders as delivered.
+class DeliveredView(APIView):
+    permission_classes = [IsDeliveryCrew]
+    throttle_write_scope = 'dispatch'
+
+    def post(self, request, pk):
+        if not deliveries.mark_delivered(request.user, pk):
+            return Response({'detail': 'No open order of yours matches the given query.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+# The `AnalyticsMixin` class serves manager reports from the daily rollups (see rollups.py) for the
+# days between `?date_from` and `?date_to`, never from the order tables. Days marked out of date are
+# recomputed first when `LITTLELEMON_ROLLUPS['REFRESH_ON_READ']` is set.
+class AnalyticsMixin:
+    permission_classes = [IsAdminOrManager]
+    filter_backends = [DeclarativeFilterBackend]
+    query_filters = ROLLUP_FILTERS
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        if rollups.get_config()['REFRESH_ON_READ']:
+            rollups.refresh_dirty()
+        return super().list(request, *args, **kwargs)
+
+# The `SalesAnalyticsView` class lists the orders, items sold and revenue per day.
+class SalesAnalyticsView(AnalyticsMixin, TimedReadMixin, ListAPIView):
+    serializer_class = DailySalesSerializer
+    queryset = DailySales.objects.order_by('date')
+
+# The `MenuItemAnalyticsView` class lists the best selling menu items, by revenue or with `?by=quantity`
+# by quantity, `?limit` of them.
+class MenuItemAnalyticsView(AnalyticsMixin, TimedReadMixin, ListAPIView):
+    serializer_class = MenuItemSalesSerializer
+    queryset = DailyMenuItemSales.objects.all()
+
+    def get_limit(self):
+        value = self.request.query_params.get('limit')
+        if value in (None, ''):
+            return rollups.get_config()['TOP_ITEMS']
+        if not value.isdigit() or not 0 < int(value) <= 1000:
+            raise ValidationError({'limit': [f'Invalid value "{value}".']})
+        return int(value)
+
+    def filter_queryset(self, queryset):
+        by = self.request.query_params.get('by') or 'revenue'
+        if by not in ('revenue', 'quantity'):
+            raise ValidationError({'by': [f'Invalid value "{by}".']})
+        limit = self.get_limit()
+        return super().filter_queryset(queryset).values('menuitem', 'menuitem__title') \
+            .annotate(quantity=Sum('quantity'), revenue=rollups.revenue('revenue')) \
+            .order_by(f'-{by}', 'menuitem')[:limit]
+
+# The `CrewAnalyticsView` class lists the orders assigned to and delivered by each delivery crew
+# member, most deliveries first.
+class CrewAnalyticsView(AnalyticsMixin, TimedReadMixin, ListAPIView):
+    serializer_class = CrewDeliveriesSerializer
+    queryset = DailyCrewDeliveries.objects.all()
+
+    def filter_queryset(self, queryset):
+        return super().filter_queryset(queryset).values('delivery_crew', 'delivery_crew__username') \
+            .annotate(assigned=Sum('assigned'), delivered=Sum('delivered')) \
+            .order_by('-delivered', 'delivery_crew')
+
+# The `MetricsView` class exposes the request metrics of this process to Prometheus. Scrapers
+# authenticate with an admin user's token.
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request):
+        return Response(metrics.render())